@@ -4,8 +4,8 @@ from typing import Type
 
 
 def populate_data_container_from_series(df: Type[pd.Series]):
-    data_container = exoboot.Exo.DataContainerWithFSRs()
+    data_container = exoboot.Exo.DataContainer(do_include_FSRs=True)
     for key, value in df.items():
-        if hasattr(df, key):
+        if key in data_container.field_names:
             setattr(data_container, key, value)
     return data_container
@@ -23,7 +23,7 @@ for i, filename in enumerate(["20210617_2351_sync6_LEFT.csv"]):
     mydatalist = []
     for idx, row in df.iterrows():
         data = analysis_util.populate_data_container_from_series(row)
-        mydatalist.append(data.__dict__)
+        mydatalist.append(data.as_dict())
         did_slip = slip_detector.detect()
         if did_slip:
             print('slipped!')
@@ -0,0 +1,410 @@
+'''Microbenchmarks for code that runs every tick of the main loop.
+
+These do not require an exo to be connected. Run all of them, or select some by name:
+    python benchmarks.py
+    python benchmarks.py logging
+'''
+import argparse
+import collections
+import copy
+import csv
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy import interpolate, signal
+
+import constants
+import data_logger
+import filters
+import util
+
+
+def time_per_call(function, num_calls: int = 20000) -> float:
+    '''Returns the average time (us) per call of function(), which takes no arguments.'''
+    function()  # Warm up
+    t0 = time.perf_counter()
+    for _ in range(num_calls):
+        function()
+    return 1e6*(time.perf_counter() - t0)/num_calls
+
+
+def print_result(description: str, microseconds: float):
+    print('%-*s %8.2f us' % (60, description, microseconds))
+
+
+def get_example_row() -> dict:
+    '''A row like the exo DataContainer with FSRs and gen_vars, used for logging benchmarks.'''
+    row = {'state_time': 1234.567, 'loop_time': 12.345678, 'accel_x': 0.0123,
+           'accel_y': -0.9876, 'accel_z': 0.0456, 'gyro_x': 12.3456, 'gyro_y': -4.5678,
+           'gyro_z': 123.456, 'motor_angle': -123456, 'motor_velocity': 1234,
+           'motor_current': 4321, 'ankle_angle': 12.3456789, 'ankle_velocity': 45.678,
+           'ankle_torque_from_current': 8.7654321, 'did_heel_strike': False,
+           'gait_phase': 0.4567, 'did_toe_off': False, 'commanded_current': 5000,
+           'commanded_position': None, 'commanded_torque': 10.5, 'slack': 321,
+           'temperature': 35, 'heel_fsr': True, 'toe_fsr': False,
+           'gen_var1': None, 'gen_var2': 0.5, 'gen_var3': None}
+    return row
+
+
+def bench_logging():
+    row = get_example_row()
+    field_names = list(row.keys())
+    field_kinds = ['bool' if isinstance(value, bool) else 'int' if isinstance(value, int)
+                   else 'float' for value in row.values()]
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, 'bench.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=field_names)
+            writer.writeheader()
+            print_result('csv.DictWriter.writerow (per tick)',
+                         time_per_call(lambda: writer.writerow(row)))
+        logger = data_logger.RingBufferLogger(
+            filename=os.path.join(folder, 'bench.bin'),
+            field_names=field_names, field_kinds=field_kinds)
+        print_result('RingBufferLogger.append (per tick)',
+                     time_per_call(lambda: logger.append(row.values()), num_calls=4000))
+        logger.close()
+
+
+def bench_transmission_ratio():
+    TR_spline = interpolate.PchipInterpolator(constants.ANKLE_PTS, constants.TR_PTS)
+    TR_table = util.LookupTable(function=TR_spline,
+                                x_min=constants.MIN_ANKLE_ANGLE,
+                                x_max=constants.MAX_ANKLE_ANGLE,
+                                step=constants.TR_TABLE_STEP)
+    ankle_angle = 23.456
+    print_result('PchipInterpolator, scalar',
+                 time_per_call(lambda: TR_spline(ankle_angle)))
+    print_result('LookupTable, scalar',
+                 time_per_call(lambda: TR_table(ankle_angle), num_calls=200000))
+    ankle_angles = np.linspace(constants.MIN_ANKLE_ANGLE, constants.MAX_ANKLE_ANGLE, 1000)
+    print_result('PchipInterpolator, 1000 angles',
+                 time_per_call(lambda: TR_spline(ankle_angles), num_calls=2000))
+    print_result('LookupTable.lookup_array, 1000 angles',
+                 time_per_call(lambda: TR_table.lookup_array(ankle_angles), num_calls=2000))
+    max_error = np.max(np.abs(TR_table.lookup_array(ankle_angles) - TR_spline(ankle_angles)))
+    print('Max abs error of table vs. pchip: %.2e' % max_error)
+
+
+def bench_ankle_to_motor_angle():
+    polynomial = constants.RIGHT_ANKLE_TO_MOTOR
+    table = util.LookupTable(function=np.poly1d(polynomial),
+                             x_min=constants.MIN_ANKLE_ANGLE,
+                             x_max=constants.MAX_ANKLE_ANGLE,
+                             step=constants.ANKLE_TO_MOTOR_TABLE_STEP)
+    ankle_angle = 23.456
+    motor_offset = 1234
+    print_result('int(np.polyval(...) + offset)',
+                 time_per_call(lambda: int(np.polyval(polynomial, ankle_angle) + motor_offset)))
+    print_result('int(LookupTable(...) + offset)',
+                 time_per_call(lambda: int(table(ankle_angle) + motor_offset), num_calls=200000))
+    cache = {ankle_angle: int(table(ankle_angle) + motor_offset)}
+    print_result('memoized setpoint (dict lookup)',
+                 time_per_call(lambda: cache[ankle_angle], num_calls=200000))
+
+
+def bench_butterworth():
+    for N, Wn in [(1, 0.08), (2, 0.03), (4, 0.1)]:
+        sos = signal.butter(N=N, Wn=Wn, output='sos')
+        state = {'zi': signal.sosfilt_zi(sos)}
+
+        def sosfilt_one_sample():
+            filtered_val, state['zi'] = signal.sosfilt(sos=sos, x=[0.5], zi=state['zi'])
+            return filtered_val[0]
+        biquad_filter = filters.Butterworth(N=N, Wn=Wn)
+        print_result('N=%d: signal.sosfilt, one sample' % N,
+                     time_per_call(sosfilt_one_sample))
+        print_result('N=%d: Butterworth.filter (biquads)' % N,
+                     time_per_call(lambda: biquad_filter.filter(0.5), num_calls=200000))
+
+
+def bench_filter_bank():
+    for num_channels in [3, 6, 24]:
+        new_vals = [0.5]*num_channels
+        filter_list = [filters.Butterworth(N=2, Wn=0.01, btype='high')
+                       for _ in range(num_channels)]
+        filter_bank = filters.FilterBank(num_channels=num_channels, N=2, Wn=0.01, btype='high')
+        print_result('%d channels: one Butterworth per channel' % num_channels,
+                     time_per_call(lambda: [my_filter.filter(new_val) for my_filter, new_val
+                                            in zip(filter_list, new_vals)]))
+        print_result('%d channels: FilterBank' % num_channels,
+                     time_per_call(lambda: filter_bank.filter(new_vals)))
+
+
+def bench_moving_filters():
+    for window_size in [10, 100]:
+        old_deque = collections.deque([0.5]*window_size, maxlen=window_size)
+
+        def deque_mean(new_val):
+            old_deque.append(new_val)
+            return np.mean(old_deque)
+        moving_average = filters.MovingAverage(window_size=window_size)
+        moving_median = filters.MovingMedian(window_size=window_size)
+        print_result('window=%d: np.mean(deque)' % window_size,
+                     time_per_call(lambda: deque_mean(np.random.rand())))
+        print_result('window=%d: MovingAverage (running sum)' % window_size,
+                     time_per_call(lambda: moving_average.filter(np.random.rand())))
+        print_result('window=%d: np.median(deque)' % window_size,
+                     time_per_call(lambda: np.median(old_deque)))
+        print_result('window=%d: MovingMedian (two heaps)' % window_size,
+                     time_per_call(lambda: moving_median.filter(np.random.rand())))
+
+
+def bench_stage_profiler():
+    stage_names = ['params', 'read_data', 'detect', 'step', 'write_data']
+    profiler = util.StageProfiler(stage_names=stage_names)
+
+    def profile_one_tick():
+        profiler.start_tick()
+        for stage_name in stage_names:
+            profiler.end_stage(stage_name)
+        profiler.end_tick(loop_time=0)
+    print_result('StageProfiler, 5 stages (per tick)', time_per_call(profile_one_tick))
+
+
+def bench_simulated_loop():
+    '''Runs the full loop (no logging) on simulated exos, as fast as possible.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import config_util
+    import control_muxer
+    import exoboot
+    config = config_util.ConfigurableConstants(DO_SIMULATE_EXOS=True)
+    exoboot.use_simulated_flexsea()
+    exo_list = []
+    for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+        dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=config.ACTPACK_FREQ)
+        exo = exoboot.Exo(dev_id=dev_id, max_allowable_current=config.MAX_ALLOWABLE_CURRENT)
+        # Skips standing calibration (and its prompt), since the true offset is known
+        exo.motor_offset = exoboot.fxs.actpacks[dev_id].motor_offset
+        exo.has_calibrated = True
+        exo_list.append(exo)
+    gait_state_estimator_list, state_machine_list = control_muxer.get_gse_and_sm_lists(
+        exo_list=exo_list, config=config)
+
+    def run_one_tick():
+        for exo in exo_list:
+            exo.read_data()
+        for gait_state_estimator in gait_state_estimator_list:
+            gait_state_estimator.detect()
+        for state_machine in state_machine_list:
+            state_machine.step(read_only=False)
+    microseconds = time_per_call(run_one_tick, num_calls=100000)
+    print_result('Simulated loop, 2 exos (per tick)', microseconds)
+    print('Max loop freq: %.0f Hz' % (1e6/microseconds))
+    for exo in exo_list:
+        exo.print_serial_stats()
+
+
+def bench_batch_detection():
+    '''Heel strike, gait phase, and toe off detection over 10 minutes of 200 Hz data.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import exoboot
+    import gait_state_estimators
+    times = 1000 + np.arange(0, 600, 0.005)
+    gyro_z = 200*np.sin(2*np.pi*times/1.1)**9 + 5*np.random.randn(len(times))
+    clock = util.VirtualClock()
+    util.set_time_source(clock)
+    try:
+        data = exoboot.Exo.DataContainer()
+        gait_state_estimator = gait_state_estimators.GaitStateEstimator(
+            data_container=data,
+            heel_strike_detector=gait_state_estimators.GyroHeelStrikeDetector(
+                height=100, gyro_filter=filters.Butterworth(N=2, Wn=10, fs=200), delay=0.02),
+            gait_phase_estimator=gait_state_estimators.StrideAverageGaitPhaseEstimator(),
+            toe_off_detector=gait_state_estimators.GaitPhaseBasedToeOffDetector(
+                fraction_of_gait=0.6))
+        t0 = time.perf_counter()
+        for time_now, gyro_value in zip(times.tolist(), gyro_z.tolist()):
+            clock.set_time(time_now)
+            data.gyro_z = gyro_value
+            gait_state_estimator.detect()
+        streaming_time = time.perf_counter() - t0
+    finally:
+        util.set_time_source()
+    t0 = time.perf_counter()
+    gait_state_estimators.detect_gait_events_batch(
+        gyro_z=gyro_z, times=times, height=100,
+        gyro_filter=filters.Butterworth(N=2, Wn=10, fs=200), delay=0.02)
+    batch_time = time.perf_counter() - t0
+    print_result('Streaming detectors (per sample)', 1e6*streaming_time/len(times))
+    print_result('detect_gait_events_batch (per sample)', 1e6*batch_time/len(times))
+
+
+def bench_jetson_messages():
+    '''Packing a Jetson message for one side, and parsing a response, in both protocols.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import exoboot
+    import ml_util
+    data = exoboot.Exo.DataContainer()
+    (data.accel_x, data.accel_y, data.accel_z, data.gyro_x, data.gyro_y, data.gyro_z,
+     data.ankle_angle, data.ankle_velocity) = np.random.randn(8).tolist()
+    text_interface = ml_util.JetsonInterface(do_set_up_server=False)
+    binary_interface = ml_util.JetsonInterface(do_set_up_server=False,
+                                               use_binary_protocol=True)
+    text_response = '!0,0.53125,1.00000'
+    binary_response = ml_util.pack_response(side=0, seq=1, send_time=1.0, gait_phase=0.53125,
+                                            is_stance=1.0)
+    print('Message sizes (bytes): text: %d, binary: %d. Response sizes: text: %d, binary: %d' % (
+        len(text_interface.package_message(side=constants.Side.LEFT, data=data)),
+        len(binary_interface.package_message(side=constants.Side.LEFT, data=data)),
+        len(text_response), len(binary_response)))
+    print_result('Text: package_message', time_per_call(
+        lambda: text_interface.package_message(side=constants.Side.LEFT, data=data)))
+    print_result('Binary: package_message', time_per_call(
+        lambda: binary_interface.package_message(side=constants.Side.LEFT, data=data)))
+    print_result('Text: parse', time_per_call(lambda: text_interface.parse(text_response)))
+    print_result('Binary: parse_binary', time_per_call(
+        lambda: binary_interface.parse_binary(binary_response)))
+    print_result('get_most_recent_gait_phase (latest slot)', time_per_call(
+        lambda: binary_interface.get_most_recent_gait_phase(side=constants.Side.LEFT)))
+
+
+def bench_jetson_loopback():
+    '''Round trips to jetson_server.py on loopback, through the receiver thread.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import threading
+    import exoboot
+    import jetson_server
+    import ml_util
+    for use_binary_protocol in [False, True]:
+        server = jetson_server.JetsonServer(model=jetson_server.GyroPeakModel(), recv_port=0,
+                                            use_binary_protocol=use_binary_protocol)
+        quit_event = threading.Event()
+        server_thread = threading.Thread(target=server.run, kwargs={
+            'quit_event': quit_event, 'do_accept_new_clients': False}, daemon=True)
+        server_thread.start()
+        jetson_interface = ml_util.JetsonInterface(
+            server_ip='127.0.0.1', recv_port=server.server_tcp.RECV_PORT,
+            use_binary_protocol=use_binary_protocol)
+        jetson_interface.start_receiver_thread()
+        data = exoboot.Exo.DataContainer()
+        round_trip_times = []
+        for _ in range(2000):
+            jetson_interface.latest_predictions[0] = None
+            t0 = time.perf_counter()
+            jetson_interface.package_and_send_message(side=constants.Side.LEFT,
+                                                      data_container=data)
+            while jetson_interface.latest_predictions[0] is None:
+                time.sleep(0.00001)
+            round_trip_times.append(time.perf_counter() - t0)
+        jetson_interface.receiver_thread.quit_event.set()
+        jetson_interface.receiver_thread.join()
+        jetson_interface.clienttcp.close()
+        server_thread.join()
+        protocol = 'Binary' if use_binary_protocol else 'Text'
+        print_result('%s: median round trip' % protocol, 1e6*np.median(round_trip_times))
+        print_result('%s: p99 round trip' % protocol,
+                     1e6*np.percentile(round_trip_times, 99))
+
+
+def bench_local_model():
+    '''A gait phase MLP (20 samples x 8 features -> 64 -> 32 -> 2) run on this machine.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import exoboot
+    import ml_util
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'mlp.npz')
+        ml_util.save_mlp(filename=filename,
+                         weights=[np.random.randn(160, 64), np.random.randn(64, 32),
+                                  np.random.randn(32, 2)],
+                         biases=[np.random.randn(64), np.random.randn(32), np.random.randn(2)],
+                         feature_mean=np.zeros(8), feature_std=np.ones(8), window_length=20)
+        local_model = ml_util.LocalGaitPhaseModel(filename=filename)
+    data = exoboot.Exo.DataContainer()
+    print_result('LocalGaitPhaseModel.package_and_send_message', time_per_call(
+        lambda: local_model.package_and_send_message(side=constants.Side.LEFT,
+                                                     data_container=data)))
+
+
+def bench_spline_controller():
+    '''Torque from FourPointSplineController's profile, by itself and while fading.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import controllers
+    spline_x = [0, 0.2, 0.55, 0.6, 10]
+    spline_y = [5, 5, 20, 5, 5]
+    spline = interpolate.pchip(spline_x, spline_y, extrapolate=False)
+    last_spline = interpolate.pchip(spline_x, [5, 5, 15, 5, 5], extrapolate=False)
+    print_result('pchip', time_per_call(lambda: spline(0.4)))
+    print_result('pchip, fading', time_per_call(lambda: 0.5*last_spline(0.4) + 0.5*spline(0.4)))
+    print_result('pchip, deepcopy on update', time_per_call(lambda: copy.deepcopy(spline),
+                                                            num_calls=2000))
+    spline_controller = controllers.GenericSplineController(
+        exo=None, spline_x=spline_x, spline_y=[5, 5, 15, 5, 5])
+    spline_controller.update_spline(spline_x=spline_x, spline_y=spline_y)
+    print_result('torque table', time_per_call(lambda: spline_controller.torque_table(0.4),
+                                               num_calls=200000))
+    print_result('torque tables, fading', time_per_call(
+        lambda: spline_controller.fade_splines(phase=0.4, fraction=0.5), num_calls=200000))
+    print_result('update_spline (builds the table)', time_per_call(
+        lambda: spline_controller.update_spline(spline_x=spline_x, spline_y=spline_y,
+                                                first_call=True), num_calls=200))
+
+
+def bench_parallel_exo_io():
+    '''One tick on simulated exos whose reads and commands block for 1 ms, like serial I/O.'''
+    # Imported here, so the other benchmarks can run without flexsea installed
+    import config_util
+    import control_muxer
+    import exoboot
+    import io_workers
+    config = config_util.ConfigurableConstants(DO_SIMULATE_EXOS=True, PRINT_HS=False)
+    exoboot.use_simulated_flexsea(io_time=0.001)
+    exo_list = []
+    for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+        dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=config.ACTPACK_FREQ)
+        exo = exoboot.Exo(dev_id=dev_id, max_allowable_current=config.MAX_ALLOWABLE_CURRENT)
+        exo.motor_offset = exoboot.fxs.actpacks[dev_id].motor_offset
+        exo.has_calibrated = True
+        exo_list.append(exo)
+    gait_state_estimator_list, state_machine_list = control_muxer.get_gse_and_sm_lists(
+        exo_list=exo_list, config=config)
+
+    def run_one_serial_tick():
+        for exo in exo_list:
+            exo.read_data()
+        for gait_state_estimator in gait_state_estimator_list:
+            gait_state_estimator.detect()
+        for state_machine in state_machine_list:
+            state_machine.step(read_only=False)
+    print_result('one exo after the other (per tick)',
+                 time_per_call(run_one_serial_tick, num_calls=1000))
+    parallel_exo_io = io_workers.ParallelExoIO(exo_list=exo_list,
+                                               state_machine_list=state_machine_list)
+
+    def run_one_parallel_tick():
+        parallel_exo_io.read_data(loop_time=None)
+        for gait_state_estimator in gait_state_estimator_list:
+            gait_state_estimator.detect()
+        parallel_exo_io.step(read_only=False)
+    print_result('ParallelExoIO (per tick)',
+                 time_per_call(run_one_parallel_tick, num_calls=1000))
+    parallel_exo_io.print_stats()
+    parallel_exo_io.close()
+
+
+BENCHMARKS = {'logging': bench_logging,
+              'transmission_ratio': bench_transmission_ratio,
+              'ankle_to_motor_angle': bench_ankle_to_motor_angle,
+              'butterworth': bench_butterworth,
+              'filter_bank': bench_filter_bank,
+              'moving_filters': bench_moving_filters,
+              'stage_profiler': bench_stage_profiler,
+              'simulated_loop': bench_simulated_loop,
+              'batch_detection': bench_batch_detection,
+              'jetson_messages': bench_jetson_messages,
+              'jetson_loopback': bench_jetson_loopback,
+              'local_model': bench_local_model,
+              'spline_controller': bench_spline_controller,
+              'parallel_exo_io': bench_parallel_exo_io}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run per-tick microbenchmarks')
+    parser.add_argument('names', nargs='*',
+                        help='any of: ' + ', '.join(BENCHMARKS.keys()))
+    args = parser.parse_args()
+    for benchmark_name in args.names or BENCHMARKS.keys():
+        print('=== ' + benchmark_name + ' ===')
+        BENCHMARKS[benchmark_name]()
@@ -0,0 +1,110 @@
+'''Saves standing calibrations by dev_id, so a restart can skip calibrating again.
+
+Standing calibration finds each exo's motor_offset, by reeling in until the cable is taut.
+The motor encoder keeps counting between sessions, so the offset is still valid until the
+actpack is power cycled, which resets its motor angle. The ankle encoder is absolute.
+
+On startup, each exo reads one sample. Its slack is then computed with the saved motor_offset,
+from the current ankle and motor angles. Slack cannot be negative, and the cable can only
+unspool so far. So a saved calibration is reused only if that slack is between
+-CALIBRATION_REUSE_TOLERANCE and CALIBRATION_REUSE_MAX_SLACK. Otherwise (or with no saved
+calibration) the exo is calibrated again and its calibration saved.
+
+The window must be narrower than one motor revolution (MOTOR_COUNTS_PER_REVOLUTION), so that
+a motor encoder shifted by a revolution always lands outside it. A session ends with some
+slack (command_slack's default is 10000 counts), so the default window ends at 15000.
+'''
+import json
+import os
+import time
+from typing import List, Type
+
+import exoboot
+
+DEFAULT_FILENAME = 'exo_data/calibrations.json'
+MOTOR_COUNTS_PER_REVOLUTION = 2**14
+
+
+class CalibrationStore():
+    def __init__(self, filename: str = DEFAULT_FILENAME):
+        '''Loads saved calibrations from filename, if it exists.'''
+        self.filename = filename
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.calibrations = json.load(f)
+        else:
+            self.calibrations = {}
+
+    def save(self, exo: Type[exoboot.Exo], standing_angle: float):
+        '''Saves exo's calibration, with the encoder readings it was found from.'''
+        self.calibrations[str(exo.dev_id)] = {
+            'side': exo.side.name,
+            'motor_offset': float(exo.motor_offset),
+            'standing_angle': float(standing_angle),
+            'ankle_angle': float(exo.data.ankle_angle),
+            'motor_angle': int(exo.data.motor_angle),
+            'saved_at': time.strftime('%Y%m%d_%H%M%S')}
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Written to a temporary file first, so a crash never leaves a partial file
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, 'w') as f:
+            json.dump(self.calibrations, f, indent=4)
+        os.replace(temporary_filename, self.filename)
+
+    def get_slack_with_saved_calibration(self, exo: Type[exoboot.Exo]):
+        '''Returns exo's slack (motor counts) with its saved motor_offset, from the current
+        encoder readings in exo.data, or None if there is no saved calibration for exo.'''
+        calibration = self.calibrations.get(str(exo.dev_id))
+        if (calibration is None or calibration['side'] != exo.side.name or
+                exo.data.ankle_angle is None or exo.data.motor_angle is None):
+            return None
+        zero_slack_motor_angle = (exo.ankle_to_motor_angle_table(exo.data.ankle_angle) +
+                                  calibration['motor_offset'])
+        return -1*exo.motor_sign*(exo.data.motor_angle - zero_slack_motor_angle)
+
+    def reuse_calibration(self, exo: Type[exoboot.Exo], tolerance: float, max_slack: float):
+        '''If exo's saved calibration matches its encoders, applies it and returns its standing
+        angle. Otherwise returns None. exo.data must have a current sample.'''
+        slack = self.get_slack_with_saved_calibration(exo)
+        if slack is None:
+            print('No saved calibration for exo on ', exo.side)
+            return None
+        calibration = self.calibrations[str(exo.dev_id)]
+        if not -tolerance <= slack <= max_slack:
+            print('Saved calibration (', calibration['saved_at'], ') does not match encoders on ',
+                  exo.side, 'slack would be: ', slack, '. Recalibrating...')
+            return None
+        exo.motor_offset = calibration['motor_offset']
+        exo.has_calibrated = True
+        print('Reusing calibration (', calibration['saved_at'], ') on ', exo.side,
+              'slack: ', slack)
+        return calibration['standing_angle']
+
+
+def calibrate_exos(exo_list: List[Type[exoboot.Exo]],
+                   calibration_store: Type[CalibrationStore],
+                   do_reuse_calibration: bool = True,
+                   tolerance: float = 500,
+                   max_slack: float = 15000) -> list:
+    '''Reuses each exo's saved calibration if it is still valid, and calibrates the others at
+    once (see exoboot.calibrate_exos), saving their new calibrations.
+
+    Returns the standing angle of each exo.'''
+    if tolerance + max_slack >= MOTOR_COUNTS_PER_REVOLUTION:
+        raise ValueError('Slack window for reusing calibrations must be under one revolution')
+    standing_angles = [None]*len(exo_list)
+    if do_reuse_calibration:
+        for i, exo in enumerate(exo_list):
+            exo.read_data()
+            standing_angles[i] = calibration_store.reuse_calibration(
+                exo, tolerance=tolerance, max_slack=max_slack)
+    indices_to_calibrate = [i for i, standing_angle in enumerate(standing_angles)
+                            if standing_angle is None]
+    if indices_to_calibrate:
+        new_standing_angles = exoboot.calibrate_exos([exo_list[i] for i in indices_to_calibrate])
+        for i, standing_angle in zip(indices_to_calibrate, new_standing_angles):
+            standing_angles[i] = standing_angle
+            calibration_store.save(exo_list[i], standing_angle=standing_angle)
+    return standing_angles
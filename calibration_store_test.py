@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import calibration_store
+import constants
+import exoboot
+
+
+class Test_CalibrationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.real_fxs = exoboot.fxs
+        exoboot.use_simulated_flexsea()
+        self.dev_ids = []
+        for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+            dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+            exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+            self.dev_ids.append(dev_id)
+
+    def tearDown(self):
+        exoboot.fxs = self.real_fxs
+
+    def stand_still(self):
+        '''Stops the simulated gaits where they are, as the wearer stands for a restart.'''
+        for actpack in exoboot.fxs.actpacks.values():
+            actpack.phase_offset = (actpack.phase_offset + actpack.sample_index /
+                                    actpack.freq/actpack.gait_period) % 1
+            actpack.gait_period = float('inf')
+
+    def get_exo_list(self):
+        '''New Exos on the open actpacks, as when main_loop is started again.'''
+        return [exoboot.Exo(dev_id=dev_id, max_allowable_current=20000)
+                for dev_id in self.dev_ids]
+
+    def test_reuses_valid_calibrations(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'calibrations.json')
+            exo_list = self.get_exo_list()
+            with mock.patch('builtins.input') as prompt:
+                standing_angles = calibration_store.calibrate_exos(
+                    exo_list=exo_list,
+                    calibration_store=calibration_store.CalibrationStore(filename=filename))
+            self.assertEqual(prompt.call_count, 1)
+            motor_offsets = [exo.motor_offset for exo in exo_list]
+            self.stand_still()
+
+            # Restart: both saved calibrations still match the encoders
+            exo_list = self.get_exo_list()
+            with mock.patch('builtins.input') as prompt:
+                reused_standing_angles = calibration_store.calibrate_exos(
+                    exo_list=exo_list,
+                    calibration_store=calibration_store.CalibrationStore(filename=filename))
+            prompt.assert_not_called()
+            self.assertEqual(reused_standing_angles, standing_angles)
+            self.assertEqual([exo.motor_offset for exo in exo_list], motor_offsets)
+            self.assertTrue(all(exo.has_calibrated for exo in exo_list))
+
+            # Power cycling an actpack resets its motor angle, so only that exo recalibrates
+            actpack = exoboot.fxs.actpacks[self.dev_ids[1]]
+            actpack.motor_offset -= 100000
+            actpack.motor_angle -= 100000
+            exo_list = self.get_exo_list()
+            with mock.patch('builtins.input') as prompt, \
+                    mock.patch.object(exoboot.Exo, 'standing_calibration',
+                                      autospec=True, return_value=3.0) as standing_calibration:
+                standing_angles = calibration_store.calibrate_exos(
+                    exo_list=exo_list,
+                    calibration_store=calibration_store.CalibrationStore(filename=filename))
+            self.assertEqual(prompt.call_count, 1)
+            standing_calibration.assert_called_once_with(exo_list[1], do_prompt=False)
+            self.assertEqual(standing_angles[1], 3.0)
+            self.assertEqual(exo_list[0].motor_offset, motor_offsets[0])
+            self.assertEqual(
+                calibration_store.CalibrationStore(filename=filename).calibrations[
+                    str(self.dev_ids[1])]['standing_angle'], 3.0)
+
+    def test_slack_at_restart_and_one_revolution(self):
+        with tempfile.TemporaryDirectory() as folder:
+            store = calibration_store.CalibrationStore(
+                filename=os.path.join(folder, 'calibrations.json'))
+            with mock.patch('builtins.input'):
+                calibration_store.calibrate_exos(exo_list=self.get_exo_list(),
+                                                 calibration_store=store)
+            self.stand_still()
+            # The session ended with the default command_slack of slack
+            actpack = exoboot.fxs.actpacks[self.dev_ids[0]]
+            actpack.motor_angle -= actpack.motor_sign*10000
+            # A motor encoder shifted by a revolution puts the slack outside the window
+            for shift in [0, 16384, -16384]:
+                actpack.motor_offset += shift
+                actpack.motor_angle += shift
+                time.sleep(0.01)  # For a new sample
+                exo = self.get_exo_list()[0]
+                exo.read_data()
+                standing_angle = store.reuse_calibration(exo, tolerance=500, max_slack=15000)
+                self.assertEqual(standing_angle is None, shift != 0)
+                actpack.motor_offset -= shift
+                actpack.motor_angle -= shift
+            with self.assertRaises(ValueError):
+                calibration_store.calibrate_exos(exo_list=self.get_exo_list(),
+                                                 calibration_store=store, max_slack=30000)
+
+    def test_does_not_reuse_if_disabled(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'calibrations.json')
+            store = calibration_store.CalibrationStore(filename=filename)
+            with mock.patch('builtins.input'):
+                calibration_store.calibrate_exos(exo_list=self.get_exo_list(),
+                                                 calibration_store=store)
+            with mock.patch('builtins.input') as prompt:
+                calibration_store.calibrate_exos(exo_list=self.get_exo_list(),
+                                                 calibration_store=store,
+                                                 do_reuse_calibration=False)
+            self.assertEqual(prompt.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
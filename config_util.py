@@ -43,10 +43,15 @@ class ConfigurableConstants():
     RIGHT_STANDING_ANGLE: float = None  # Deg
 
     TARGET_FREQ: float = 175  # Hz
+    TIMER_DO_SLEEP: bool = True  # Sleep for most of each loop period, instead of busy-waiting
+    TIMER_SPIN_TIME: float = 0.0005  # s. Busy-waits for this long before each deadline
     ACTPACK_FREQ: float = 200  # Hz
     DO_DEPHY_LOG: bool = False
     DEPHY_LOG_LEVEL: int = 4
     ONLY_LOG_IF_NEW: bool = True
+    DO_LOG_BINARY: bool = True  # Logs to a binary ring buffer, converted to csv on close
+    DO_TRACE_LOOP_STAGES: bool = False  # Logs every tick's stage times to a _STAGES file
+    DO_PARALLEL_EXO_IO: bool = False  # Reads and commands each exo from its own thread (io_workers.py)
 
     TASK: Type[Task] = Task.WALKING
     STANCE_CONTROL_STYLE: Type[StanceCtrlStyle] = StanceCtrlStyle.FOURPOINTSPLINE
@@ -79,6 +84,11 @@ class ConfigurableConstants():
     SET_POINT: float = 0  # Deg
 
     READ_ONLY: bool = False  # Does not require Lipos
+    DO_REUSE_CALIBRATION: bool = False  # Skips standing calibration if the saved one matches the encoders
+    CALIBRATION_FILENAME: str = 'exo_data/calibrations.json'  # Standing calibrations, by dev_id
+    CALIBRATION_REUSE_TOLERANCE: float = 500  # Motor counts of negative slack allowed when reusing
+    CALIBRATION_REUSE_MAX_SLACK: float = 15000  # Motor counts. More slack means a stale calibration. With the tolerance, under one revolution (16384)
+    DO_SIMULATE_EXOS: bool = False  # Replaces the actpacks with simulated_exoboots.py
     DO_READ_FSRS: bool = False
     DO_READ_SYNC: bool = False
 
@@ -89,6 +99,13 @@ class ConfigurableConstants():
     DO_INCLUDE_GEN_VARS: bool = False
     SLIP_DETECT_DELAY: int = 0
     DO_FILTER_GAIT_PHASE: bool = False
+    JETSON_SERVER_IP: str = '192.168.1.2'  # '127.0.0.1' to use jetson_server.py on this machine
+    JETSON_SERVER_PORT: int = 8080
+    ML_USE_BINARY_PROTOCOL: bool = False  # Struct-packed Jetson messages (ml_util). Jetson must match
+    ML_USE_RECEIVER_THREAD: bool = True  # Receives Jetson predictions in a background thread
+    ML_MAX_PREDICTION_AGE: float = 0.1  # s. Older Jetson predictions are ignored. None: no limit
+    ML_MODEL_FILE: str = None  # .npz MLP (see ml_util.save_mlp). If set, runs on the Pi, not the Jetson
+    ML_INFERENCE_BUDGET: float = 0.001  # s. Max median inference time of ML_MODEL_FILE
     EXPERIMENTER_NOTES: str = 'Experimenter notes go here'
 
 
@@ -101,6 +118,7 @@ class ConfigSaver():
         filename = subfolder_name + \
             time.strftime("%Y%m%d_%H%M_") + file_ID + \
             '_CONFIG' + '.csv'
+        self.filename = filename
         self.my_file = open(filename, 'w', newline='')
         self.writer = csv.DictWriter(
             self.my_file, fieldnames=self.config.__dict__.keys())
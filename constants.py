@@ -16,9 +16,15 @@ LEFT_ANKLE_TO_MOTOR = np.array(
 RIGHT_ANKLE_TO_MOTOR = np.array(
     [6.53412109e-06, -5.10000261e-04, -7.52460274e-02, -1.27584877e+00,
      7.05016223e+02, -1.09811413e+04])
+# The polynomials are precomputed as dense lookup tables with this spacing (max error < 0.001 counts)
+ANKLE_TO_MOTOR_TABLE_STEP = 0.01  # Deg
 # These points are used to create a Pchip spline, which defines the transmission ratio as a function of ankle angle
 ANKLE_PTS = np.array([-60, -40, 0, 10, 20, 30, 40, 45.6, 55, 80])  # Deg
 TR_PTS = np.array([16, 16, 15, 14.5, 14, 11.5, 5, 0, -6.5, -12])  # Nm/Nm
+# The spline is precomputed as a dense lookup table with this spacing, from MIN to MAX_ANKLE_ANGLE
+TR_TABLE_STEP = 0.01  # Deg
+# Spline controllers precompute their torque profiles as dense lookup tables with this spacing
+SPLINE_TABLE_STEP = 0.001  # Gait phase, or s if the spline is in time
 
 LEFT_ANKLE_ANGLE_OFFSET = -92  # deg
 RIGHT_ANKLE_ANGLE_OFFSET = 88  # deg
@@ -151,7 +151,17 @@ def get_gse_and_sm_lists(exo_list, config: Type[config_util.ConfigurableConstant
                                                                         slip_recovery_time=slip_recovery_time)
             state_machine_list.append(state_machine)
     elif config.TASK == config_util.Task.WALKINGMLGAITPHASE:
-        jetson_interface = ml_util.JetsonInterface()
+        if config.ML_MODEL_FILE is not None:
+            jetson_interface = ml_util.LocalGaitPhaseModel(
+                filename=config.ML_MODEL_FILE, max_prediction_age=config.ML_MAX_PREDICTION_AGE,
+                inference_budget=config.ML_INFERENCE_BUDGET)
+        else:
+            jetson_interface = ml_util.JetsonInterface(
+                server_ip=config.JETSON_SERVER_IP, recv_port=config.JETSON_SERVER_PORT,
+                use_binary_protocol=config.ML_USE_BINARY_PROTOCOL,
+                max_prediction_age=config.ML_MAX_PREDICTION_AGE)
+            if config.ML_USE_RECEIVER_THREAD:
+                jetson_interface.start_receiver_thread()
         for exo in exo_list:
             gait_state_estimator = gait_state_estimators.MLGaitStateEstimator(
                 side=exo.side, data_container=exo.data, jetson_interface=jetson_interface,
@@ -1,8 +1,6 @@
 import constants
 from exoboot import Exo
 from scipy import signal, interpolate
-import time
-import copy
 import filters
 import config_util
 import util
@@ -164,25 +162,25 @@ class GenericSplineController(Controller):
                  Kd: int = constants.DEFAULT_KD,
                  ff: int = constants.DEFAULT_FF):
         self.exo = exo
-        self.spline = None  # Placeholds so update_spline can fill self.last_spline
+        self.torque_table = None  # Placeholds so update_spline can fill self.last_torque_table
         self.update_spline(spline_x, spline_y, first_call=True)
         self.fade_duration = fade_duration
         self.use_gait_phase = use_gait_phase  # if False, use time (s)
         super().update_controller_gains(Kp=Kp, Ki=Ki, Kd=Kd, ff=ff)
         # Fade timer goes from 0 to fade_duration, active if below fade_duration (starts inactive)
-        self.fade_start_time = time.perf_counter()-100
+        self.fade_start_time = util.get_time()-100
         self.t0 = None
 
     def command(self, reset=False):
         '''Commands appropriate control. If reset=True, this controller was just switched to.'''
         if reset:
             super().command_gains()
-            self.t0 = time.perf_counter()
+            self.t0 = util.get_time()
 
         if self.use_gait_phase:
             phase = self.exo.data.gait_phase
         else:
-            phase = time.perf_counter()-self.t0
+            phase = util.get_time()-self.t0
 
         if phase is None:
             # Gait phase is sometimes None
@@ -190,13 +188,13 @@ class GenericSplineController(Controller):
         elif phase > self.spline_x[-1]:
             # If phase (elapsed time) is longer than spline is specified, use last spline point
             print('phase is longer than specified spline')
-            desired_torque = self.spline(self.spline_x)
-        elif time.perf_counter() - self.fade_start_time < self.fade_duration:
+            desired_torque = self.torque_table(phase)  # Table clamps to its last point
+        elif util.get_time() - self.fade_start_time < self.fade_duration:
             # If fading splines
             desired_torque = self.fade_splines(
-                phase=phase, fraction=(time.perf_counter()-self.fade_start_time)/self.fade_duration)
+                phase=phase, fraction=(util.get_time()-self.fade_start_time)/self.fade_duration)
         else:
-            desired_torque = self.spline(phase)
+            desired_torque = self.torque_table(phase)
 
         self.exo.command_torque(desired_torque)
 
@@ -205,14 +203,16 @@ class GenericSplineController(Controller):
             self.spline_x = spline_x
             self.spline_y = spline_y
             print('Splines updated: ', 'x = ', spline_x, 'y = ', spline_y)
-            self.fade_start_time = time.perf_counter()
-            self.last_spline = copy.deepcopy(self.spline)
-            self.spline = interpolate.pchip(
-                spline_x, spline_y, extrapolate=False)
+            self.fade_start_time = util.get_time()
+            # Tables are never modified after they are built, so the old one can be kept as is
+            self.last_torque_table = self.torque_table
+            self.torque_table = util.LookupTable(
+                function=interpolate.pchip(spline_x, spline_y, extrapolate=False),
+                x_min=spline_x[0], x_max=spline_x[-1], step=constants.SPLINE_TABLE_STEP)
 
     def fade_splines(self, phase, fraction):
-        torque_from_last_spline = self.last_spline(phase)
-        torque_from_current_spline = self.spline(phase)
+        torque_from_last_spline = self.last_torque_table(phase)
+        torque_from_current_spline = self.torque_table(phase)
         desired_torque = (1-fraction)*torque_from_last_spline + \
             fraction*torque_from_current_spline
         return desired_torque
@@ -392,7 +392,7 @@ class GenericImpedanceController(Controller):
     def command(self, reset=False):
         if reset:
             super().command_gains()
-        theta0_motor = self.exo.ankle_angle_to_motor_angle(self.setpoint)
+        theta0_motor = self.exo.ankle_setpoint_to_motor_angle(self.setpoint)
         self.exo.command_motor_impedance(
             theta0=theta0_motor, k_val=self.k_val, b_val=self.b_val)
 
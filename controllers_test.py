@@ -1,29 +1,84 @@
 import controllers
 import unittest
 import numpy as np
-from scipy import signal
+import util
+from scipy import signal, interpolate
 import matplotlib.pyplot as plt
 
 
+class TorqueRecordingExo():
+    '''Stands in for an Exo: holds gait_phase, and records commanded torques.'''
+
+    class DataContainer():
+        gait_phase = None
+
+    def __init__(self):
+        self.data = self.DataContainer()
+        self.commanded_torques = []
+
+    def command_torque(self, desired_torque):
+        self.commanded_torques.append(desired_torque)
+
+
 class Test_PositionController(unittest.TestCase):
 
     def test_spline_controller(self):
         spline_x = [0, 0.2, 0.5, 0.6, 1]
         spline_y = [0, 6, 10, 0, 0]
+        exo = TorqueRecordingExo()
         spline_controller = controllers.GenericSplineController(
-            Kp=100, Ki=20, Kd=0,
+            exo=exo, Kp=100, Ki=20, Kd=0,
             spline_x=spline_x, spline_y=spline_y)
         time_nows = np.arange(0, 10, 0.01)
         gait_phases = 0.5+0.5*(signal.sawtooth(t=time_nows, width=1))
-        desired_currents = []
         for gait_phase in gait_phases:
-            desired_currents.append(spline_controller.command(gait_phase))
+            exo.data.gait_phase = gait_phase
+            spline_controller.command()
+        spline = interpolate.pchip(spline_x, spline_y)
+        np.testing.assert_allclose(exo.commanded_torques, spline(gait_phases), atol=1e-3)
         plt.plot(gait_phases)
-        plt.plot(desired_currents)
+        plt.plot(exo.commanded_torques)
         plt.show()
 
+    def test_spline_out_of_range(self):
+        exo = TorqueRecordingExo()
+        spline_controller = controllers.GenericSplineController(
+            exo=exo, spline_x=[0, 0.5, 1], spline_y=[2, 8, 3])
+        for gait_phase in [None, 1.5, -0.1]:
+            exo.data.gait_phase = gait_phase
+            spline_controller.command()
+        self.assertEqual(exo.commanded_torques, [0, 3, 2])
+
     def test_spline_fade(self):
-        spline_controller = controllers.FourPointSplineController(exo)
+        clock = util.VirtualClock(start_time=10)
+        util.set_time_source(clock)
+        try:
+            exo = TorqueRecordingExo()
+            spline_controller = controllers.FourPointSplineController(
+                exo=exo, peak_torque=20, fade_duration=2)
+            last_spline = interpolate.pchip(spline_controller.spline_x,
+                                            spline_controller.spline_y)
+            exo.data.gait_phase = 0.55
+            spline_controller.command()
+            self.assertAlmostEqual(exo.commanded_torques[-1], 20)
+            spline_controller.update_spline(spline_x=[0, 0.2, 0.5, 0.6, 10],
+                                            spline_y=[5, 5, 30, 5, 5])
+            spline = interpolate.pchip(spline_controller.spline_x, spline_controller.spline_y)
+            for fraction in [0, 0.25, 0.5, 0.75]:
+                clock.set_time(10 + 2*fraction)
+                for gait_phase in [0.1, 0.3, 0.55, 0.58, 0.9]:
+                    exo.data.gait_phase = gait_phase
+                    spline_controller.command()
+                    self.assertAlmostEqual(
+                        exo.commanded_torques[-1],
+                        (1-fraction)*last_spline(gait_phase) + fraction*spline(gait_phase),
+                        places=3)
+            clock.set_time(12)
+            exo.data.gait_phase = 0.5
+            spline_controller.command()
+            self.assertAlmostEqual(exo.commanded_torques[-1], 30)
+        finally:
+            util.set_time_source()
 
 
 if __name__ == '__main__':
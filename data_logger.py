@@ -0,0 +1,149 @@
+'''Binary data logging that keeps file I/O off the control thread.
+
+Samples are copied into a preallocated, fixed-schema NumPy ring buffer, and a
+background thread drains that buffer to disk in large blocks. Binary logs can be
+converted to the usual csv layout with convert_log_to_csv(), or from the command line:
+    python data_logger.py exo_data/20210727_1253_S01_T04_LEFT.bin
+'''
+import csv
+import json
+import sys
+import threading
+from typing import List, Sequence
+
+import numpy as np
+
+FILE_MAGIC = b'EXOLOG1\n'
+FIELD_KINDS = ('bool', 'int', 'float')
+
+
+class RingBufferLogger(threading.Thread):
+    def __init__(self,
+                 filename: str,
+                 field_names: Sequence[str],
+                 field_kinds: Sequence[str],
+                 capacity: int = 8192,
+                 flush_period: float = 0.5,
+                 name='data-logger-thread'):
+        '''Logs fixed-schema samples to a binary file from a background thread.
+
+        append() only copies a sample into a preallocated ring buffer, so it is safe to call
+        from the control loop. Every flush_period, this thread writes all pending samples to
+        disk in one block. If the writer falls more than capacity samples behind (e.g., a very
+        long SD card stall), new samples are dropped and counted in num_dropped.
+
+        Args:
+            filename: str. Binary file to write (conventionally ending in .bin)
+            field_names: names of the fields, in the order values are passed to append()
+            field_kinds: 'bool', 'int', or 'float' for each field, used to recreate the csv
+            capacity: number of samples the ring buffer can hold
+            flush_period: time (s) between writes to disk'''
+        super().__init__(name=name)
+        if len(field_names) != len(field_kinds):
+            raise ValueError('field_names and field_kinds must be the same length')
+        for kind in field_kinds:
+            if kind not in FIELD_KINDS:
+                raise ValueError('field kinds must be one of: ', FIELD_KINDS)
+        self.daemon = True  # Thread property
+        self.filename = filename
+        self.field_names = list(field_names)
+        self.field_kinds = list(field_kinds)
+        self.capacity = capacity
+        self.flush_period = flush_period
+        # All fields are stored as float64, so None can be stored (as NaN)
+        self.dtype = np.dtype([(name, np.float64) for name in self.field_names])
+        self.buffer = np.zeros(self.capacity, dtype=self.dtype)
+        # Monotonic counters: only the control thread touches num_appended, and only the
+        # writer thread touches num_drained, so no lock is needed
+        self.num_appended = 0
+        self.num_drained = 0
+        self.num_dropped = 0
+        self.stop_event = threading.Event()
+        self.my_file = open(self.filename, 'wb')
+        write_header(my_file=self.my_file, field_names=self.field_names,
+                     field_kinds=self.field_kinds)
+        self.start()  # Starts the run() function
+
+    def append(self, values: Sequence):
+        '''Copies one sample (values in the order of field_names) into the ring buffer.'''
+        if self.num_appended - self.num_drained >= self.capacity:
+            self.num_dropped += 1
+            return
+        self.buffer[self.num_appended % self.capacity] = tuple(values)
+        self.num_appended += 1
+
+    # This run function overrides the run() function in threading.Thread
+    def run(self):
+        while not self.stop_event.wait(timeout=self.flush_period):
+            self._drain()
+        self._drain()
+        self.my_file.close()
+
+    def _drain(self):
+        '''Writes all pending samples to disk, in at most two contiguous blocks.'''
+        num_appended = self.num_appended
+        while self.num_drained < num_appended:
+            start = self.num_drained % self.capacity
+            stop = min(self.capacity, start + num_appended - self.num_drained)
+            self.my_file.write(self.buffer[start:stop].tobytes())
+            self.num_drained += stop - start
+        self.my_file.flush()
+
+    def close(self):
+        '''Writes any remaining samples and closes the file.'''
+        self.stop_event.set()
+        self.join()
+        if self.num_dropped:
+            print('Data logger dropped ', self.num_dropped,
+                  ' samples because the writer fell behind: ', self.filename)
+
+
+def write_header(my_file, field_names: List[str], field_kinds: List[str]):
+    my_file.write(FILE_MAGIC)
+    header = json.dumps({'field_names': field_names, 'field_kinds': field_kinds})
+    my_file.write(header.encode() + b'\n')
+
+
+def load_log(filename: str):
+    '''Returns (structured array of samples, field_kinds) from a binary log.'''
+    with open(filename, 'rb') as f:
+        if f.readline() != FILE_MAGIC:
+            raise ValueError('Not a binary exo log: ', filename)
+        header = json.loads(f.readline().decode())
+        dtype = np.dtype([(name, np.float64) for name in header['field_names']])
+        raw = f.read()
+    # A partially written sample at the end (e.g., from a power loss) is discarded
+    num_samples = len(raw) // dtype.itemsize
+    samples = np.frombuffer(raw, dtype=dtype, count=num_samples)
+    return samples, header['field_kinds']
+
+
+def _format_value(value: float, kind: str) -> str:
+    '''Formats a value like csv.DictWriter would have formatted the original python value.'''
+    if value != value:  # NaN means the value was None
+        return ''
+    elif kind == 'bool':
+        return str(bool(value))
+    elif kind == 'int':
+        return str(int(value))
+    else:
+        return repr(float(value))
+
+
+def convert_log_to_csv(filename: str, csv_filename: str = None) -> str:
+    '''Converts a binary log to a csv with the same layout as the csv.DictWriter logs.'''
+    if csv_filename is None:
+        csv_filename = filename[:-4] + '.csv' if filename.endswith('.bin') else filename + '.csv'
+    samples, field_kinds = load_log(filename)
+    with open(csv_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(samples.dtype.names)
+        for sample in samples.tolist():
+            writer.writerow([_format_value(value, kind)
+                             for value, kind in zip(sample, field_kinds)])
+    return csv_filename
+
+
+if __name__ == '__main__':
+    for log_filename in sys.argv[1:]:
+        print('Wrote: ', convert_log_to_csv(log_filename))
@@ -0,0 +1,71 @@
+import csv
+import io
+import os
+import tempfile
+import unittest
+
+import data_logger
+
+
+class Test_RingBufferLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'test_LEFT.bin')
+        self.field_names = ['loop_time', 'motor_angle', 'did_heel_strike', 'gait_phase']
+        self.field_kinds = ['float', 'int', 'bool', 'float']
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_csv_matches_dict_writer(self):
+        # Converted logs should look just like the csv.DictWriter logs
+        rows = [{'loop_time': 0.005*i, 'motor_angle': -1000*i,
+                 'did_heel_strike': i == 3, 'gait_phase': None if i < 2 else 0.1*i}
+                for i in range(10)]
+        logger = data_logger.RingBufferLogger(
+            filename=self.filename, field_names=self.field_names,
+            field_kinds=self.field_kinds, flush_period=0.01)
+        for row in rows:
+            logger.append(row.values())
+        logger.close()
+        csv_filename = data_logger.convert_log_to_csv(self.filename)
+
+        expected = io.StringIO(newline='')
+        writer = csv.DictWriter(expected, fieldnames=self.field_names)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+        with open(csv_filename, newline='') as f:
+            self.assertEqual(f.read(), expected.getvalue())
+
+    def test_wraparound(self):
+        # A long flush_period means the writer only drains when asked to
+        logger = data_logger.RingBufferLogger(
+            filename=self.filename, field_names=self.field_names,
+            field_kinds=self.field_kinds, capacity=8, flush_period=100)
+        for i in range(6):
+            logger.append([i, i, False, i])
+        logger._drain()
+        for i in range(6, 12):
+            logger.append([i, i, False, i])
+        logger.close()
+        samples, field_kinds = data_logger.load_log(self.filename)
+        self.assertEqual(logger.num_dropped, 0)
+        self.assertListEqual(samples['loop_time'].tolist(), list(range(12)))
+        self.assertListEqual(field_kinds, self.field_kinds)
+
+    def test_dropped_samples(self):
+        logger = data_logger.RingBufferLogger(
+            filename=self.filename, field_names=self.field_names,
+            field_kinds=self.field_kinds, capacity=8, flush_period=100)
+        for i in range(12):
+            logger.append([i, i, False, i])
+        logger.close()
+        samples, _ = data_logger.load_log(self.filename)
+        self.assertEqual(logger.num_dropped, 4)
+        self.assertListEqual(samples['loop_time'].tolist(), list(range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,23 @@
+import concurrent.futures
 import csv
+import glob
 import logging
+import operator
 import os
+import re
 import sys
 import time
 import warnings
-from dataclasses import dataclass, field, InitVar
 from scipy import interpolate
-from typing import Type
+from typing import List, Type
 
 import numpy as np
 
 import config_util
 import constants
+import data_logger
 import filters
+import util
 from flexsea import fxEnums as fxe
 from flexsea import flexsea as flex
 from flexsea import fxUtils as fxu
@@ -21,13 +26,46 @@ from flexsea import fxUtils as fxu
 fxs = flex.FlexSEA()
 
 
+def use_simulated_flexsea(**kwargs):
+    '''Replaces Dephy's FlexSEA object with a simulated one (see simulated_exoboots.py).'''
+    global fxs
+    import simulated_exoboots  # Imported here, because it is only needed without actpacks
+    fxs = simulated_exoboots.SimulatedFlexSEA(**kwargs)
+    return fxs
+
+
+def discover_ports(pattern: str = '/dev/ttyACM*') -> List[str]:
+    '''Returns the serial ports matching pattern, in numerical order (ttyACM2 before ttyACM10).'''
+    return sorted(glob.glob(pattern),
+                  key=lambda port: [int(text) if text.isdigit() else text
+                                    for text in re.split(r'(\d+)', port)])
+
+
+def _run_for_each_exo(function, items: list) -> list:
+    '''Calls function(item) for every item at once, each in its own thread, and returns the
+    results in order. If any call raises, the error is raised after every call has finished.'''
+    if not items:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(items)) as executor:
+        futures = [executor.submit(function, item) for item in items]
+        concurrent.futures.wait(futures)
+    return [future.result() for future in futures]
+
+
 def connect_to_exos(file_ID: str,
                     config: Type[config_util.ConfigurableConstants],
                     sync_detector=None):
-    '''Connect to Exos, instantiate Exo objects.'''
+    '''Connect to Exos, instantiate Exo objects.
+
+    Every port is opened, starts streaming, and gets its Exo at the same time.'''
+    t0 = time.perf_counter()
 
     # Load Ports and baud rate
-    if fxu.is_win():		# Need for WebAgg server to work in Python 3.8
+    if config.DO_SIMULATE_EXOS:
+        use_simulated_flexsea()
+        ports = ['/dev/ttyACM0', '/dev/ttyACM1']  # Only used to assign sides
+        baud_rate = constants.DEFAULT_BAUD_RATE
+    elif fxu.is_win():		# Need for WebAgg server to work in Python 3.8
         print('Detected win32')
         import asyncio
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -35,34 +73,76 @@ def connect_to_exos(file_ID: str,
             os.path.abspath(__file__)), "ports.yaml")
         ports, baud_rate = fxu.load_ports_from_file(port_cfg_path)
     elif fxu.is_pi64() or fxu.is_pi():
-        ports = ['/dev/ttyACM0', '/dev/ttyACM1']
+        ports = discover_ports()
         baud_rate = constants.DEFAULT_BAUD_RATE
     else:
         raise ValueError('Max Code only supporting Windows or pi64 so far')
     print(f"Using ports:\t{ports}")
 
-    exo_list = []
-    for port in ports:
+    def connect_to_exo(port):
         try:
             dev_id = fxs.open(port, baud_rate, log_level=3)
             fxs.start_streaming(
                 dev_id=dev_id, freq=config.ACTPACK_FREQ, log_en=config.DO_DEPHY_LOG)
-            exo_list.append(Exo(dev_id=dev_id, file_ID=file_ID,
-                                target_freq=config.TARGET_FREQ,
-                                do_read_fsrs=config.DO_READ_FSRS,
-                                do_include_did_slip=config.DO_DETECT_SLIP,
-                                max_allowable_current=config.MAX_ALLOWABLE_CURRENT,
-                                do_include_gen_vars=config.DO_INCLUDE_GEN_VARS,
-                                sync_detector=sync_detector))
+            return Exo(dev_id=dev_id, file_ID=file_ID,
+                       target_freq=config.TARGET_FREQ,
+                       do_read_fsrs=config.DO_READ_FSRS,
+                       do_include_did_slip=config.DO_DETECT_SLIP,
+                       max_allowable_current=config.MAX_ALLOWABLE_CURRENT,
+                       do_include_gen_vars=config.DO_INCLUDE_GEN_VARS,
+                       do_log_binary=config.DO_LOG_BINARY,
+                       do_include_ml_telemetry=(
+                           config.TASK == config_util.Task.WALKINGMLGAITPHASE),
+                       sync_detector=sync_detector)
         except IOError:
             print('Unable to open exo on port: ', port,
                   ' This is okay if only one exo is connected!')
+            return None
 
+    exo_list = [exo for exo in _run_for_each_exo(connect_to_exo, ports) if exo is not None]
     if not exo_list:  # (if empty)
         raise RuntimeError('No Exos connected')
+    print('Connected to %d exos in %.2f s' % (len(exo_list), time.perf_counter() - t0))
     return exo_list
 
 
+def calibrate_exos(exo_list: List[Type['Exo']], **kwargs) -> list:
+    '''Runs standing_calibration on every exo at once, after a single prompt.
+
+    Returns the calibrated ankle angle of each exo. kwargs are passed to standing_calibration.'''
+    input('Press Enter to calibrate ' + ', '.join(str(exo.side) for exo in exo_list))
+    t0 = time.perf_counter()
+    standing_angles = _run_for_each_exo(
+        lambda exo: exo.standing_calibration(do_prompt=False, **kwargs), exo_list)
+    print('Calibrated %d exos in %.2f s' % (len(exo_list), time.perf_counter() - t0))
+    return standing_angles
+
+
+def close_exos(exo_list: List[Type['Exo']]):
+    '''Closes every exo at once.'''
+    t0 = time.perf_counter()
+    _run_for_each_exo(lambda exo: exo.close(), exo_list)
+    print('Closed %d exos in %.2f s' % (len(exo_list), time.perf_counter() - t0))
+
+
+def get_TR_lookup_table(motor_sign: int) -> Type[util.LookupTable]:
+    '''Precomputes the transmission ratio spline (a function of ankle angle) as a lookup table.'''
+    TR_spline = interpolate.PchipInterpolator(
+        constants.ANKLE_PTS, motor_sign*constants.TR_PTS)
+    return util.LookupTable(function=TR_spline,
+                            x_min=constants.MIN_ANKLE_ANGLE,
+                            x_max=constants.MAX_ANKLE_ANGLE,
+                            step=constants.TR_TABLE_STEP)
+
+
+def get_ankle_to_motor_lookup_table(ankle_to_motor_angle_polynomial: np.ndarray) -> Type[util.LookupTable]:
+    '''Precomputes the ankle angle to motor angle polynomial (without offset) as a lookup table.'''
+    return util.LookupTable(function=np.poly1d(ankle_to_motor_angle_polynomial),
+                            x_min=constants.MIN_ANKLE_ANGLE,
+                            x_max=constants.MAX_ANKLE_ANGLE,
+                            step=constants.ANKLE_TO_MOTOR_TABLE_STEP)
+
+
 class Exo():
     def __init__(self,
                  dev_id: int,
@@ -72,17 +152,22 @@ class Exo():
                  do_read_fsrs: bool = False,
                  do_include_did_slip: bool = False,
                  do_include_gen_vars: bool = False,
+                 do_log_binary: bool = False,
+                 do_include_ml_telemetry: bool = False,
                  sync_detector=None):
         '''Exo object is the primary interface with the Dephy ankle exos, and corresponds to a single physical exoboot.
         Args:
             dev_id: int. Unique integer to identify the exo in flexsea's library. Returned by connect_to_exo
             file_ID: str. Unique string added to filename. If None, no file will be saved.
             do_read_fsrs: bool indicating whether to read FSRs.
+            do_log_binary: bool. If True, log to a binary ring buffer, and convert to csv on close.
+            do_include_ml_telemetry: bool. If True, log Jetson link telemetry (see ml_util.py).
             sync_detector: gpiozero class for sync line, created in config_util '''
         self.dev_id = dev_id
         self.max_allowable_current = max_allowable_current
         self.file_ID = file_ID
         self.do_read_fsrs = do_read_fsrs
+        self.do_log_binary = do_log_binary
         self.do_include_sync = True if sync_detector else False
         self.sync_detector = sync_detector
         if self.dev_id is None:
@@ -100,7 +185,19 @@ class Exo():
         else:
             raise ValueError(
                 'dev_id: ', self.dev_id, 'not found in constants.LEFT_EXO_DEV_IDS or constants.RIGHT_EXO_DEV_IDS')
+        # Quantities that only depend on ankle angle are computed once per sample (see get_TR)
+        self._cached_ankle_angle = None
+        self._TR = None
+        self._max_allowable_torque = None
+        self._zero_slack_motor_angle = None
         self.motor_offset = 0
+        # Gains and (ctrl_mode, value) last sent to the actpack, so repeats can be skipped
+        self._last_gains_sent = None
+        self._last_motor_command_sent = None
+        self.num_gains_sent = 0
+        self.num_gains_suppressed = 0
+        self.num_motor_commands_sent = 0
+        self.num_motor_commands_suppressed = 0
         # ankle velocity filter is hardcoded for simplicity, but can be factored out if necessary
         self.ankle_velocity_filter = filters.Butterworth(
             N=2, Wn=10, fs=target_freq)
@@ -122,7 +219,8 @@ class Exo():
 
         self.data = self.DataContainer(
             do_include_FSRs=do_read_fsrs, do_include_did_slip=do_include_did_slip,
-            do_include_gen_vars=do_include_gen_vars, do_include_sync=self.do_include_sync)
+            do_include_gen_vars=do_include_gen_vars, do_include_sync=self.do_include_sync,
+            do_include_ml_telemetry=do_include_ml_telemetry)
         self.has_calibrated = False
         self.is_clipping = False
         if self.file_ID is not None:
@@ -134,64 +232,106 @@ class Exo():
                               k_val=0,
                               b_val=0,
                               ff=constants.DEFAULT_FF)
-            self.TR_from_ankle_angle = interpolate.PchipInterpolator(
-                constants.ANKLE_PTS, self.motor_sign*constants.TR_PTS)
+            self.TR_from_ankle_angle = get_TR_lookup_table(motor_sign=self.motor_sign)
+            self.ankle_to_motor_angle_table = get_ankle_to_motor_lookup_table(
+                self.ankle_to_motor_angle_polynomial)
 
-    @dataclass
     class DataContainer:
-        '''A nested dataclass within Exo, reserving space for instantaneous data.'''
-        do_include_FSRs: InitVar[bool] = False
-        do_include_sync: InitVar[bool] = False
-        do_include_did_slip: InitVar[bool] = False
-        do_include_gen_vars: InitVar[bool] = False
-        state_time: float = 0
-        loop_time: float = 0
-        accel_x: float = 0
-        accel_y: float = 0
-        accel_z: float = 0
-        gyro_x: float = 0
-        gyro_y: float = 0
-        gyro_z: float = 0
-        motor_angle: int = 0
-        motor_velocity: float = 0
-        motor_current: int = 0
-        ankle_angle: float = 0
-        ankle_velocity: float = 0
-        ankle_torque_from_current: float = 0
-        did_heel_strike: bool = False
-        gait_phase: float = None
-        did_toe_off: bool = False
-        commanded_current: int = None
-        commanded_position: int = None
-        commanded_torque: float = None
-        slack: int = None
-        temperature: int = None
-        # Optional fields--init in __post__init__
-        heel_fsr: bool = field(init=False)
-        toe_fsr: bool = field(init=False)
-        did_slip: bool = field(init=False)
-        sync: bool = field(init=False)
-        gen_var1: float = field(init=False)
-        gen_var2: float = field(init=False)
-        gen_var3: float = field(init=False)
-
-        def __post_init__(self, do_include_FSRs, do_include_sync, do_include_did_slip, do_include_gen_vars):
-            # Important! The order of these args need to match their order as InitVars above
+        '''A nested class within Exo, reserving space for instantaneous data.
+
+        Fields live in __slots__, and the schema (field_names, field_kinds) is fixed when the
+        container is created. Optional fields are only in the schema if their do_include flag
+        is True; otherwise they are left unset, so accessing them raises an AttributeError.
+        values() grabs every field in one call, without building a dict.'''
+        # (name, kind, default value), in the order that fields are written to file
+        REQUIRED_FIELDS = (
+            ('state_time', 'float', 0),
+            ('loop_time', 'float', 0),
+            ('accel_x', 'float', 0),
+            ('accel_y', 'float', 0),
+            ('accel_z', 'float', 0),
+            ('gyro_x', 'float', 0),
+            ('gyro_y', 'float', 0),
+            ('gyro_z', 'float', 0),
+            ('motor_angle', 'int', 0),
+            ('motor_velocity', 'float', 0),
+            ('motor_current', 'int', 0),
+            ('ankle_angle', 'float', 0),
+            ('ankle_velocity', 'float', 0),
+            ('ankle_torque_from_current', 'float', 0),
+            ('did_heel_strike', 'bool', False),
+            ('gait_phase', 'float', None),
+            ('did_toe_off', 'bool', False),
+            ('commanded_current', 'int', None),
+            ('commanded_position', 'int', None),
+            ('commanded_torque', 'float', None),
+            ('slack', 'int', None),
+            ('temperature', 'int', None))
+        # Optional fields
+        FSR_FIELDS = (('heel_fsr', 'bool', False),
+                      ('toe_fsr', 'bool', False))
+        DID_SLIP_FIELDS = (('did_slip', 'bool', False),)
+        GEN_VAR_FIELDS = (('gen_var1', 'float', None),
+                          ('gen_var2', 'float', None),
+                          ('gen_var3', 'float', None))
+        SYNC_FIELDS = (('sync', 'bool', True),)
+        # Seq of the Jetson prediction used, its round trip time (s), and its age when used (s)
+        ML_TELEMETRY_FIELDS = (('ml_seq', 'int', None),
+                               ('ml_rtt', 'float', None),
+                               ('ml_prediction_age', 'float', None))
+        __slots__ = tuple(name for name, _, _ in (
+            REQUIRED_FIELDS + FSR_FIELDS + DID_SLIP_FIELDS + GEN_VAR_FIELDS + SYNC_FIELDS +
+            ML_TELEMETRY_FIELDS)) + (
+            'field_names', 'field_kinds', '_get_values')
+
+        def __init__(self,
+                     do_include_FSRs: bool = False,
+                     do_include_sync: bool = False,
+                     do_include_did_slip: bool = False,
+                     do_include_gen_vars: bool = False,
+                     do_include_ml_telemetry: bool = False):
+            fields = self.REQUIRED_FIELDS
             if do_include_FSRs:
-                self.heel_fsr = False
-                self.toe_fsr = False
+                fields += self.FSR_FIELDS
             if do_include_did_slip:
-                self.did_slip = False
+                fields += self.DID_SLIP_FIELDS
             if do_include_gen_vars:
-                self.gen_var1 = None
-                self.gen_var2 = None
-                self.gen_var3 = None
+                fields += self.GEN_VAR_FIELDS
             if do_include_sync:
-                self.sync = True
+                fields += self.SYNC_FIELDS
+            if do_include_ml_telemetry:
+                fields += self.ML_TELEMETRY_FIELDS
+            for name, _, default_value in fields:
+                setattr(self, name, default_value)
+            self.field_names = tuple(name for name, _, _ in fields)
+            self.field_kinds = tuple(kind for _, kind, _ in fields)
+            self._get_values = operator.attrgetter(*self.field_names)
+
+        def values(self) -> tuple:
+            '''Returns the values of all fields, in the order of field_names.'''
+            return self._get_values(self)
+
+        def as_dict(self) -> dict:
+            return dict(zip(self.field_names, self._get_values(self)))
+
+        def __repr__(self):
+            return 'DataContainer(' + ', '.join(
+                name + '=' + repr(value) for name, value in self.as_dict().items()) + ')'
+
+    @property
+    def motor_offset(self):
+        return self._motor_offset
+
+    @motor_offset.setter
+    def motor_offset(self, motor_offset):
+        self._motor_offset = motor_offset
+        # Memoized setpoint conversions depend on motor_offset, so they are cleared
+        self._setpoint_to_motor_angle_cache = {}
+        self._zero_slack_motor_angle = None
 
     def close(self):
-        self.update_gains()
-        self.command_current(desired_mA=0)
+        self.update_gains(do_force_send=True)
+        self.command_current(desired_mA=0, do_force_send=True)
         time.sleep(0.1)
         self.command_controller_off()
         time.sleep(0.05)
@@ -205,8 +345,12 @@ class Exo():
         if self.do_include_sync:
             self.sync_detector.close()
 
-    def update_gains(self, Kp=None, Ki=None, Kd=None, k_val=None, b_val=None, ff=None):
-        '''Optionally updates individual exo gain values, and sends to Actpack.'''
+    def update_gains(self, Kp=None, Ki=None, Kd=None, k_val=None, b_val=None, ff=None,
+                     do_force_send: bool = False):
+        '''Optionally updates individual exo gain values, and sends to Actpack.
+
+        Gains are only sent if they differ from the last gains sent (or the control mode has
+        changed since), unless do_force_send.'''
         if Kp is not None:
             self.Kp = Kp
         if Ki is not None:
@@ -219,8 +363,36 @@ class Exo():
             self.b_val = b_val
         if ff is not None:
             self.ff = ff
+        gains = (self.Kp, self.Ki, self.Kd, self.k_val, self.b_val, self.ff)
+        if gains == self._last_gains_sent and not do_force_send:
+            self.num_gains_suppressed += 1
+            return
         fxs.set_gains(dev_id=self.dev_id, kp=self.Kp, ki=self.Ki,
                       kd=self.Kd, k_val=self.k_val, b_val=self.b_val, ff=self.ff)
+        self._last_gains_sent = gains
+        self.num_gains_sent += 1
+
+    def _send_motor_command(self, ctrl_mode, value, do_force_send: bool = False):
+        '''Sends a motor command to the Actpack, unless it repeats the last one sent.'''
+        motor_command = (ctrl_mode, value)
+        if motor_command == self._last_motor_command_sent and not do_force_send:
+            self.num_motor_commands_suppressed += 1
+            return
+        fxs.send_motor_command(dev_id=self.dev_id, ctrl_mode=ctrl_mode, value=value)
+        if (self._last_motor_command_sent is None or
+                ctrl_mode != self._last_motor_command_sent[0]):
+            # In case changing control mode resets the Actpack's gains, send them again next time
+            self._last_gains_sent = None
+        self._last_motor_command_sent = motor_command
+        self.num_motor_commands_sent += 1
+
+    def print_serial_stats(self):
+        '''Prints how many gain and motor command messages were sent, and how many were
+        skipped as repeats.'''
+        print('Side: ', self.side, 'gains sent: ', self.num_gains_sent,
+              'suppressed: ', self.num_gains_suppressed,
+              '| motor commands sent: ', self.num_motor_commands_sent,
+              'suppressed: ', self.num_motor_commands_suppressed)
 
     def read_data(self, loop_time=None):
         '''Read data from Dephy Actpack, store in exo.data Data Container.
@@ -294,10 +466,15 @@ class Exo():
             self.filename = subfolder_name + \
                 time.strftime("%Y%m%d_%H%M_") + file_ID + \
                 '_' + self.side.name + '.csv'
-            self.my_file = open(self.filename, 'w', newline='')
-            self.writer = csv.DictWriter(
-                self.my_file, fieldnames=self.data.__dict__.keys())
-            self.writer.writeheader()
+            if self.do_log_binary:
+                self.data_logger = data_logger.RingBufferLogger(
+                    filename=self.filename.replace('.csv', '.bin'),
+                    field_names=self.data.field_names,
+                    field_kinds=self.data.field_kinds)
+            else:
+                self.my_file = open(self.filename, 'w', newline='')
+                self.writer = csv.writer(self.my_file)
+                self.writer.writerow(self.data.field_names)
             self._did_heel_strike_hold = False
             self._did_toe_off_hold = False
 
@@ -316,7 +493,7 @@ class Exo():
                 current_did_toe_off = self.data.did_toe_off
                 self.data.did_heel_strike = self._did_heel_strike_hold
                 self.data.did_toe_off = self._did_toe_off_hold
-                self.writer.writerow(self.data.__dict__)
+                self._write_row()
                 # Reset to False (will fail if heel strikes / toe offs occur within ~10 ms of each other.)
                 self.data.did_heel_strike = current_did_heel_strike
                 self._did_heel_strike_hold = False
@@ -324,20 +501,32 @@ class Exo():
                 self._did_toe_off_hold = False
         else:
             if self.file_ID is not None:
-                self.writer.writerow(self.data.__dict__)
+                self._write_row()
+
+    def _write_row(self):
+        if self.do_log_binary:
+            self.data_logger.append(self.data.values())
+        else:
+            self.writer.writerow(self.data.values())
 
     def close_file(self):
         if self.file_ID is not None:
-            self.my_file.close()
+            if self.do_log_binary:
+                # Conversion happens after the loop has stopped, so it can take its time
+                self.data_logger.close()
+                data_logger.convert_log_to_csv(
+                    filename=self.data_logger.filename, csv_filename=self.filename)
+            else:
+                self.my_file.close()
 
-    def command_current(self, desired_mA: int):
+    def command_current(self, desired_mA: int, do_force_send: bool = False):
         '''Commands current (mA), with positive = PF on right, DF on left.'''
         if abs(desired_mA) > self.max_allowable_current:
             self.command_controller_off()
             raise ValueError(
                 'abs(desired_mA) must be < config.max_allowable_current')
-        fxs.send_motor_command(
-            dev_id=self.dev_id, ctrl_mode=fxe.FX_CURRENT, value=desired_mA)
+        self._send_motor_command(
+            ctrl_mode=fxe.FX_CURRENT, value=desired_mA, do_force_send=do_force_send)
         self.data.commanded_current = desired_mA
         self.data.commanded_position = None
 
@@ -346,16 +535,14 @@ class Exo():
         if abs(desired_mV) > constants.MAX_ALLOWABLE_VOLTAGE_COMMAND:
             raise ValueError(
                 'abs(desired_mV) must be < constants.MAX_ALLOWABLE_VOLTAGE_COMMAND')
-        fxs.send_motor_command(
-            dev_id=self.dev_id, ctrl_mode=fxe.FX_VOLTAGE, value=desired_mV)
+        self._send_motor_command(ctrl_mode=fxe.FX_VOLTAGE, value=desired_mV)
         self.data.commanded_current = None
         self.data.commanded_position = None
         self.data.commanded_torque = None
 
     def command_motor_angle(self, desired_motor_angle: int):
         '''Commands motor angle (counts). Pay attention to the sign!'''
-        fxs.send_motor_command(
-            dev_id=self.dev_id, ctrl_mode=fxe.FX_POSITION, value=desired_motor_angle)
+        self._send_motor_command(ctrl_mode=fxe.FX_POSITION, value=desired_motor_angle)
         self.data.commanded_current = None
         self.data.commanded_position = desired_motor_angle
         self.data.commanded_torque = None
@@ -372,8 +559,7 @@ class Exo():
         if self.k_val != k_val or self.b_val != b_val:
             # Only send gains when necessary
             self.update_gains(k_val=int(k_val), b_val=int(b_val))
-        fxs.send_motor_command(
-            dev_id=self.dev_id, ctrl_mode=fxe.FX_IMPEDANCE, value=int(theta0))
+        self._send_motor_command(ctrl_mode=fxe.FX_IMPEDANCE, value=int(theta0))
         self.data.commanded_current = None
         self.data.commanded_position = None
         self.data.commanded_torque = None
@@ -421,8 +607,8 @@ class Exo():
             theta0=theta0_motor, k_val=K_dephy, b_val=0)
 
     def command_controller_off(self):
-        fxs.send_motor_command(
-            dev_id=self.dev_id, ctrl_mode=fxe.FX_NONE, value=0)
+        # Always sent, since it is used to stop the motor
+        self._send_motor_command(ctrl_mode=fxe.FX_NONE, value=0, do_force_send=True)
 
     def command_slack(self, desired_slack=10000):
         if not self.has_calibrated:
@@ -433,56 +619,92 @@ class Exo():
             raise ValueError('Desired slack must be positive')
         # Desired motor angle requires estimating motor angle from ankle angle and adding/subtracting slack
         desired_motor_angle = int(
-            -1 * self.motor_sign * desired_slack +
-            self.ankle_angle_to_motor_angle(self.data.ankle_angle))
+            -1 * self.motor_sign * desired_slack + self.get_zero_slack_motor_angle())
         self.command_motor_angle(
             desired_motor_angle=desired_motor_angle)
 
     def get_slack(self):
         '''Returns slack in motor counts, with positive = actual slack.'''
-        slack = -1*self.motor_sign*(self.data.motor_angle -
-                                    self.ankle_angle_to_motor_angle(self.data.ankle_angle))
+        slack = -1*self.motor_sign*(self.data.motor_angle - self.get_zero_slack_motor_angle())
         return slack
 
+    def _update_angle_dependent_cache(self):
+        '''Computes the transmission ratio and max allowable torque at the current ankle angle.'''
+        self._cached_ankle_angle = self.data.ankle_angle
+        self._TR = self.TR_from_ankle_angle(self.data.ankle_angle)
+        self._max_allowable_torque = max(
+            0, self.motor_sign*self.max_allowable_current*constants.MOTOR_CURRENT_TO_MOTOR_TORQUE*self._TR)
+        self._zero_slack_motor_angle = None  # Computed when first needed, since it requires calibration
+
+    def get_TR(self) -> float:
+        '''Returns the transmission ratio at the current ankle angle.
+
+        read_data, command_torque, and controllers all need the same angle-dependent quantities
+        during a tick, so they are computed once for each new ankle angle (a new actpack sample,
+        or a replayed row) and reused until it changes.'''
+        if self.data.ankle_angle != self._cached_ankle_angle:
+            self._update_angle_dependent_cache()
+        return self._TR
+
+    def get_zero_slack_motor_angle(self) -> int:
+        '''Returns the motor angle (counts) with zero slack at the current ankle angle.'''
+        if self.data.ankle_angle != self._cached_ankle_angle:
+            self._update_angle_dependent_cache()
+        if self._zero_slack_motor_angle is None:
+            self._zero_slack_motor_angle = self.ankle_angle_to_motor_angle(self.data.ankle_angle)
+        return self._zero_slack_motor_angle
+
     def calculate_max_allowable_torque(self):
         '''Calculates max allowable torque from self.max_allowable_current and ankle_angle.'''
-        max_allowable_torque = max(
-            0, self._motor_current_to_ankle_torque(current=self.motor_sign*self.max_allowable_current))
-        return max_allowable_torque
+        if self.data.ankle_angle != self._cached_ankle_angle:
+            self._update_angle_dependent_cache()
+        return self._max_allowable_torque
 
     def _motor_current_to_ankle_torque(self, current: int) -> float:
         '''Converts current (mA) to torque (Nm), based on side and transmission ratio (no dynamics)'''
         motor_torque = current*constants.MOTOR_CURRENT_TO_MOTOR_TORQUE
-        ankle_torque = motor_torque * \
-            self.TR_from_ankle_angle(self.data.ankle_angle)
+        ankle_torque = motor_torque * self.get_TR()
         return ankle_torque
 
     def _ankle_torque_to_motor_current(self, torque: float) -> int:
         '''Converts torque (Nm) to current (mA), based on side and transmission ratio (no dynamics)'''
-        motor_torque = torque / \
-            self.TR_from_ankle_angle(self.data.ankle_angle)
+        motor_torque = torque / self.get_TR()
         motor_current = int(
             motor_torque / constants.MOTOR_CURRENT_TO_MOTOR_TORQUE)
 
         return motor_current
 
     def ankle_angle_to_motor_angle(self, ankle_angle):
-        '''Calculate equivalent motor position via polynomial evaluation.'''
+        '''Calculate equivalent motor position via the precomputed polynomial lookup table.'''
         if not self.has_calibrated:
             raise ValueError(
                 'Must perform standing calibration before performing this task')
         else:
-            motor_angle = int(np.polyval(
-                self.ankle_to_motor_angle_polynomial, ankle_angle) + self.motor_offset)
+            motor_angle = int(self.ankle_to_motor_angle_table(
+                ankle_angle) + self.motor_offset)
         return motor_angle
 
+    def ankle_setpoint_to_motor_angle(self, ankle_setpoint):
+        '''Memoized ankle_angle_to_motor_angle, for setpoints that rarely change (e.g., impedance).'''
+        try:
+            return self._setpoint_to_motor_angle_cache[ankle_setpoint]
+        except KeyError:
+            motor_angle = self.ankle_angle_to_motor_angle(ankle_setpoint)
+            if len(self._setpoint_to_motor_angle_cache) < 100:  # Keep the cache small
+                self._setpoint_to_motor_angle_cache[ankle_setpoint] = motor_angle
+            return motor_angle
+
     def standing_calibration(self,
                              calibration_mV: int = 1300,
                              max_seconds_to_calibrate: float = 5,
                              current_threshold: float = 1500,
-                             do_zero_ankle_angle: bool = False):
-        '''Brings up slack, calibrates ankle and motor offset angles.'''
-        input(['Press Enter to calibrate exo on ' + str(self.side)])
+                             do_zero_ankle_angle: bool = False,
+                             do_prompt: bool = True):
+        '''Brings up slack, calibrates ankle and motor offset angles.
+
+        If do_prompt is False, starts without waiting for Enter (see calibrate_exos).'''
+        if do_prompt:
+            input(['Press Enter to calibrate exo on ' + str(self.side)])
         time.sleep(0.2)
         print('Calibrating...')
         current_filter = filters.MovingAverage(window_size=10)
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from scipy import interpolate
+
+import config_util
+import constants
+import exoboot
+from exoboot import Exo
+
+
+class Test_DataContainer(unittest.TestCase):
+
+    def test_schema(self):
+        data = Exo.DataContainer(do_include_FSRs=True, do_include_gen_vars=True)
+        self.assertEqual(data.field_names[0], 'state_time')
+        self.assertEqual(data.field_names[-5:],
+                         ('heel_fsr', 'toe_fsr', 'gen_var1', 'gen_var2', 'gen_var3'))
+        self.assertEqual(len(data.field_names), len(data.field_kinds))
+        # Optional fields that were not included are not part of the schema
+        self.assertNotIn('did_slip', data.field_names)
+        with self.assertRaises(AttributeError):
+            data.did_slip
+        # Slots do not allow new fields to be added by accident
+        with self.assertRaises(AttributeError):
+            data.not_a_field = 1
+
+    def test_values(self):
+        data = Exo.DataContainer()
+        data.ankle_angle = 12.5
+        data.did_heel_strike = True
+        values = data.values()
+        self.assertEqual(values[data.field_names.index('ankle_angle')], 12.5)
+        self.assertEqual(data.as_dict()['did_heel_strike'], True)
+
+
+class Test_TransmissionRatio(unittest.TestCase):
+
+    def test_TR_lookup_table_matches_pchip(self):
+        for motor_sign in [-1, 1]:
+            TR_spline = interpolate.PchipInterpolator(
+                constants.ANKLE_PTS, motor_sign*constants.TR_PTS)
+            TR_table = exoboot.get_TR_lookup_table(motor_sign=motor_sign)
+            ankle_angles = np.random.uniform(
+                constants.MIN_ANKLE_ANGLE, constants.MAX_ANKLE_ANGLE, 5000)
+            errors = [TR_table(ankle_angle) - TR_spline(ankle_angle)
+                      for ankle_angle in ankle_angles]
+            self.assertLess(np.max(np.abs(errors)), 1e-4)
+            np.testing.assert_allclose(TR_table.lookup_array(ankle_angles),
+                                       TR_spline(ankle_angles), atol=1e-4)
+
+    def test_ankle_to_motor_lookup_table_matches_polynomial(self):
+        for polynomial in [constants.LEFT_ANKLE_TO_MOTOR, constants.RIGHT_ANKLE_TO_MOTOR]:
+            table = exoboot.get_ankle_to_motor_lookup_table(polynomial)
+            ankle_angles = np.random.uniform(
+                constants.MIN_ANKLE_ANGLE, constants.MAX_ANKLE_ANGLE, 5000)
+            errors = [table(ankle_angle) - np.polyval(polynomial, ankle_angle)
+                      for ankle_angle in ankle_angles]
+            self.assertLess(np.max(np.abs(errors)), 0.01)  # motor counts
+
+
+class Test_SimulatedFlexSEA(unittest.TestCase):
+
+    def setUp(self):
+        self.real_fxs = exoboot.fxs
+        exoboot.use_simulated_flexsea()
+
+    def tearDown(self):
+        exoboot.fxs = self.real_fxs
+
+    def test_read_data_inverts_raw_values(self):
+        for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+            dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+            exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+            exo = Exo(dev_id=dev_id, max_allowable_current=0)
+            exo.read_data()
+            actpack = exoboot.fxs.actpacks[dev_id]
+            self.assertEqual(exo.side, actpack.side)
+            self.assertAlmostEqual(exo.data.ankle_angle, actpack.ankle_angle,
+                                   delta=constants.ENC_CLICKS_TO_DEG)
+
+    def test_standing_calibration_finds_motor_offset(self):
+        dev_id = exoboot.fxs.open('/dev/ttyACM0', constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+        exo = Exo(dev_id=dev_id, max_allowable_current=0)
+        with mock.patch('builtins.input'):
+            exo.standing_calibration()
+        # Within the error from the ankle encoder resolution
+        self.assertAlmostEqual(exo.motor_offset, exoboot.fxs.actpacks[dev_id].motor_offset,
+                               delta=10)
+        self.assertLess(abs(exo.get_slack()), 10)
+
+    def test_angle_dependent_quantities_computed_once_per_sample(self):
+        dev_id = exoboot.fxs.open('/dev/ttyACM1', constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+        exo = Exo(dev_id=dev_id, max_allowable_current=20000)
+        with mock.patch('builtins.input'):
+            exo.standing_calibration()
+        TR_table = exo.TR_from_ankle_angle
+        with mock.patch.object(exo, 'TR_from_ankle_angle', wraps=TR_table) as TR_lookup:
+            for ankle_angle in [10, 10, 20.5]:
+                exo.data.ankle_angle = ankle_angle
+                exo.data.motor_angle = 5000
+                TR = TR_table(ankle_angle)
+                self.assertEqual(exo.get_TR(), TR)
+                self.assertEqual(exo.calculate_max_allowable_torque(), max(
+                    0, exo.motor_sign*20000*constants.MOTOR_CURRENT_TO_MOTOR_TORQUE*TR))
+                self.assertEqual(exo.get_slack(), -exo.motor_sign*(
+                    5000 - exo.ankle_angle_to_motor_angle(ankle_angle)))
+                exo.command_torque(desired_torque=5)
+            self.assertEqual(TR_lookup.call_count, 2)
+        # The zero-slack motor angle depends on the motor offset
+        slack = exo.get_slack()
+        exo.motor_offset += 100
+        self.assertEqual(exo.get_slack(), slack + exo.motor_sign*100)
+
+    def test_repeated_gains_and_motor_commands_are_suppressed(self):
+        dev_id = exoboot.fxs.open('/dev/ttyACM0', constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+        exo = Exo(dev_id=dev_id, max_allowable_current=20000)
+        with mock.patch.object(exoboot.fxs, 'set_gains') as set_gains, \
+                mock.patch.object(exoboot.fxs, 'send_motor_command') as send_motor_command:
+            for _ in range(3):
+                exo.update_gains(Kp=20, Ki=200, Kd=0, ff=60)
+                exo.command_current(desired_mA=1000)
+            # Gains are sent again on the tick after a change of control mode
+            self.assertEqual(set_gains.call_count, 2)
+            self.assertEqual(send_motor_command.call_count, 1)
+            exo.command_voltage(desired_mV=1000)
+            exo.update_gains(Kp=20, Ki=200, Kd=0, ff=60)
+            exo.update_gains(Kp=20, Ki=200, Kd=0, ff=60)
+            exo.command_voltage(desired_mV=1000)
+            self.assertEqual(set_gains.call_count, 3)
+            self.assertEqual(send_motor_command.call_count, 2)
+            # Stopping the motor is always sent
+            exo.command_controller_off()
+            exo.command_controller_off()
+            self.assertEqual(send_motor_command.call_count, 4)
+            exo.update_gains(do_force_send=True)
+            self.assertEqual(set_gains.call_count, 4)
+        self.assertEqual(exo.num_gains_sent, 5)  # Including the gains sent when Exo was created
+        self.assertEqual(exo.num_gains_suppressed, 2)
+        self.assertEqual(exo.num_motor_commands_sent, 4)
+        self.assertEqual(exo.num_motor_commands_suppressed, 3)
+
+    def test_connect_calibrate_and_close_exos_at_once(self):
+        config = config_util.ConfigurableConstants(DO_SIMULATE_EXOS=True)
+        exo_list = exoboot.connect_to_exos(file_ID=None, config=config)
+        self.assertCountEqual([exo.side for exo in exo_list],
+                              [constants.Side.LEFT, constants.Side.RIGHT])
+        with mock.patch('builtins.input') as prompt:
+            standing_angles = exoboot.calibrate_exos(exo_list)
+        self.assertEqual(prompt.call_count, 1)
+        for exo, standing_angle in zip(exo_list, standing_angles):
+            self.assertTrue(exo.has_calibrated)
+            self.assertIsNotNone(standing_angle)
+            self.assertAlmostEqual(exo.motor_offset,
+                                   exoboot.fxs.actpacks[exo.dev_id].motor_offset, delta=10)
+        t0 = time.perf_counter()
+        exoboot.close_exos(exo_list)
+        self.assertLess(time.perf_counter() - t0, 0.6)  # Each exo takes 0.35 s to close
+        self.assertEqual(exoboot.fxs.actpacks, {})
+
+
+class Test_DiscoverPorts(unittest.TestCase):
+
+    def test_ports_in_numerical_order(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ['ttyACM10', 'ttyACM2', 'ttyACM0', 'ttyUSB0']:
+                open(os.path.join(folder, name), 'w').close()
+            ports = exoboot.discover_ports(pattern=os.path.join(folder, 'ttyACM*'))
+        self.assertEqual([os.path.basename(port) for port in ports],
+                         ['ttyACM0', 'ttyACM2', 'ttyACM10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 from scipy import signal
 import numpy as np
 import collections
+import heapq
+import math
 
 
 class Filter(object):
@@ -13,14 +15,26 @@ class Filter(object):
     def filter(self, new_val):
         raise ValueError('filter() not implemented for child class of Filter')
 
+    def filter_array(self, values) -> np.ndarray:
+        '''Filters a whole recording. Child classes can override this with a vectorized version,
+        but it must give the same values as calling filter() on each value in turn.'''
+        return np.array([self.filter(value) for value in values])
+
 
 class PassThroughFilter(Filter):
     def filter(self, new_val):
         return new_val
 
+    def filter_array(self, values) -> np.ndarray:
+        return np.array(values)
+
 
 class Butterworth():
-    '''Implements a real-time Butterworth filter using second orded cascaded filters.'''
+    '''Implements a real-time Butterworth filter using second orded cascaded filters.
+
+    Each second order section (biquad) is run in transposed direct form II, the same form
+    used by scipy.signal.sosfilt, with coefficients and state stored as python floats. This
+    avoids allocating arrays and scipy's argument checking on every sample.'''
 
     def __init__(self, N: int, Wn: float, btype='low', fs=None):
         ''' 
@@ -39,28 +53,218 @@ class Butterworth():
             self._Wn = Wn
         self.sos = signal.butter(N=self.N, Wn=self._Wn,
                                  btype=self.btype, output='sos')
-        self.zi = signal.sosfilt_zi(self.sos)
-        self.first_value = True
+        # (b0, b1, b2, a1, a2) for each section. a0 is always 1 for sos output.
+        self._sections = [(b0, b1, b2, a1, a2) for b0, b1, b2, _, a1, a2
+                          in self.sos.tolist()]
+        # Steady state of each section for a unit step, scaled by the first value
+        self._unit_zi = signal.sosfilt_zi(self.sos).tolist()
+        self.restart()
 
     def filter(self, new_val: float) -> float:
         if self.first_value:
-            self.zi = self.zi*new_val
+            self.zi = [[z0*new_val, z1*new_val] for z0, z1 in self._unit_zi]
+            self.first_value = False
+        x = new_val
+        for (b0, b1, b2, a1, a2), z in zip(self._sections, self.zi):
+            y = b0*x + z[0]
+            z[0] = b1*x - a1*y + z[1]
+            z[1] = b2*x - a2*y
+            x = y
+        return x
+
+    def filter_array(self, values) -> np.ndarray:
+        '''Filters a whole recording with scipy.signal.sosfilt. sosfilt runs the same sections in
+        the same order, so the output, and the state left for the next filter() call, are
+        identical to calling filter() on each value in turn.'''
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return values.copy()
+        if self.first_value:
+            first_val = float(values[0])
+            self.zi = [[z0*first_val, z1*first_val] for z0, z1 in self._unit_zi]
             self.first_value = False
-        filtered_val, self.zi = signal.sosfilt(
-            sos=self.sos, x=[new_val], zi=self.zi)
-        return filtered_val[0]
+        filtered, final_zi = signal.sosfilt(self.sos, values, zi=np.array(self.zi))
+        self.zi = final_zi.tolist()
+        return filtered
 
     def restart(self):
-        self.__init__(N=self.N, Wn=self._Wn)
+        '''Clears the filter state, so the next value re-initializes it.'''
+        self.first_value = True
+
+
+class FilterBank():
+    '''Implements real-time Butterworth filtering of several channels at once.
+
+    All channels share the same coefficients. The cascaded sections are combined into one
+    state-space matrix, so each call is a single matrix product over a (states + 1, num_channels)
+    array, instead of N python round trips through separate filters.'''
+
+    def __init__(self, num_channels: int, N: int, Wn: float, btype='low', fs=None):
+        '''
+        num_channels: number of values passed to (and returned from) filter()
+        N, Wn, btype, fs: same as Butterworth
+        '''
+        self.num_channels = num_channels
+        self.N = N
+        self.fs = fs
+        self.Wn = Wn
+        self.btype = btype
+        if self.fs is not None:
+            self._Wn = self.Wn/(self.fs/2)
+        else:
+            self._Wn = Wn
+        self.sos = signal.butter(N=self.N, Wn=self._Wn,
+                                 btype=self.btype, output='sos')
+        self._matrix = self._get_state_space_matrix(self.sos)
+        num_states = 2*len(self.sos)
+        self._unit_zi = signal.sosfilt_zi(self.sos).reshape(num_states, 1)
+        # Rows are the section states (z0, z1 of each section), then the newest input
+        self._state = np.zeros((num_states + 1, self.num_channels))
+        self._next_state = np.zeros((num_states + 1, self.num_channels))
+        self.restart()
+
+    @staticmethod
+    def _get_state_space_matrix(sos: np.ndarray) -> np.ndarray:
+        '''Combines cascaded sections (transposed direct form II) into one matrix M, such that
+        [next section states; output] = M @ [section states; input].'''
+        num_states = 2*len(sos)
+        # Each quantity is a row vector of coefficients on [section states; input]
+        x = np.zeros(num_states + 1)
+        x[-1] = 1
+        matrix = np.zeros((num_states + 1, num_states + 1))
+        for i, (b0, b1, b2, _, a1, a2) in enumerate(sos):
+            z0 = np.zeros(num_states + 1)
+            z0[2*i] = 1
+            z1 = np.zeros(num_states + 1)
+            z1[2*i + 1] = 1
+            y = b0*x + z0
+            matrix[2*i] = b1*x - a1*y + z1
+            matrix[2*i + 1] = b2*x - a2*y
+            x = y  # The output of this section is the input to the next
+        matrix[-1] = x
+        return matrix
+
+    def filter(self, new_vals) -> np.ndarray:
+        '''Filters one sample of every channel. new_vals is a sequence of length num_channels.'''
+        state = self._state
+        state[-1] = new_vals
+        if self.first_value:
+            np.multiply(self._unit_zi, state[-1], out=state[:-1])
+            self.first_value = False
+        np.dot(self._matrix, state, out=self._next_state)
+        self._state, self._next_state = self._next_state, state
+        # The last row now holds the outputs; it is overwritten by the inputs on the next call
+        return self._state[-1].copy()
+
+    def restart(self):
+        '''Clears the filter state, so the next values re-initialize it.'''
+        self.first_value = True
 
 
 class MovingAverage(Filter):
-    '''Implements a real-time moving average filter.'''
+    '''Implements a real-time moving average filter, using an O(1) running sum.'''
 
-    def __init__(self, window_size):
+    def __init__(self, window_size, recompute_interval=1000):
+        '''
+        window_size: number of recent values to average
+        recompute_interval: the running sum is recomputed from the window every this many values,
+            so floating point error cannot accumulate over long recordings
+        '''
+        self.window_size = window_size
+        self.recompute_interval = recompute_interval
         self.deque = collections.deque([], maxlen=window_size)
+        self.running_sum = 0
+        self.num_since_recompute = 0
 
     def filter(self, new_val):
-        # TODO: Optimize for efficiency if window size is large
+        if len(self.deque) == self.window_size:
+            self.running_sum -= self.deque[0]  # Oldest value is about to be dropped
         self.deque.append(new_val)
-        return np.mean(self.deque)
+        self.running_sum += new_val
+        self.num_since_recompute += 1
+        if self.num_since_recompute >= self.recompute_interval:
+            self.running_sum = math.fsum(self.deque)
+            self.num_since_recompute = 0
+        return self.running_sum/len(self.deque)
+
+
+class MovingMedian(Filter):
+    '''Implements a real-time moving median filter, e.g., to reject spikes in angle or current.
+
+    The window is split into a max heap (smaller half) and a min heap (larger half). Values that
+    leave the window are deleted lazily, when they reach the top of a heap. Values buried lower in
+    a heap can stay there, so the heaps are rebuilt from the window once the number of stale
+    values exceeds window_size. Each new value costs O(log n), amortized.'''
+
+    def __init__(self, window_size):
+        if window_size < 1:
+            raise ValueError('window_size must be >= 1')
+        self.window_size = window_size
+        self.deque = collections.deque()
+        self._low = []  # Smaller half, stored negated so heapq acts as a max heap
+        self._high = []  # Larger half
+        self._low_size = 0  # Number of values in the heaps that are still in the window
+        self._high_size = 0
+        self._to_remove = {}  # {value: number of stale copies in the heaps}
+
+    def filter(self, new_val):
+        if self._low_size == 0 or new_val <= -self._low[0]:
+            heapq.heappush(self._low, -new_val)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, new_val)
+            self._high_size += 1
+        self.deque.append(new_val)
+
+        if len(self.deque) > self.window_size:
+            old_val = self.deque.popleft()
+            self._to_remove[old_val] = self._to_remove.get(old_val, 0) + 1
+            # Heap tops are always valid, so this tells which half old_val belongs to
+            if old_val <= -self._low[0]:
+                self._low_size -= 1
+            else:
+                self._high_size -= 1
+            self._prune_heaps()
+            num_stale = len(self._low) + len(self._high) - self._low_size - self._high_size
+            if num_stale > self.window_size:
+                self._rebuild_heaps()
+
+        # Balance so the low half has the same number, or one more, valid values
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune_heaps()
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._high_size -= 1
+            self._low_size += 1
+            self._prune_heaps()
+
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        else:
+            return (-self._low[0] + self._high[0])/2
+
+    def _prune_heaps(self):
+        '''Pops values that have left the window off the tops of both heaps.'''
+        while self._low and -self._low[0] in self._to_remove:
+            self._remove_stale(-heapq.heappop(self._low))
+        while self._high and self._high[0] in self._to_remove:
+            self._remove_stale(heapq.heappop(self._high))
+
+    def _remove_stale(self, value):
+        if self._to_remove[value] == 1:
+            del self._to_remove[value]
+        else:
+            self._to_remove[value] -= 1
+
+    def _rebuild_heaps(self):
+        '''Rebuilds both heaps from the values in the window, dropping every stale value.'''
+        window = sorted(self.deque)
+        self._low_size = (len(window) + 1)//2
+        self._high_size = len(window) - self._low_size
+        self._low = [-value for value in window[:self._low_size]]
+        self._high = window[self._low_size:]
+        heapq.heapify(self._low)  # self._high is sorted, so it is already a heap
+        self._to_remove = {}
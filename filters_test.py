@@ -23,6 +23,46 @@ class Test_custom_filters(unittest.TestCase):
 
         self.assertListEqual(y.tolist(), y_real_time_filter)
 
+    def test_Butterworth_high_and_bandpass(self):
+        x = np.random.randn(500)
+        for N, Wn, btype in [(2, 0.01, 'high'), (3, 0.2, 'low'), (2, [0.1, 0.3], 'bandpass')]:
+            sos = signal.butter(N, Wn, btype=btype, output='sos')
+            zi = signal.sosfilt_zi(sos)
+            y, _ = signal.sosfilt(sos, x, zi=zi*x[0])
+            test_filter = filters.Butterworth(N=N, Wn=Wn, btype=btype)
+            y_real_time_filter = [test_filter.filter(new_val) for new_val in x]
+            np.testing.assert_allclose(y_real_time_filter, y, rtol=1e-12, atol=1e-12)
+
+    def test_Butterworth_restart(self):
+        test_filter = filters.Butterworth(N=2, Wn=10, btype='high', fs=200)
+        first_pass = [test_filter.filter(new_val) for new_val in range(20)]
+        test_filter.restart()
+        second_pass = [test_filter.filter(new_val) for new_val in range(20)]
+        self.assertListEqual(first_pass, second_pass)
+
+    def test_Butterworth_filter_array(self):
+        # Identical to filtering one value at a time, including the state left afterwards
+        x = np.random.randn(1000)*300
+        for N, Wn, btype in [(2, 5, 'low'), (3, 20, 'low'), (2, 10, 'high')]:
+            real_time_filter = filters.Butterworth(N=N, Wn=Wn, btype=btype, fs=200)
+            y_real_time_filter = [real_time_filter.filter(new_val) for new_val in x.tolist()]
+            array_filter = filters.Butterworth(N=N, Wn=Wn, btype=btype, fs=200)
+            y_array_filter = array_filter.filter_array(x[:600]).tolist()
+            y_array_filter.extend(array_filter.filter(new_val) for new_val in x[600:].tolist())
+            self.assertListEqual(y_array_filter, y_real_time_filter)
+        self.assertListEqual(filters.PassThroughFilter().filter_array([1, 2]).tolist(), [1, 2])
+
+    def test_FilterBank(self):
+        # Each channel should behave like scipy.sosfilt on that channel
+        x = np.random.randn(300, 6)
+        sos = signal.butter(2, 0.01, btype='high', output='sos')
+        zi = signal.sosfilt_zi(sos)
+        test_filter = filters.FilterBank(num_channels=6, N=2, Wn=0.01, btype='high')
+        y_real_time_filter = np.array([test_filter.filter(new_vals) for new_vals in x])
+        for channel in range(6):
+            y, _ = signal.sosfilt(sos, x[:, channel], zi=zi*x[0, channel])
+            np.testing.assert_allclose(y_real_time_filter[:, channel], y, rtol=1e-9, atol=1e-12)
+
     def test_MovingAverageFilter(self):
         test_filter = filters.MovingAverage(window_size=3)
         test_signal = [0, 1, 5, 3, 4, -10, 3, 6, 0]
@@ -33,6 +73,37 @@ class Test_custom_filters(unittest.TestCase):
         for true_val, test_val in zip(correct_answer, filtered_answer):
             self.assertAlmostEqual(true_val, test_val)
 
+    def test_MovingAverage_recompute(self):
+        # Matches np.mean over the window, including across running sum recomputes
+        x = np.random.randn(500)*1000 + 1e6
+        test_filter = filters.MovingAverage(window_size=20, recompute_interval=50)
+        for i, value in enumerate(x):
+            self.assertAlmostEqual(test_filter.filter(value), np.mean(x[max(0, i-19):i+1]),
+                                   places=6)
+
+    def test_MovingMedian(self):
+        test_filter = filters.MovingMedian(window_size=3)
+        test_signal = [0, 1, 5, 3, 4, -10, 3, 6, 0]
+        correct_answer = [0, 0.5, 1, 3, 4, 3, 3, 3, 3]
+        filtered_answer = [test_filter.filter(signal_value) for signal_value in test_signal]
+        self.assertListEqual(filtered_answer, correct_answer)
+        # Repeated values exercise the lazy deletion from both heaps
+        for window_size in [1, 2, 5, 8]:
+            test_filter = filters.MovingMedian(window_size=window_size)
+            x = np.random.randint(-3, 4, size=300)
+            for i, value in enumerate(x):
+                self.assertEqual(test_filter.filter(value),
+                                 np.median(x[max(0, i-window_size+1):i+1]))
+
+    def test_MovingMedian_heaps_stay_bounded(self):
+        # On a ramp, values leave the window from the bottom of the low heap, never its top
+        for x in [np.arange(20000), -np.arange(20000)]:
+            test_filter = filters.MovingMedian(window_size=10)
+            for i, value in enumerate(x):
+                self.assertEqual(test_filter.filter(value), np.median(x[max(0, i-9):i+1]))
+                self.assertLessEqual(len(test_filter._low) + len(test_filter._high), 21)
+                self.assertLessEqual(len(test_filter._to_remove), 11)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,6 @@ import filters
 import exoboot
 from scipy import signal
 from collections import deque
-import time
 import constants
 from typing import Type
 import util
@@ -57,6 +56,7 @@ class MLGaitStateEstimator():
         self.last_is_stance = False
         self.stride_average_gait_state_estimator = StrideAverageGaitPhaseEstimator()
         self.jetson_object = jetson_interface
+        self.do_log_telemetry = 'ml_seq' in self.data.field_names
         print(
             'REMEMBER TO PRESS a TO MAKE CONTROLLER ACTIVE (INACTIVE TO START BY DEFAULT)')
 
@@ -89,12 +89,34 @@ class MLGaitStateEstimator():
         self.jetson_object.package_and_send_message(
             side=self.side, data_container=self.data)
         self.jetson_object.grab_message_and_parse()
-        my_gait_phase_info = self.jetson_object.get_most_recent_gait_phase(
-            side=self.side)
-        if my_gait_phase_info is not None:
-            gait_phase, is_stance = my_gait_phase_info
-        else:
+
+        # use stride average gait phase estimator to determine if steady state and mask. Fed
+        # every tick, even without a prediction, so its stride timing stays right
+        self.fake_data.gyro_z = self.data.gyro_z
+        self.parallel_tbe.detect()
+        if self.fake_data.gait_phase is not None:
+            self.fake_data.gait_phase = self.fake_data.gait_phase*1/0.6
+            if self.fake_data.gait_phase > 1:
+                self.fake_data.gait_phase = 0
+        self.data.gen_var3 = self.fake_data.gait_phase
+
+        prediction = self.jetson_object.get_most_recent_prediction(side=self.side)
+        if prediction is None:
+            # No prediction yet, or it is too old to use: gait_phase is None, so controllers
+            # command no torque, rather than acting on an old gait phase
+            self.data.gait_phase = None
+            self.data.did_heel_strike = False
+            self.data.did_toe_off = False
             return
+        gait_phase = prediction.gait_phase
+        is_stance = prediction.is_stance
+        prediction_age = self.jetson_object.record_prediction_use(
+            side=self.side, prediction=prediction)
+        if self.do_log_telemetry:
+            self.data.ml_seq = prediction.seq
+            self.data.ml_rtt = (None if prediction.send_time is None else
+                                prediction.arrival_time - prediction.send_time)
+            self.data.ml_prediction_age = prediction_age
         gait_phase = self.gait_phase_filter.filter(gait_phase)
         if gait_phase < 0:
             gait_phase = 0
@@ -115,14 +137,6 @@ class MLGaitStateEstimator():
             self.data.did_toe_off = True
         self.last_is_stance = is_stance
 
-        # use stride average gait phase estimator to determine if steady state and mask
-        self.fake_data.gyro_z = self.data.gyro_z
-        self.parallel_tbe.detect()
-        if self.fake_data.gait_phase is not None:
-            self.fake_data.gait_phase = self.fake_data.gait_phase*1/0.6
-            if self.fake_data.gait_phase > 1:
-                self.fake_data.gait_phase = 0
-        self.data.gen_var3 = self.fake_data.gait_phase
         # if self.fake_data.gait_phase is not None:
         #     self.data.gait_phase = gait_phase
         # else:
@@ -135,6 +149,10 @@ class MLGaitStateEstimator():
     def update_params_from_config(self, config: Type[config_util.ConfigurableConstants]):
         pass
 
+    def print_stats(self):
+        '''Prints round trip times, prediction ages, and dropped/duplicate counts.'''
+        self.jetson_object.print_telemetry_summary(side=self.side)
+
 
 class GyroHeelStrikeDetector():
     def __init__(self, height: float, gyro_filter: Type[filters.Filter], delay=0):
@@ -209,7 +227,7 @@ class StrideAverageGaitPhaseEstimator():
             window_size=num_strides_to_average)
 
     def estimate(self, data: Type[exoboot.Exo.DataContainer]):
-        time_now = time.perf_counter()
+        time_now = util.get_time()
         if data.did_heel_strike:
             stride_duration = time_now - self.time_of_last_heel_strike
             self.last_stride_durations.append(stride_duration)
@@ -229,6 +247,116 @@ class StrideAverageGaitPhaseEstimator():
         return gait_phase
 
 
+def detect_heel_strikes_batch(gyro_z: np.ndarray,
+                              times: np.ndarray,
+                              height: float,
+                              gyro_filter: Type[filters.Filter] = None,
+                              delay: float = 0) -> np.ndarray:
+    '''Returns the indices where GyroHeelStrikeDetector would return True, for a whole recording.
+
+    times are what util.get_time() returns on each call, and must not decrease. A peak at
+    the previous sample starts the delay timer, and a later peak restarts it, so a heel strike is
+    returned at the first sample where times >= peak time + delay, unless another peak comes
+    first. Peaks are sparse, so only the timer logic loops in python.'''
+    times = np.asarray(times, dtype=float)
+    if gyro_filter is None:
+        gyro_filter = filters.PassThroughFilter()
+    filtered_gyro_z = np.asarray(gyro_filter.filter_array(gyro_z), dtype=float)
+    # The streaming detector's history starts with two zeros
+    padded = np.concatenate(([0, 0], filtered_gyro_z))
+    previous = padded[1:-1]
+    is_peak = ((previous > height) & (previous > filtered_gyro_z) &
+               (previous > padded[:-2]))
+    peak_indices = np.flatnonzero(is_peak).tolist()
+    # First index at which a timer started at each peak would go off
+    fire_indices = np.maximum(
+        np.searchsorted(times, times[peak_indices] + delay, side='left'),
+        peak_indices).tolist()
+    heel_strike_indices = []
+    for i, peak_index in enumerate(peak_indices):
+        # The timer is restarted by the next peak, before it is checked on that sample
+        next_peak_index = peak_indices[i+1] if i+1 < len(peak_indices) else len(times)
+        if fire_indices[i] < next_peak_index:
+            heel_strike_indices.append(fire_indices[i])
+    return np.array(heel_strike_indices, dtype=int)
+
+
+def estimate_gait_phase_batch(heel_strike_indices: np.ndarray,
+                              times: np.ndarray,
+                              num_strides_required: int = 2,
+                              num_strides_to_average: int = 2,
+                              min_allowable_stride_duration: float = 0.6,
+                              max_allowable_stride_duration: float = 2) -> np.ndarray:
+    '''Returns the gait phase StrideAverageGaitPhaseEstimator would return at every sample, with
+    NaN in place of None. Args are the same as StrideAverageGaitPhaseEstimator's.
+
+    Stride validity and the mean stride duration only change at heel strikes, so they are worked
+    out once per stride, with the same deque and MovingAverage, and then applied to every sample
+    of the stride at once.'''
+    times = np.asarray(times, dtype=float)
+    gait_phase = np.full(len(times), np.nan)
+    estimator = StrideAverageGaitPhaseEstimator(
+        num_strides_required=num_strides_required,
+        num_strides_to_average=num_strides_to_average,
+        min_allowable_stride_duration=min_allowable_stride_duration,
+        max_allowable_stride_duration=max_allowable_stride_duration)
+    max_time_since_heel_strike = 1.2 * max_allowable_stride_duration
+    heel_strike_indices = np.asarray(heel_strike_indices, dtype=int).tolist()
+    stride_ends = heel_strike_indices[1:] + [len(times)]
+    # Before the first heel strike, the initial stride durations are never allowable
+    for start, end in zip(heel_strike_indices, stride_ends):
+        heel_strike_time = times[start]
+        stride_duration = heel_strike_time - estimator.time_of_last_heel_strike
+        estimator.last_stride_durations.append(stride_duration)
+        estimator.time_of_last_heel_strike = heel_strike_time
+        mean_stride_duration = estimator.stride_duration_filter.filter(stride_duration)
+        if not all(min_allowable_stride_duration < last_stride_duration
+                   < max_allowable_stride_duration for last_stride_duration
+                   in estimator.last_stride_durations):
+            continue
+        time_since_heel_strike = times[start:end] - heel_strike_time
+        is_valid = time_since_heel_strike < max_time_since_heel_strike
+        gait_phase[start:end][is_valid] = np.minimum(
+            1, time_since_heel_strike[is_valid]/mean_stride_duration)
+    return gait_phase
+
+
+def detect_toe_offs_batch(gait_phase: np.ndarray, fraction_of_gait: float) -> np.ndarray:
+    '''Returns the indices where GaitPhaseBasedToeOffDetector would return True, given the gait
+    phase at every sample (NaN for None).
+
+    Samples with gait phase below fraction_of_gait re-arm the detector, and samples above it
+    fire it once, so a toe off is the first sample above after a sample below (or the first
+    sample above). NaN, and samples exactly at fraction_of_gait, do neither.'''
+    gait_phase = np.asarray(gait_phase, dtype=float)
+    is_above = gait_phase > fraction_of_gait
+    relevant_indices = np.flatnonzero(is_above | (gait_phase < fraction_of_gait))
+    relevant_is_above = is_above[relevant_indices]
+    follows_below = np.concatenate(([True], ~relevant_is_above[:-1]))
+    return relevant_indices[relevant_is_above & follows_below]
+
+
+def detect_gait_events_batch(gyro_z: np.ndarray,
+                             times: np.ndarray,
+                             height: float,
+                             gyro_filter: Type[filters.Filter] = None,
+                             delay: float = 0,
+                             num_strides_required: int = 2,
+                             fraction_of_gait: float = 0.6):
+    '''Runs the batch versions of GyroHeelStrikeDetector, StrideAverageGaitPhaseEstimator, and
+    GaitPhaseBasedToeOffDetector (as control_muxer combines them) on a whole recording.
+
+    Returns (heel strike indices, gait phase array with NaN for None, toe off indices).'''
+    heel_strike_indices = detect_heel_strikes_batch(
+        gyro_z=gyro_z, times=times, height=height, gyro_filter=gyro_filter, delay=delay)
+    gait_phase = estimate_gait_phase_batch(
+        heel_strike_indices=heel_strike_indices, times=times,
+        num_strides_required=num_strides_required)
+    toe_off_indices = detect_toe_offs_batch(
+        gait_phase=gait_phase, fraction_of_gait=fraction_of_gait)
+    return heel_strike_indices, gait_phase, toe_off_indices
+
+
 class BilateralSlipDetectorParent():
     def __init__(self,
                  exo_1: Type[exoboot.Exo],
@@ -329,23 +457,22 @@ class BilateralSlipDetectorIMU(BilateralSlipDetectorParent):
         self.max_acc_y = max_acc_y
         self.max_acc_z = max_acc_z
         self.do_filter_accels = do_filter_accels
-        self.filter_list = [[
-            filters.Butterworth(N=2, Wn=0.01, btype='high'),
-            filters.Butterworth(N=2, Wn=0.01, btype='high'),
-            filters.Butterworth(N=2, Wn=0.01, btype='high')],
-            [filters.Butterworth(N=2, Wn=0.01, btype='high'),
-             filters.Butterworth(N=2, Wn=0.01, btype='high'),
-             filters.Butterworth(N=2, Wn=0.01, btype='high')]]
+        # Filters accel x, y, z of exo_1, then accel x, y, z of exo_2, in one call
+        self.accel_filter_bank = filters.FilterBank(
+            num_channels=6, N=2, Wn=0.01, btype='high')
         self.shuffling_timer = util.DelayTimer(
             delay_time=required_seconds_of_stillness,
             true_until=True)
 
     def detect_slip(self):
-        for exo, filt in zip(self.exo_list, self.filter_list):
+        data_1 = self.exo_list[0].data
+        data_2 = self.exo_list[1].data
+        filtered_accels = self.accel_filter_bank.filter(
+            [data_1.accel_x, data_1.accel_y-1, data_1.accel_z,
+             data_2.accel_x, data_2.accel_y-1, data_2.accel_z]).tolist()
+        for i, exo in enumerate(self.exo_list):
             data = exo.data
-            accel_x = filt[0].filter(data.accel_x)
-            accel_y = filt[1].filter(data.accel_y-1)
-            accel_z = filt[2].filter(data.accel_z)
+            accel_x, accel_y, accel_z = filtered_accels[3*i:3*i+3]
             data.gen_var1 = accel_x
             data.gen_var2 = accel_y
             data.gen_var3 = accel_z
@@ -3,7 +3,11 @@ import gait_state_estimators
 import unittest
 import matplotlib.pyplot as plt
 from exoboot import Exo
+import constants
+import controllers
 import filters
+import ml_util
+import util
 
 
 class TestGaitEventDetectors(unittest.TestCase):
@@ -60,5 +64,171 @@ class TestGaitEventDetectors(unittest.TestCase):
         plt.show()
 
 
+class EchoClientTCP():
+    '''Answers every request at once (until is_answering is False), with gait phase 0.3, in
+    stance.'''
+
+    def __init__(self):
+        self.to_receive = b''
+        self.is_answering = True
+
+    def to_server(self, msg):
+        if not self.is_answering:
+            return
+        side, seq, send_time, _ = ml_util.unpack_request(msg)
+        self.to_receive += ml_util.pack_response(
+            side=side, seq=seq, send_time=send_time, gait_phase=0.3, is_stance=1.0)
+
+    def from_server_bytes(self, timeout=0.0001):
+        data, self.to_receive = self.to_receive, b''
+        return data
+
+
+class TorqueRecordingExo():
+    '''Stands in for an Exo with data, and records commanded torques.'''
+
+    def __init__(self, data):
+        self.data = data
+        self.commanded_torques = []
+
+    def command_torque(self, desired_torque):
+        self.commanded_torques.append(desired_torque)
+
+
+class TestMLGaitStateEstimator(unittest.TestCase):
+
+    def test_telemetry_fields(self):
+        clock = util.VirtualClock(start_time=50)
+        util.set_time_source(clock)
+        try:
+            jetson_interface = ml_util.JetsonInterface(do_set_up_server=False,
+                                                       use_binary_protocol=True,
+                                                       max_prediction_age=0.1)
+            jetson_interface.clienttcp = EchoClientTCP()
+            data = Exo.DataContainer(do_include_gen_vars=True, do_include_ml_telemetry=True)
+            gait_state_estimator = gait_state_estimators.MLGaitStateEstimator(
+                side=constants.Side.RIGHT, data_container=data,
+                jetson_interface=jetson_interface, do_print_heel_strikes=False)
+            for i in range(3):
+                clock.set_time(50 + i/100)
+                gait_state_estimator.detect()
+            self.assertEqual(data.gait_phase, 0.30000001192092896)  # float32
+            self.assertEqual(data.ml_seq, 3)
+            self.assertEqual(data.ml_rtt, 0)
+            self.assertEqual(data.ml_prediction_age, 0)
+            self.assertEqual(jetson_interface.telemetry[1].get_stats()['num_answered'], 3)
+        finally:
+            util.set_time_source()
+
+    def test_stale_prediction_stops_torque(self):
+        clock = util.VirtualClock(start_time=50)
+        util.set_time_source(clock)
+        try:
+            jetson_interface = ml_util.JetsonInterface(do_set_up_server=False,
+                                                       use_binary_protocol=True,
+                                                       max_prediction_age=0.1)
+            jetson_interface.clienttcp = EchoClientTCP()
+            data = Exo.DataContainer(do_include_gen_vars=True)
+            gait_state_estimator = gait_state_estimators.MLGaitStateEstimator(
+                side=constants.Side.RIGHT, data_container=data,
+                jetson_interface=jetson_interface, do_print_heel_strikes=False)
+            controller = controllers.GenericSplineController(
+                exo=TorqueRecordingExo(data), spline_x=[0, 0.3, 1], spline_y=[0, 10, 0])
+            data.gyro_z = 1
+            gait_state_estimator.detect()
+            controller.command()
+            self.assertAlmostEqual(controller.exo.commanded_torques[-1], 10, places=5)
+            # The Jetson stops answering: once its last prediction is stale, gait_phase is
+            # None, so no torque is commanded, while the stride estimator still gets the gyro
+            jetson_interface.clienttcp.is_answering = False
+            clock.set_time(50.2)
+            data.gyro_z = 2
+            gait_state_estimator.detect()
+            controller.command()
+            self.assertIsNone(data.gait_phase)
+            self.assertEqual(controller.exo.commanded_torques[-1], 0)
+            self.assertEqual(gait_state_estimator.fake_data.gyro_z, 2)
+        finally:
+            util.set_time_source()
+
+
+class TestBatchGaitEventDetectors(unittest.TestCase):
+
+    def run_streaming_detectors(self, times, gyro_z, height, gyro_filter, delay,
+                                num_strides_required, fraction_of_gait):
+        clock = util.VirtualClock()
+        util.set_time_source(clock)
+        try:
+            data = Exo.DataContainer()
+            gait_event_detector = gait_state_estimators.GaitStateEstimator(
+                data_container=data,
+                heel_strike_detector=gait_state_estimators.GyroHeelStrikeDetector(
+                    height=height, gyro_filter=gyro_filter, delay=delay),
+                gait_phase_estimator=gait_state_estimators.StrideAverageGaitPhaseEstimator(
+                    num_strides_required=num_strides_required),
+                toe_off_detector=gait_state_estimators.GaitPhaseBasedToeOffDetector(
+                    fraction_of_gait=fraction_of_gait))
+            did_heel_strikes = []
+            gait_phases = []
+            did_toe_offs = []
+            for time_now, gyro_value in zip(times.tolist(), gyro_z.tolist()):
+                clock.set_time(time_now)
+                data.gyro_z = gyro_value
+                gait_event_detector.detect()
+                did_heel_strikes.append(data.did_heel_strike)
+                gait_phases.append(np.nan if data.gait_phase is None else data.gait_phase)
+                did_toe_offs.append(data.did_toe_off)
+        finally:
+            util.set_time_source()
+        return (np.flatnonzero(did_heel_strikes), np.array(gait_phases),
+                np.flatnonzero(did_toe_offs))
+
+    def test_batch_matches_streaming(self):
+        # Irregular walking with pauses, noise, and jittery sample times, so the delay timer
+        # is restarted and strides go in and out of the allowable range
+        rng = np.random.default_rng(0)
+        num_samples = 12000
+        times = 100000 + np.cumsum(rng.uniform(0.004, 0.006, num_samples))
+        stride_freq = 1/rng.choice([0.5, 1.1, 1.3, 2.5], size=num_samples//500).repeat(500)
+        phase = 2*np.pi*np.cumsum(stride_freq*np.diff(times, prepend=times[0]))
+        gyro_z = 200*np.sin(phase)**9 + 5*rng.standard_normal(num_samples)
+        gyro_z[3000:4000] = 0
+        for height, gyro_filter_params, delay, num_strides_required, fraction_of_gait in [
+                (100, None, 0.3, 2, 0.6),
+                (100, (2, 20), 0.05, 2, 0.6),
+                (150, (1, 8), 0.2, 3, 0.4),
+                (50, (3, 10), 0, 4, 0.65)]:
+            streaming_events = self.run_streaming_detectors(
+                times=times, gyro_z=gyro_z, height=height,
+                gyro_filter=(filters.PassThroughFilter() if gyro_filter_params is None else
+                             filters.Butterworth(*gyro_filter_params, fs=200)),
+                delay=delay, num_strides_required=num_strides_required,
+                fraction_of_gait=fraction_of_gait)
+            batch_events = gait_state_estimators.detect_gait_events_batch(
+                gyro_z=gyro_z, times=times, height=height,
+                gyro_filter=(None if gyro_filter_params is None else
+                             filters.Butterworth(*gyro_filter_params, fs=200)),
+                delay=delay, num_strides_required=num_strides_required,
+                fraction_of_gait=fraction_of_gait)
+            self.assertGreater(len(streaming_events[0]), 10)
+            self.assertGreater(len(streaming_events[2]), 2)
+            for streaming_values, batch_values in zip(streaming_events, batch_events):
+                np.testing.assert_array_equal(batch_values, streaming_values)
+
+    def test_heel_strike_delay_restarts(self):
+        # A second peak before the delay is up restarts the timer
+        gyro_z = np.array([0, 3, 0, 0, 3, 0, 0, 0, 0, 0, 0])
+        times = np.arange(len(gyro_z), dtype=float)
+        heel_strike_indices = gait_state_estimators.detect_heel_strikes_batch(
+            gyro_z=gyro_z, times=times, height=2.5, delay=3)
+        self.assertListEqual(heel_strike_indices.tolist(), [8])
+
+    def test_toe_off_rearming(self):
+        gait_phase = np.array([np.nan, 0.7, 0.8, 0.5, 0.6, np.nan, 0.9, 0.2, np.nan, 0.7])
+        toe_off_indices = gait_state_estimators.detect_toe_offs_batch(
+            gait_phase=gait_phase, fraction_of_gait=0.6)
+        self.assertListEqual(toe_off_indices.tolist(), [1, 6, 9])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,145 @@
+'''Per-exo I/O worker threads, so the serial I/O of both actpacks happens at the same time.
+
+With DO_PARALLEL_EXO_IO, each Exo gets an ExoIOWorker. In the read_data stage, the worker
+runs its exo's read_data (fxs.read_device). In the step stage, it steps that exo's state
+machines, which send its motor commands. ParallelExoIO hands every worker the stage, and
+returns once all of them have finished it (a per-tick barrier). So gait state estimators,
+including bilateral slip detectors, still run on samples read from both exos in the same
+tick. No exo is used by two threads at once.
+
+Python only runs one thread at a time, but it lets other threads run while one waits on I/O.
+So the serial waits overlap, while the state machines' own computation does not.
+'''
+import threading
+import time
+from typing import List, Type
+
+import exoboot
+
+
+class ExoIOWorker(threading.Thread):
+    def __init__(self,
+                 exo: Type[exoboot.Exo],
+                 state_machine_list: list,
+                 start_barrier: Type[threading.Barrier],
+                 end_barrier: Type[threading.Barrier],
+                 name='exo-io-thread'):
+        '''Runs one stage per tick for one exo, between start_barrier and end_barrier.
+
+        ParallelExoIO sets stage (and loop_time or read_only) before the start barrier.
+        After the end barrier it reads job_start_time, job_end_time, and error.'''
+        super().__init__(name=name)
+        self.daemon = True  # Thread property
+        self.exo = exo
+        self.state_machine_list = state_machine_list
+        self.start_barrier = start_barrier
+        self.end_barrier = end_barrier
+        self.stage = None
+        self.loop_time = None
+        self.read_only = False
+        self.job_start_time = 0
+        self.job_end_time = 0
+        self.error = None
+        self.start()  # Starts the run() function
+
+    # This run function overrides the run() function in threading.Thread
+    def run(self):
+        while True:
+            try:
+                self.start_barrier.wait()
+            except threading.BrokenBarrierError:
+                return  # ParallelExoIO was closed
+            self.job_start_time = time.perf_counter()
+            try:
+                if self.stage == 'read_data':
+                    self.exo.read_data(loop_time=self.loop_time)
+                else:
+                    for state_machine in self.state_machine_list:
+                        state_machine.step(read_only=self.read_only)
+            except Exception as err:
+                self.error = err  # Raised again in the main thread
+            self.job_end_time = time.perf_counter()
+            try:
+                self.end_barrier.wait()
+            except threading.BrokenBarrierError:
+                return
+
+
+class ParallelExoIO():
+    def __init__(self, exo_list: List[Type[exoboot.Exo]], state_machine_list: list):
+        '''Creates an ExoIOWorker for each exo. Each state machine is stepped by the worker
+        for the exo it controls.'''
+        for state_machine in state_machine_list:
+            if not any(state_machine.exo is exo for exo in exo_list):
+                raise ValueError('State machine does not control an exo in exo_list')
+        self.start_barrier = threading.Barrier(len(exo_list) + 1)
+        self.end_barrier = threading.Barrier(len(exo_list) + 1)
+        self.workers = [
+            ExoIOWorker(exo=exo,
+                        state_machine_list=[state_machine for state_machine in state_machine_list
+                                            if state_machine.exo is exo],
+                        start_barrier=self.start_barrier, end_barrier=self.end_barrier,
+                        name='exo-io-thread-' + str(exo.side))
+            for exo in exo_list]
+        # For each stage: [num ticks, total worker busy time, total wall time, total stage time]
+        self.stage_totals = {'read_data': [0, 0.0, 0.0, 0.0], 'step': [0, 0.0, 0.0, 0.0]}
+
+    def read_data(self, loop_time: float):
+        '''Reads data from every exo at once, and returns when all of them are done.'''
+        for worker in self.workers:
+            worker.stage = 'read_data'
+            worker.loop_time = loop_time
+        self._run_stage('read_data')
+
+    def step(self, read_only: bool = False):
+        '''Steps every exo's state machines at once, and returns when all of them are done.'''
+        for worker in self.workers:
+            worker.stage = 'step'
+            worker.read_only = read_only
+        self._run_stage('step')
+
+    def _run_stage(self, stage: str):
+        stage_start_time = time.perf_counter()
+        self.start_barrier.wait()
+        self.end_barrier.wait()
+        stage_end_time = time.perf_counter()
+        totals = self.stage_totals[stage]
+        totals[0] += 1
+        totals[1] += sum(worker.job_end_time - worker.job_start_time for worker in self.workers)
+        totals[2] += (max(worker.job_end_time for worker in self.workers) -
+                      min(worker.job_start_time for worker in self.workers))
+        totals[3] += stage_end_time - stage_start_time
+        for worker in self.workers:
+            if worker.error is not None:
+                error = worker.error
+                worker.error = None
+                raise error
+
+    def get_stats(self, stage: str) -> dict:
+        '''Returns mean times (ms) per tick for a stage: busy (the sum of the workers' times,
+        which is how long the stage would take one exo after another), wall (first worker
+        start to last worker end), overlap (busy - wall), and stage (including the barriers).'''
+        num_ticks, busy_time, wall_time, stage_time = self.stage_totals[stage]
+        if num_ticks == 0:
+            return {}
+        return {'busy_ms': 1000*busy_time/num_ticks,
+                'wall_ms': 1000*wall_time/num_ticks,
+                'overlap_ms': 1000*(busy_time - wall_time)/num_ticks,
+                'stage_ms': 1000*stage_time/num_ticks}
+
+    def print_stats(self):
+        for stage in self.stage_totals:
+            stats = self.get_stats(stage)
+            if stats:
+                print('Parallel exo I/O, %s: busy %.3f ms, wall %.3f ms, overlap %.3f ms '
+                      '(%.0f%%), with barriers %.3f ms' % (
+                          stage, stats['busy_ms'], stats['wall_ms'], stats['overlap_ms'],
+                          100*stats['overlap_ms']/stats['busy_ms'] if stats['busy_ms'] else 0,
+                          stats['stage_ms']))
+
+    def close(self):
+        '''Stops the workers. They are idle between stages, so the exos can be closed after.'''
+        self.start_barrier.abort()
+        self.end_barrier.abort()
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,91 @@
+import threading
+import unittest
+
+import constants
+import exoboot
+import io_workers
+
+
+class ThreadRecordingStateMachine():
+    '''Records the thread it was stepped from, and optionally raises an error.'''
+
+    def __init__(self, exo, error=None):
+        self.exo = exo
+        self.error = error
+        self.thread_names = []
+
+    def step(self, read_only=False):
+        self.thread_names.append(threading.current_thread().name)
+        if self.error is not None:
+            raise self.error
+
+
+class Test_ParallelExoIO(unittest.TestCase):
+
+    def setUp(self):
+        self.real_fxs = exoboot.fxs
+        exoboot.use_simulated_flexsea(io_time=0.02)
+        self.exo_list = []
+        for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+            dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+            exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+            self.exo_list.append(exoboot.Exo(dev_id=dev_id, max_allowable_current=20000))
+
+    def tearDown(self):
+        exoboot.fxs = self.real_fxs
+
+    def test_reads_exos_at_the_same_time(self):
+        parallel_exo_io = io_workers.ParallelExoIO(exo_list=self.exo_list,
+                                                   state_machine_list=[])
+        try:
+            for loop_time in [0.1, 0.2, 0.3]:
+                parallel_exo_io.read_data(loop_time=loop_time)
+                for exo in self.exo_list:
+                    self.assertEqual(exo.data.loop_time, loop_time)
+                    self.assertIsNotNone(exo.data.ankle_angle)
+        finally:
+            parallel_exo_io.close()
+        stats = parallel_exo_io.get_stats('read_data')
+        # Each read sleeps for io_time, so one after the other would take at least 40 ms
+        self.assertGreater(stats['busy_ms'], 40)
+        self.assertLess(stats['wall_ms'], 0.75*stats['busy_ms'])
+        self.assertGreater(stats['overlap_ms'], 0.25*stats['busy_ms'])
+        self.assertEqual(parallel_exo_io.get_stats('step'), {})
+
+    def test_state_machines_stepped_by_their_exos_worker(self):
+        state_machine_list = [ThreadRecordingStateMachine(exo) for exo in self.exo_list]
+        state_machine_list.append(ThreadRecordingStateMachine(self.exo_list[0]))
+        parallel_exo_io = io_workers.ParallelExoIO(exo_list=self.exo_list,
+                                                   state_machine_list=state_machine_list)
+        try:
+            parallel_exo_io.step()
+            parallel_exo_io.step()
+        finally:
+            parallel_exo_io.close()
+        for state_machine in state_machine_list:
+            self.assertEqual(state_machine.thread_names,
+                             ['exo-io-thread-' + str(state_machine.exo.side)]*2)
+        with self.assertRaises(ValueError):
+            io_workers.ParallelExoIO(exo_list=self.exo_list[:1],
+                                     state_machine_list=state_machine_list)
+
+    def test_errors_raised_in_main_thread(self):
+        state_machine_list = [
+            ThreadRecordingStateMachine(self.exo_list[0]),
+            ThreadRecordingStateMachine(self.exo_list[1], error=ValueError('Too much current'))]
+        parallel_exo_io = io_workers.ParallelExoIO(exo_list=self.exo_list,
+                                                   state_machine_list=state_machine_list)
+        try:
+            with self.assertRaises(ValueError):
+                parallel_exo_io.step()
+            # Both workers finished the stage, and are ready for the next one
+            self.assertEqual(len(state_machine_list[0].thread_names), 1)
+            parallel_exo_io.read_data(loop_time=0.1)
+        finally:
+            parallel_exo_io.close()
+        for worker in parallel_exo_io.workers:
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
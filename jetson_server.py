@@ -0,0 +1,240 @@
+'''A local stand-in for the Jetson gait phase server, for load testing the ML task on loopback.
+
+JetsonServer accepts the messages ml_util.JetsonInterface sends (text, or binary with
+--binary), runs a gait phase model on each, and answers like the Jetson does. Requests are
+answered in order, each one compute delay (plus up to +/- jitter) after the previous one
+finished, so a slow model queues up like it would on the Jetson. Models:
+    gyro_peak: NumPy gait phase from gyro_z peaks and the average stride duration
+    replay: replays recorded gait_phase and is_stance columns (or gp_jetson, ss_jetson, as
+        written by test_jetson_interface.py) from a csv, one row per request for each side
+    mlp: an ml_util.MLPGaitPhaseNetwork, loaded from an .npz file
+
+    python jetson_server.py --model gyro_peak --binary
+    python jetson_server.py --model replay --replay_file test_jetson.csv --delay 0.005 --jitter 0.002
+    python jetson_server.py --model mlp --model_file gait_phase_mlp.npz --binary
+
+Then set JETSON_SERVER_IP = '127.0.0.1' (and ML_USE_BINARY_PROTOCOL to match) in the config.
+'''
+import argparse
+import collections
+import random
+import threading
+import time
+from typing import Type
+
+import pandas as pd
+
+import ml_util
+import tcpip
+
+
+class GaitPhaseModel():
+    '''Parent class for models, to help with type hinting.'''
+
+    def predict(self, side: int, features: list, send_time: float):
+        '''Returns (gait_phase, is_stance) for one request. features are in the order of
+        ml_util.REQUEST_STRUCT. send_time is the client's (binary) or server's (text) time.'''
+        raise ValueError('predict() not implemented for child class of GaitPhaseModel')
+
+
+class GyroPeakModel(GaitPhaseModel):
+    '''Estimates gait phase from the time since the last gyro_z peak, over the average of the
+    last num_strides_to_average stride durations, like StrideAverageGaitPhaseEstimator.'''
+
+    def __init__(self, height: float = 100, stance_fraction: float = 0.6,
+                 num_strides_to_average: int = 2, max_stride_duration: float = 2):
+        self.height = height
+        self.stance_fraction = stance_fraction
+        self.max_stride_duration = max_stride_duration
+        self.gyro_histories = [collections.deque([0, 0], maxlen=2) for _ in range(2)]
+        self.last_peak_times = [None, None]
+        self.stride_durations = [collections.deque(maxlen=num_strides_to_average)
+                                 for _ in range(2)]
+
+    def predict(self, side: int, features: list, send_time: float):
+        gyro_z = features[5]
+        gyro_history = self.gyro_histories[side]
+        if gyro_history[1] > self.height and gyro_history[1] > max(gyro_history[0], gyro_z):
+            if self.last_peak_times[side] is not None:
+                stride_duration = send_time - self.last_peak_times[side]
+                if stride_duration < self.max_stride_duration:
+                    self.stride_durations[side].append(stride_duration)
+            self.last_peak_times[side] = send_time
+        gyro_history.append(gyro_z)
+        if not self.stride_durations[side]:
+            return 0.0, 0.0
+        stride_durations = self.stride_durations[side]
+        gait_phase = min(1.0, (send_time - self.last_peak_times[side]) /
+                         (sum(stride_durations)/len(stride_durations)))
+        return gait_phase, float(gait_phase < self.stance_fraction)
+
+
+class ReplayModel(GaitPhaseModel):
+    '''Replays recorded predictions, looping when they run out.'''
+
+    def __init__(self, filename: str):
+        df = pd.read_csv(filename)
+        if 'gait_phase' in df.columns:
+            self.gait_phases = df['gait_phase'].fillna(0).tolist()
+            self.is_stances = df['is_stance'].fillna(0).tolist()
+        else:
+            self.gait_phases = df['gp_jetson'].fillna(0).tolist()
+            self.is_stances = df['ss_jetson'].fillna(0).tolist()
+        self.indices = [0, 0]
+
+    def predict(self, side: int, features: list, send_time: float):
+        i = self.indices[side]
+        self.indices[side] = (i + 1) % len(self.gait_phases)
+        return float(self.gait_phases[i]), float(self.is_stances[i])
+
+
+class MLPModel(GaitPhaseModel):
+    '''Runs the same network LocalGaitPhaseModel runs on the Pi.'''
+
+    def __init__(self, filename: str):
+        self.network = ml_util.MLPGaitPhaseNetwork(filename=filename)
+
+    def predict(self, side: int, features: list, send_time: float):
+        return self.network.predict(side=side, features=features)
+
+
+class JetsonServer():
+    def __init__(self,
+                 model: Type[GaitPhaseModel],
+                 server_ip: str = '127.0.0.1',
+                 recv_port: int = 8080,
+                 use_binary_protocol: bool = False,
+                 delay: float = 0,
+                 jitter: float = 0,
+                 seed: int = None):
+        '''
+        Args:
+            model: GaitPhaseModel to answer requests with
+            recv_port: port to listen on. If 0, the OS picks one (see server_tcp.RECV_PORT)
+            use_binary_protocol: must match the JetsonInterface's
+            delay: compute time (s) of each request
+            jitter: each compute time is delay + uniform(-jitter, jitter), and at least 0
+        '''
+        self.model = model
+        self.use_binary_protocol = use_binary_protocol
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.server_tcp = tcpip.ServerTCP(server_ip, recv_port)
+        self.server_tcp.start_listening()
+        self.request_frame_buffer = ml_util.get_request_frame_buffer()
+        self.text_buffer = ''
+        self.num_malformed_requests = 0
+        self.response_queue = collections.deque()  # (time to send, response)
+        self.num_requests = 0
+
+    def get_requests(self, data: bytes) -> list:
+        '''Returns (side, seq, send_time, features) of each complete request in data.
+        Malformed text requests are counted and skipped.'''
+        if self.use_binary_protocol:
+            return [ml_util.unpack_request(frame)
+                    for frame in self.request_frame_buffer.add(data)]
+        # Text requests have no terminator, so a request is complete once the '!' of the next
+        # one arrives, or once it matches TEXT_REQUEST_PATTERN (a request cut inside its last
+        # number would otherwise still parse)
+        messages = (self.text_buffer + data.decode()).split('!')
+        if ml_util.TEXT_REQUEST_PATTERN.fullmatch(messages[-1]):
+            self.text_buffer = ''
+        else:
+            self.text_buffer = '!' + messages.pop() if len(messages) > 1 else ''
+        requests = []
+        for message in messages[1:]:
+            try:
+                values = [float(value) for value in message.split(',')]
+            except ValueError:
+                values = []
+            if len(values) != 1 + len(ml_util.FEATURE_NAMES) or values[0] not in (0, 1):
+                self.num_malformed_requests += 1
+                continue
+            requests.append((int(values[0]), None, time.perf_counter(), values[1:]))
+        return requests
+
+    def get_response(self, side: int, seq: int, send_time: float, features: list):
+        gait_phase, is_stance = self.model.predict(side=side, features=features,
+                                                   send_time=send_time)
+        if self.use_binary_protocol:
+            return ml_util.pack_response(side=side, seq=seq, send_time=send_time,
+                                         gait_phase=gait_phase, is_stance=is_stance)
+        else:
+            return '!%d,%.5f,%.5f' % (side, gait_phase, is_stance)
+
+    def handle_requests(self, data: bytes):
+        '''Computes responses to the requests in data, and queues them to be sent after
+        their compute delay.'''
+        for side, seq, send_time, features in self.get_requests(data):
+            response = self.get_response(side=side, seq=seq, send_time=send_time,
+                                         features=features)
+            # Each request starts computing when it arrives, or when the previous one is done
+            start_time = time.perf_counter()
+            if self.response_queue:
+                start_time = max(start_time, self.response_queue[-1][0])
+            compute_time = max(0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+            self.response_queue.append((start_time + compute_time, response))
+            self.num_requests += 1
+
+    def send_due_responses(self):
+        now = time.perf_counter()
+        while self.response_queue and self.response_queue[0][0] <= now:
+            self.server_tcp.to_client(self.response_queue.popleft()[1])
+
+    def run(self, quit_event: Type[threading.Event] = None, do_accept_new_clients=True):
+        '''Serves clients until quit_event is set (or forever). If do_accept_new_clients,
+        waits for another client when one disconnects, otherwise returns.'''
+        if quit_event is None:
+            quit_event = threading.Event()
+        while not quit_event.is_set():
+            self.server_tcp.accept_client()
+            while not quit_event.is_set():
+                if self.response_queue:
+                    timeout = min(0.01, max(0, self.response_queue[0][0] - time.perf_counter()))
+                else:
+                    timeout = 0.01
+                try:
+                    self.handle_requests(self.server_tcp.from_client_bytes(timeout=timeout))
+                    self.send_due_responses()
+                except ConnectionError as err:
+                    print('%s. Answered %d requests, skipped %d malformed ones' % (
+                        err, self.num_requests, self.num_malformed_requests))
+                    break
+            self.server_tcp.close()
+            self.response_queue.clear()
+            self.text_buffer = ''
+            if not do_accept_new_clients:
+                break
+        self.server_tcp.listen_socket.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Jetson server')
+    parser.add_argument('--model', choices=['gyro_peak', 'replay', 'mlp'], default='gyro_peak')
+    parser.add_argument('--replay_file', type=str, default=None,
+                        help='csv of recorded predictions, for --model replay')
+    parser.add_argument('--model_file', type=str, default=None,
+                        help='.npz weights, for --model mlp')
+    parser.add_argument('--ip', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--binary', action='store_true', help='use the binary protocol')
+    parser.add_argument('--delay', type=float, default=0, help='compute time (s)')
+    parser.add_argument('--jitter', type=float, default=0, help='+/- compute time (s)')
+    args = parser.parse_args()
+
+    if args.model == 'replay':
+        if args.replay_file is None:
+            raise ValueError('--model replay requires --replay_file')
+        model = ReplayModel(filename=args.replay_file)
+    elif args.model == 'mlp':
+        if args.model_file is None:
+            raise ValueError('--model mlp requires --model_file')
+        model = MLPModel(filename=args.model_file)
+    else:
+        model = GyroPeakModel()
+    server = JetsonServer(model=model, server_ip=args.ip, recv_port=args.port,
+                          use_binary_protocol=args.binary, delay=args.delay,
+                          jitter=args.jitter)
+    print('Serving %s model on %s:%d' % (args.model, args.ip, server.server_tcp.RECV_PORT))
+    server.run()
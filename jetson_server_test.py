@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+import constants
+import jetson_server
+import ml_util
+from exoboot import Exo
+
+
+class Test_JetsonServer(unittest.TestCase):
+
+    def run_session(self, use_binary_protocol: bool, model, num_requests: int, delay=0):
+        '''Sends num_requests for each side to a JetsonServer on loopback, waiting for each
+        response. Returns the JetsonInterface and the (left, right) predictions.'''
+        server = jetson_server.JetsonServer(model=model, recv_port=0, delay=delay,
+                                            use_binary_protocol=use_binary_protocol)
+        quit_event = threading.Event()
+        server_thread = threading.Thread(target=server.run, kwargs={
+            'quit_event': quit_event, 'do_accept_new_clients': False}, daemon=True)
+        server_thread.start()
+        jetson_interface = ml_util.JetsonInterface(
+            server_ip='127.0.0.1', recv_port=server.server_tcp.RECV_PORT,
+            use_binary_protocol=use_binary_protocol)
+        data = Exo.DataContainer()
+        predictions = []
+        try:
+            for i in range(num_requests):
+                for side in [constants.Side.LEFT, constants.Side.RIGHT]:
+                    jetson_interface.latest_predictions = [None, None]
+                    data.gyro_z = i
+                    jetson_interface.package_and_send_message(side=side, data_container=data)
+                    t0 = time.perf_counter()
+                    while (jetson_interface.get_most_recent_gait_phase(side) is None and
+                           time.perf_counter() - t0 < 2):
+                        jetson_interface.receive(timeout=0.01)
+                    predictions.append(jetson_interface.get_most_recent_gait_phase(side))
+        finally:
+            jetson_interface.clienttcp.close()
+            server_thread.join(timeout=2)
+        self.assertFalse(server_thread.is_alive())
+        self.assertEqual(server.num_requests, 2*num_requests)
+        return jetson_interface, predictions
+
+    def test_replay_model(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'predictions.csv')
+            pd.DataFrame({'gp_jetson': [0.1, 0.2, 0.3],
+                          'ss_jetson': [1, 1, 0]}).to_csv(filename, index=False)
+            model = jetson_server.ReplayModel(filename=filename)
+        for use_binary_protocol in [False, True]:
+            model.indices = [0, 0]
+            jetson_interface, predictions = self.run_session(
+                use_binary_protocol=use_binary_protocol, model=model, num_requests=4,
+                delay=0.002)
+            gait_phases = [round(gait_phase, 5) for gait_phase, _ in predictions]
+            self.assertListEqual(gait_phases, [0.1, 0.1, 0.2, 0.2, 0.3, 0.3, 0.1, 0.1])
+        # Compute delay shows up in the round trip time
+        telemetry = jetson_interface.telemetry[0]
+        self.assertEqual(telemetry.num_rtts, 4)
+        self.assertGreaterEqual(min(telemetry.rtts[:telemetry.num_rtts]), 0.002)
+
+    def test_text_requests_split_across_reads(self):
+        server = jetson_server.JetsonServer(model=jetson_server.GyroPeakModel(), recv_port=0)
+        features = [0.1, 0.2, 0.3, 1.5, 2.5, 120.5, 10.0, -3.0]
+        message = '!1,' + ','.join('%.5f' % feature for feature in features)
+        # Split inside a middle field, then inside the last one, where '-3.0' would still parse
+        for data in [message + message[:10], message[10:] + message[:-3], message[-3:]]:
+            requests = server.get_requests(data.encode())
+            self.assertEqual(len(requests), 1)
+            side, seq, _, request_features = requests[0]
+            self.assertEqual((side, seq), (1, None))
+            self.assertListEqual(request_features, features)
+        # Malformed requests are skipped, without losing the ones around them
+        requests = server.get_requests(
+            (message + '!1,x,2' + message.replace('!1', '!2') + message).encode())
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(server.num_malformed_requests, 2)
+        self.assertEqual(server.text_buffer, '')
+        server.server_tcp.listen_socket.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
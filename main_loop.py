@@ -2,6 +2,7 @@
 This is the main GT program for running the Dephy exos. Read the Readme.
 '''
 import exoboot
+import calibration_store
 import threading
 import controllers
 import state_machines
@@ -13,6 +14,7 @@ import util
 import config_util
 import parameter_passers
 import control_muxer
+import io_workers
 import plotters
 import ml_util
 import traceback
@@ -38,15 +40,19 @@ gait_state_estimator_list, state_machine_list = control_muxer.get_gse_and_sm_lis
     exo_list=exo_list, config=config)
 
 '''Prep parameter passing.'''
-lock = threading.Lock()
+update_channel = parameter_passers.UpdateChannel()
 quit_event = threading.Event()
-new_params_event = threading.Event()
 # v0.2,15,0.56,0.6!
 
 '''Perform standing calibration.'''
 if not config.READ_ONLY:
-    for exo in exo_list:
-        standing_angle = exo.standing_calibration()
+    standing_angles = calibration_store.calibrate_exos(
+        exo_list=exo_list,
+        calibration_store=calibration_store.CalibrationStore(filename=config.CALIBRATION_FILENAME),
+        do_reuse_calibration=config.DO_REUSE_CALIBRATION,
+        tolerance=config.CALIBRATION_REUSE_TOLERANCE,
+        max_slack=config.CALIBRATION_REUSE_MAX_SLACK)
+    for exo, standing_angle in zip(exo_list, standing_angles):
         if exo.side == constants.Side.LEFT:
             config.LEFT_STANDING_ANGLE = standing_angle
         else:
@@ -59,41 +65,61 @@ print('Start!')
 
 '''Main Loop: Check param updates, Read data, calculate gait state, apply control, write data.'''
 timer = util.FlexibleTimer(
-    target_freq=config.TARGET_FREQ)  # attempts constants freq
+    target_freq=config.TARGET_FREQ, do_sleep=config.TIMER_DO_SLEEP,
+    spin_time=config.TIMER_SPIN_TIME)  # attempts constants freq
 t0 = time.perf_counter()
 keyboard_thread = parameter_passers.ParameterPasser(
-    lock=lock, config=config, quit_event=quit_event,
-    new_params_event=new_params_event)
+    update_channel=update_channel, config=config, quit_event=quit_event)
 config_saver.write_data(loop_time=0)  # Write first row on config
 only_write_if_new = not config.READ_ONLY and config.ONLY_LOG_IF_NEW
+if config.DO_TRACE_LOOP_STAGES:
+    trace_filename = config_saver.filename.replace('_CONFIG.csv', '_STAGES.bin')
+else:
+    trace_filename = None
+stage_profiler = util.StageProfiler(
+    stage_names=['params', 'read_data', 'detect', 'step', 'write_data'],
+    trace_filename=trace_filename)
+if config.DO_PARALLEL_EXO_IO:
+    parallel_exo_io = io_workers.ParallelExoIO(
+        exo_list=exo_list, state_machine_list=state_machine_list)
 
 
 while True:
     try:
         timer.pause()
         loop_time = time.perf_counter() - t0
+        stage_profiler.start_tick()
 
-        lock.acquire()
-        if new_params_event.is_set():
+        if update_channel.apply_updates(config=config):
             config_saver.write_data(loop_time=loop_time)  # Update config file
             for state_machine in state_machine_list:  # Make sure up to date
                 state_machine.update_ctrl_params_from_config(config=config)
             for gait_state_estimator in gait_state_estimator_list:  # Make sure up to date
                 gait_state_estimator.update_params_from_config(config=config)
-            new_params_event.clear()
         if quit_event.is_set():  # If user enters "quit"
             break
-        lock.release()
+        stage_profiler.end_stage('params')
 
-        for exo in exo_list:
-            exo.read_data(loop_time=loop_time)
+        if config.DO_PARALLEL_EXO_IO:
+            parallel_exo_io.read_data(loop_time=loop_time)
+        else:
+            for exo in exo_list:
+                exo.read_data(loop_time=loop_time)
+        stage_profiler.end_stage('read_data')
         for gait_state_estimator in gait_state_estimator_list:
             gait_state_estimator.detect()
+        stage_profiler.end_stage('detect')
         if not config.READ_ONLY:
-            for state_machine in state_machine_list:
-                state_machine.step(read_only=config.READ_ONLY)
+            if config.DO_PARALLEL_EXO_IO:
+                parallel_exo_io.step(read_only=config.READ_ONLY)
+            else:
+                for state_machine in state_machine_list:
+                    state_machine.step(read_only=config.READ_ONLY)
+            stage_profiler.end_stage('step')
         for exo in exo_list:
             exo.write_data(only_write_if_new=only_write_if_new)
+        stage_profiler.end_stage('write_data')
+        stage_profiler.end_tick(loop_time=loop_time)
 
     except KeyboardInterrupt:
         print('Ctrl-C detected, Exiting Gracefully')
@@ -104,9 +130,21 @@ while True:
         break
 
 '''Safely close files, stop streaming, optionally saves plots'''
+timer.print_period_stats()
+timer.write_period_stats(
+    filename=config_saver.filename.replace('_CONFIG.csv', '_TIMING.csv'))
+stage_profiler.print_stats()
+stage_profiler.close()
+if config.DO_PARALLEL_EXO_IO:
+    parallel_exo_io.print_stats()
+    parallel_exo_io.close()
+for gait_state_estimator in gait_state_estimator_list:
+    if isinstance(gait_state_estimator, gait_state_estimators.MLGaitStateEstimator):
+        gait_state_estimator.print_stats()
 config_saver.close_file()
 for exo in exo_list:
-    exo.close()
+    exo.print_serial_stats()
+exoboot.close_exos(exo_list)
 if config.VARS_TO_PLOT:
     plotters.save_plot(filename=exo_list[0].filename.replace(
         '_LEFT.csv', '').replace('_RIGHT.csv', ''), vars_to_plot=config.VARS_TO_PLOT)
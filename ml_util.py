@@ -1,19 +1,173 @@
 import exoboot
-from typing import Type
+from typing import List, Type
 import constants
+import math
 import numpy as np
+import operator
+import re
+import struct
+import threading
 import tcpip
-from collections import deque
+import util
+from collections import deque, namedtuple
+
+# Binary protocol: fixed size little-endian messages, each starting with MESSAGE_MAGIC.
+# Requests (Pi -> Jetson): magic, side (0: left, 1: right), sequence number, send time (s),
+# then accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z, ankle_angle, ankle_velocity.
+# Responses (Jetson -> Pi): magic, side, and the sequence number and send time of the request
+# being answered, then gait_phase, is_stance.
+MESSAGE_MAGIC = b'\xeb\x0a'
+REQUEST_STRUCT = struct.Struct('<2sBId8f')
+RESPONSE_STRUCT = struct.Struct('<2sBIdff')
+MAX_SEQUENCE_NUMBER = 2**32 - 1
+# A whole text request, after its '!', as package_message formats it: side, then the features
+TEXT_REQUEST_PATTERN = re.compile(r'\d+(,-?\d+\.\d{5}){8}')
+# DataContainer fields sent to the Jetson, or fed to a local model, in order
+FEATURE_NAMES = ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z',
+                 'ankle_angle', 'ankle_velocity')
+
+
+def is_text_response_cut_off(message: str) -> bool:
+    '''True if message (a text response, after its '!') is visibly incomplete: it has fewer
+    than three fields, or a field that is not a number yet (e.g., '0.', '1e-'). The Jetson's
+    number format is not fixed, so a number cut between digits cannot be detected.'''
+    fields = message.split(',')
+    if len(fields) != 3 or fields[-1].endswith('.'):
+        return True
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        return True
+    return False
+
+
+def pack_request(side: int, seq: int, send_time: float, features) -> bytes:
+    return REQUEST_STRUCT.pack(MESSAGE_MAGIC, side, seq, send_time, *features)
+
+
+def unpack_request(frame: bytes):
+    '''Returns (side, seq, send_time, features), for use on the Jetson (ServerTCP) side.'''
+    _, side, seq, send_time, *features = REQUEST_STRUCT.unpack(frame)
+    return side, seq, send_time, features
+
+
+def pack_response(side: int, seq: int, send_time: float, gait_phase: float,
+                  is_stance: float) -> bytes:
+    return RESPONSE_STRUCT.pack(MESSAGE_MAGIC, side, seq, send_time, gait_phase, is_stance)
+
+
+def unpack_response(frame: bytes):
+    '''Returns (side, seq, send_time, gait_phase, is_stance).'''
+    return RESPONSE_STRUCT.unpack(frame)[1:]
+
+
+# A gait phase prediction from the Jetson. arrival_time is from util.get_time(). seq and
+# send_time are those of the request it answers (None with the text protocol).
+Prediction = namedtuple('Prediction',
+                        ['gait_phase', 'is_stance', 'arrival_time', 'seq', 'send_time'])
+
+
+class LinkTelemetry():
+    '''Latency and loss of the Jetson link, for one side.
+
+    Round trip times (request sent to response received) are recorded by whichever thread
+    parses responses, and prediction ages (request sent to prediction used) by the main loop.
+    The most recent max_num_samples of each are kept, like FlexibleTimer's periods.'''
+
+    def __init__(self, max_num_samples: int = 200000):
+        self.rtts = np.zeros(max_num_samples)
+        self.num_rtts = 0
+        self.ages = np.zeros(max_num_samples)
+        self.num_ages = 0
+        self.num_sent = 0
+        self.num_dropped = 0  # Not answered within drop_timeout
+        self.num_duplicates = 0  # Answers to requests already answered or dropped
+
+    def record_rtt(self, rtt: float):
+        self.rtts[self.num_rtts % len(self.rtts)] = rtt
+        self.num_rtts += 1
+
+    def record_age(self, age: float):
+        self.ages[self.num_ages % len(self.ages)] = age
+        self.num_ages += 1
+
+    def get_stats(self) -> dict:
+        '''Returns counts, and statistics of round trip times and prediction ages (ms).'''
+        stats = {'num_sent': self.num_sent,
+                 'num_answered': self.num_rtts,
+                 'num_dropped': self.num_dropped,
+                 'num_duplicates': self.num_duplicates,
+                 'num_unanswered_at_exit': self.num_sent - self.num_rtts - self.num_dropped,
+                 'num_used': self.num_ages}
+        for name, values, num_values in [('rtt', self.rtts, self.num_rtts),
+                                         ('age', self.ages, self.num_ages)]:
+            values = 1000*values[:min(num_values, len(values))]
+            if len(values) == 0:
+                continue
+            stats[name + '_mean'] = np.mean(values)
+            for percentile in [50, 90, 99]:
+                stats[name + '_p' + str(percentile)] = np.percentile(values, percentile)
+            stats[name + '_max'] = np.max(values)
+        return stats
+
+
+def get_request_frame_buffer() -> Type[tcpip.FrameBuffer]:
+    '''Returns a FrameBuffer that splits the stream a ServerTCP receives into request frames.'''
+    return tcpip.FrameBuffer(frame_size=REQUEST_STRUCT.size, magic=MESSAGE_MAGIC)
 
 
 class JetsonInterface():
 
-    def __init__(self, do_set_up_server=True, server_ip='192.168.1.2', recv_port=8080):
-        self.data = deque(maxlen=10)
+    def __init__(self, do_set_up_server=True, server_ip='192.168.1.2', recv_port=8080,
+                 use_binary_protocol=False, max_prediction_age=None, drop_timeout=1):
+        '''
+        use_binary_protocol: if True, messages use REQUEST_STRUCT and RESPONSE_STRUCT, which the
+            Jetson must also use. If False, messages are comma separated text, starting with !
+        max_prediction_age: predictions received longer ago than this (s) are not returned by
+            get_most_recent_gait_phase. None means no limit.
+        drop_timeout: requests not answered within this time (s) are counted as dropped. Only
+            the binary protocol matches responses to requests, so round trip times, drops, and
+            duplicates are only recorded with it.
+        '''
+        self.use_binary_protocol = use_binary_protocol
+        self.max_prediction_age = max_prediction_age
+        self.drop_timeout = drop_timeout
+        self.seq = 0
+        self.last_send_time = None
+        self.telemetry = [LinkTelemetry(), LinkTelemetry()]  # Left, right
+        # (side, seq, send_time) of sent requests, appended by the sending thread, and moved
+        # to pending_requests ({seq: (side, send_time)}) by the thread that parses responses
+        self.sent_requests = deque()
+        self.pending_requests = {}
+        self.response_frame_buffer = tcpip.FrameBuffer(frame_size=RESPONSE_STRUCT.size,
+                                                       magic=MESSAGE_MAGIC)
+        # Text responses have no terminator, so a response visibly cut off by a recv is kept
+        # here until the rest of it arrives
+        self.text_buffer = ''
+        self.num_malformed_messages = 0
+        # Latest Prediction for each side (0: left, 1: right). Each slot is replaced whole, so
+        # the main loop can read it while the receiver thread writes, without a lock.
+        self.latest_predictions = [None, None]
+        self.receiver_thread = None
         if do_set_up_server:
             self.clienttcp = tcpip.ClientTCP(server_ip, recv_port)
 
+    def start_receiver_thread(self, quit_event: Type[threading.Event] = None):
+        '''Starts receiving in a JetsonReceiver thread, after which grab_message_and_parse()
+        does nothing, so the main loop never waits on the socket.'''
+        if quit_event is None:
+            quit_event = threading.Event()
+        self.receiver_thread = JetsonReceiver(jetson_interface=self, quit_event=quit_event)
+
     def package_message(self, side: Type[constants.Side], data: exoboot.Exo.DataContainer):
+        if self.use_binary_protocol:
+            self.seq = self.seq + 1 if self.seq < MAX_SEQUENCE_NUMBER else 0
+            self.last_send_time = util.get_time()
+            return pack_request(
+                side=0 if side == constants.Side.LEFT else 1, seq=self.seq,
+                send_time=self.last_send_time,
+                features=(data.accel_x, data.accel_y, data.accel_z, data.gyro_x, data.gyro_y,
+                          data.gyro_z, data.ankle_angle, data.ankle_velocity))
         if side == constants.Side.LEFT:
             side_str = '0'
         else:
@@ -32,27 +186,275 @@ class JetsonInterface():
 
     def package_and_send_message(self, side, data_container):
         message = self.package_message(side=side, data=data_container)
+        if self.use_binary_protocol:
+            # Before sending, so the response cannot be parsed before its request is pending
+            side_index = 0 if side == constants.Side.LEFT else 1
+            self.sent_requests.append((side_index, self.seq, self.last_send_time))
+            self.telemetry[side_index].num_sent += 1
         self.clienttcp.to_server(msg=message)
 
     def grab_message_and_parse(self):
-        message = self.clienttcp.from_server()
-        self.parse(message)
+        if self.receiver_thread is None:
+            self.receive()
+
+    def receive(self, timeout=0.0001):
+        '''Waits up to timeout (s) for messages from the Jetson, and parses any that arrived.'''
+        if self.use_binary_protocol:
+            self.parse_binary(self.clienttcp.from_server_bytes(timeout=timeout))
+        else:
+            self.parse(self.clienttcp.from_server(timeout=timeout))
 
     def parse(self, message):
-        '''parses message from jetson. Returns side, gait_phase, is_stance'''
-        if message is not None:
-            message_list = message.split("!")[1:]
-            for message in message_list:
-                data_list = message.split(",")
-                self.data.appendleft([float(i) for i in data_list])
-
-    def get_most_recent_gait_phase(self, side: Type[constants.Side]):
-        for message in self.data:
-            if side == constants.Side.LEFT and message[0] == 0:
-                gait_phase = message[1]
-                stance_swing = message[2]
-                return gait_phase, stance_swing
-            elif side == constants.Side.RIGHT and message[0] == 1:
-                gait_phase = message[1]
-                stance_swing = message[2]
-                return gait_phase, stance_swing
+        '''parses message from jetson, and stores the latest gait_phase, is_stance per side.
+
+        message may hold partial responses. The last one is kept for the next call if it is
+        visibly cut off (see is_text_response_cut_off), and parsed at once otherwise, so it is
+        not delayed until the next response arrives. Malformed responses are counted and
+        skipped.'''
+        if not message:
+            return
+        arrival_time = util.get_time()
+        message_list = (self.text_buffer + message).split("!")
+        if len(message_list) > 1 and is_text_response_cut_off(message_list[-1]):
+            self.text_buffer = '!' + message_list.pop()
+        else:
+            self.text_buffer = ''
+        for message in message_list[1:]:
+            try:
+                side, gait_phase, is_stance = [float(i) for i in message.split(",")]
+                self.latest_predictions[[0, 1].index(side)] = Prediction(
+                    gait_phase, is_stance, arrival_time, None, None)
+            except ValueError:
+                self.num_malformed_messages += 1
+
+    def parse_binary(self, message: bytes):
+        '''Parses bytes received from the Jetson, which may hold partial responses.'''
+        frames = self.response_frame_buffer.add(message)
+        if not frames:
+            return
+        arrival_time = util.get_time()
+        pending_requests = self.pending_requests
+        while self.sent_requests:
+            side, seq, send_time = self.sent_requests.popleft()
+            pending_requests[seq] = (side, send_time)
+        for frame in frames:
+            side, seq, send_time, gait_phase, is_stance = unpack_response(frame)
+            if side > 1:
+                self.num_malformed_messages += 1
+                continue
+            if pending_requests.pop(seq, None) is None:
+                self.telemetry[side].num_duplicates += 1
+            else:
+                self.telemetry[side].record_rtt(arrival_time - send_time)
+            self.latest_predictions[side] = Prediction(
+                gait_phase, is_stance, arrival_time, seq, send_time)
+        # Requests are pending in the order they were sent, so the oldest are first
+        while pending_requests:
+            seq = next(iter(pending_requests))
+            side, send_time = pending_requests[seq]
+            if arrival_time - send_time < self.drop_timeout:
+                break
+            del pending_requests[seq]
+            self.telemetry[side].num_dropped += 1
+
+    def get_most_recent_prediction(self, side: Type[constants.Side], max_age=None):
+        '''Returns the latest Prediction for side, or None if there is none, or it arrived more
+        than max_age (s, defaults to max_prediction_age) ago.'''
+        prediction = self.latest_predictions[0 if side == constants.Side.LEFT else 1]
+        if prediction is None:
+            return None
+        if max_age is None:
+            max_age = self.max_prediction_age
+        if max_age is not None and util.get_time() - prediction.arrival_time > max_age:
+            return None
+        return prediction
+
+    def get_most_recent_gait_phase(self, side: Type[constants.Side], max_age=None):
+        '''Returns (gait_phase, is_stance) from get_most_recent_prediction, or None.'''
+        prediction = self.get_most_recent_prediction(side=side, max_age=max_age)
+        if prediction is None:
+            return None
+        return prediction.gait_phase, prediction.is_stance
+
+    def record_prediction_use(self, side: Type[constants.Side], prediction: Prediction) -> float:
+        '''Records, and returns, the age (s) of a prediction being used: the time since its
+        request was sent (or since it arrived, with the text protocol).'''
+        if prediction.send_time is None:
+            age = util.get_time() - prediction.arrival_time
+        else:
+            age = util.get_time() - prediction.send_time
+        self.telemetry[0 if side == constants.Side.LEFT else 1].record_age(age)
+        return age
+
+    def print_telemetry_summary(self, side: Type[constants.Side]):
+        stats = self.telemetry[0 if side == constants.Side.LEFT else 1].get_stats()
+        print('Jetson link stats (ms) on side %s: ' % side, ', '.join(
+            '%s=%.4g' % (key, value) for key, value in stats.items()),
+            '(malformed messages, both sides: %d)' % self.num_malformed_messages)
+
+
+class JetsonReceiver(threading.Thread):
+    def __init__(self,
+                 jetson_interface: Type[JetsonInterface],
+                 quit_event: Type[threading.Event],
+                 name='jetson-receiver-thread'):
+        '''Receives and parses messages from the Jetson in the background, filling the
+        jetson_interface's latest prediction slots until quit_event is set.'''
+        super().__init__(name=name)
+        self.daemon = True  # Thread property
+        self.jetson_interface = jetson_interface
+        self.quit_event = quit_event
+        self.start()  # Starts the run() function
+
+    def run(self):
+        while not self.quit_event.is_set():
+            try:
+                # Blocks briefly, so quit_event is still checked regularly
+                self.jetson_interface.receive(timeout=0.01)
+            except ConnectionError as err:
+                print('Jetson receiver stopped: ', err)
+                break
+
+
+def save_mlp(filename: str,
+             weights: List[np.ndarray],
+             biases: List[np.ndarray],
+             feature_mean,
+             feature_std,
+             window_length: int):
+    '''Saves MLP weights (e.g., exported from a training script) for MLPGaitPhaseNetwork.'''
+    arrays = {'window_length': window_length,
+              'feature_mean': np.asarray(feature_mean, dtype=float),
+              'feature_std': np.asarray(feature_std, dtype=float)}
+    for i, (weight, bias) in enumerate(zip(weights, biases)):
+        arrays['weight_%d' % i] = weight
+        arrays['bias_%d' % i] = bias
+    np.savez(filename, **arrays)
+
+
+class MLPGaitPhaseNetwork():
+    '''A multilayer perceptron that predicts gait phase and stance from the last window_length
+    samples of FEATURE_NAMES, for each side.
+
+    The .npz file (see save_mlp) holds window_length, feature_mean and feature_std (used to
+    normalize each feature), and weight_0, bias_0, weight_1, ... weight_i has shape (inputs,
+    outputs). The first layer's inputs are the normalized window, oldest sample first, flattened
+    to window_length*8 values. Hidden layers use ReLU. The last layer has two outputs: gait
+    phase (clipped to [0, 1]), and a stance logit (passed through a sigmoid).
+
+    Each side's window is a ring buffer written twice, back to back, so the latest window is
+    always one contiguous slice: adding a sample costs two row writes, and nothing is copied.'''
+
+    def __init__(self, filename: str):
+        with np.load(filename) as npz:
+            self.window_length = int(npz['window_length'])
+            self.feature_mean = npz['feature_mean'].astype(float)
+            self.feature_std = npz['feature_std'].astype(float)
+            self.weights = []
+            self.biases = []
+            while 'weight_%d' % len(self.weights) in npz:
+                self.biases.append(npz['bias_%d' % len(self.weights)].astype(float))
+                self.weights.append(npz['weight_%d' % len(self.weights)].astype(float))
+        num_inputs = self.window_length*len(FEATURE_NAMES)
+        for weight, bias in zip(self.weights, self.biases):
+            if weight.shape != (num_inputs, len(bias)):
+                raise ValueError('Layer with %d inputs has weights of shape %s' % (
+                    num_inputs, weight.shape))
+            num_inputs = len(bias)
+        if not self.weights or num_inputs != 2:
+            raise ValueError('The last layer must have 2 outputs (gait phase, stance logit)')
+        self.reset()
+
+    def reset(self):
+        '''Empties both sides' windows.'''
+        self.windows = [np.zeros((2*self.window_length, len(FEATURE_NAMES))) for _ in range(2)]
+        self.window_starts = [0, 0]  # Row of the oldest sample, which is overwritten next
+        self.num_samples = [0, 0]
+
+    def is_window_full(self, side: int) -> bool:
+        return self.num_samples[side] >= self.window_length
+
+    def predict(self, side: int, features):
+        '''Adds the newest features (in the order of FEATURE_NAMES) to side's window (0: left,
+        1: right), and returns (gait_phase, is_stance) for that window.'''
+        normalized_features = (np.asarray(features, dtype=float) -
+                               self.feature_mean)/self.feature_std
+        window = self.windows[side]
+        start = self.window_starts[side]
+        window[start] = normalized_features
+        window[start + self.window_length] = normalized_features
+        start = start + 1 if start + 1 < self.window_length else 0
+        self.window_starts[side] = start
+        self.num_samples[side] += 1
+        x = window[start:start + self.window_length].reshape(-1)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            x = np.maximum(np.dot(x, weight) + bias, 0)
+        gait_phase, stance_logit = (np.dot(x, self.weights[-1]) + self.biases[-1]).tolist()
+        # Sigmoid, with exp only of negative numbers so it cannot overflow
+        if stance_logit >= 0:
+            is_stance = 1/(1 + math.exp(-stance_logit))
+        else:
+            exp_logit = math.exp(stance_logit)
+            is_stance = exp_logit/(1 + exp_logit)
+        return min(1.0, max(0.0, gait_phase)), is_stance
+
+
+class LocalGaitPhaseModel(JetsonInterface):
+    def __init__(self,
+                 filename: str,
+                 max_prediction_age=None,
+                 inference_budget: float = None):
+        '''Runs an MLPGaitPhaseNetwork on the Pi, in place of the Jetson. It has JetsonInterface's
+        methods, so MLGaitStateEstimator can use either.
+
+        Predictions are made in package_and_send_message, so they are used the same tick. Each
+        Prediction's send_time is when inference started, and arrival_time is when it ended, so
+        the round trip times that are logged (ml_rtt) and summarized are inference times.
+        inference_budget: max inference time (s). If not None, the median of a few hundred
+            calls is checked when loading (raising a ValueError if over budget), and calls over
+            budget are counted.'''
+        super().__init__(do_set_up_server=False, max_prediction_age=max_prediction_age)
+        self.network = MLPGaitPhaseNetwork(filename=filename)
+        self.inference_budget = inference_budget
+        self.num_over_budget = 0
+        self.get_features = operator.attrgetter(*FEATURE_NAMES)
+        if self.inference_budget is not None:
+            inference_time = self.get_median_inference_time()
+            if inference_time > self.inference_budget:
+                raise ValueError('Median inference time (%.3g s) is over budget (%.3g s)' % (
+                    inference_time, self.inference_budget))
+
+    def get_median_inference_time(self, num_calls: int = 300) -> float:
+        features = self.network.feature_mean.tolist()
+        inference_times = []
+        for _ in range(num_calls):
+            t0 = util.get_time()
+            self.network.predict(side=0, features=features)
+            inference_times.append(util.get_time() - t0)
+        self.network.reset()
+        return float(np.median(inference_times))
+
+    def package_and_send_message(self, side, data_container):
+        side_index = 0 if side == constants.Side.LEFT else 1
+        start_time = util.get_time()
+        gait_phase, is_stance = self.network.predict(
+            side=side_index, features=self.get_features(data_container))
+        end_time = util.get_time()
+        if not self.network.is_window_full(side_index):
+            return
+        self.seq = self.seq + 1 if self.seq < MAX_SEQUENCE_NUMBER else 0
+        self.latest_predictions[side_index] = Prediction(
+            gait_phase, is_stance, end_time, self.seq, start_time)
+        telemetry = self.telemetry[side_index]
+        telemetry.num_sent += 1
+        telemetry.record_rtt(end_time - start_time)
+        if self.inference_budget is not None and end_time - start_time > self.inference_budget:
+            self.num_over_budget += 1
+
+    def grab_message_and_parse(self):
+        pass  # Predictions are already in latest_predictions
+
+    def print_telemetry_summary(self, side: Type[constants.Side]):
+        super().print_telemetry_summary(side=side)
+        if self.inference_budget is not None:
+            print('Inference calls over budget (both sides): ', self.num_over_budget)
@@ -0,0 +1,278 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import constants
+import ml_util
+import tcpip
+import util
+from exoboot import Exo
+
+
+class Test_BinaryProtocol(unittest.TestCase):
+
+    def test_request_round_trip(self):
+        jetson_interface = ml_util.JetsonInterface(do_set_up_server=False)
+        data = Exo.DataContainer()
+        features = [0.1, -0.98, 0.05, 12.5, -3.25, 250.123, 10.5, -120.75]
+        (data.accel_x, data.accel_y, data.accel_z, data.gyro_x, data.gyro_y, data.gyro_z,
+         data.ankle_angle, data.ankle_velocity) = features
+        text_message = jetson_interface.package_message(side=constants.Side.RIGHT, data=data)
+        jetson_interface.use_binary_protocol = True
+        frame_buffer = ml_util.get_request_frame_buffer()
+        frames = frame_buffer.add(jetson_interface.package_message(
+            side=constants.Side.RIGHT, data=data))
+        frames += frame_buffer.add(jetson_interface.package_message(
+            side=constants.Side.LEFT, data=data))
+        self.assertEqual(len(frames), 2)
+        self.assertLess(len(frames[0]), len(text_message))
+        side, seq, _, received_features = ml_util.unpack_request(frames[0])
+        self.assertEqual((side, seq), (1, 1))
+        np.testing.assert_allclose(received_features, features, rtol=1e-6)
+        side, seq, _, _ = ml_util.unpack_request(frames[1])
+        self.assertEqual((side, seq), (0, 2))
+
+    def test_partial_reads(self):
+        responses = [ml_util.pack_response(side=i % 2, seq=i, send_time=i/100,
+                                           gait_phase=i/20, is_stance=1.0)
+                     for i in range(10)]
+        # Garbage before the first response, like after a partially sent message
+        stream = b'\x0a\x00' + ml_util.MESSAGE_MAGIC[:1] + b''.join(responses)
+        for chunk_size in [1, 3, len(responses[0]), 50, len(stream)]:
+            jetson_interface = ml_util.JetsonInterface(do_set_up_server=False,
+                                                       use_binary_protocol=True)
+            for start in range(0, len(stream), chunk_size):
+                jetson_interface.parse_binary(stream[start:start+chunk_size])
+            self.assertEqual(jetson_interface.response_frame_buffer.num_bytes_dropped, 3)
+            self.assertEqual(jetson_interface.latest_predictions[0].seq, 8)
+            self.assertEqual(jetson_interface.latest_predictions[1].seq, 9)
+            gait_phase, is_stance = jetson_interface.get_most_recent_gait_phase(
+                side=constants.Side.LEFT)
+            self.assertAlmostEqual(gait_phase, 8/20, places=6)
+            self.assertEqual(is_stance, 1)
+
+    def test_frame_buffer_resync(self):
+        frame_buffer = tcpip.FrameBuffer(frame_size=4, magic=b'AB')
+        self.assertListEqual(frame_buffer.add(b'ABxyAB12A'), [b'ABxy', b'AB12'])
+        self.assertListEqual(frame_buffer.add(b'xxxABcd'), [b'ABcd'])
+        self.assertEqual(frame_buffer.num_bytes_dropped, 4)
+
+
+class FakeClientTCP():
+    '''Stands in for tcpip.ClientTCP: keeps sent messages, and receives what it is given.'''
+
+    def __init__(self):
+        self.sent_messages = []
+        self.to_receive = b''
+
+    def to_server(self, msg):
+        self.sent_messages.append(msg)
+
+    def from_server_bytes(self, timeout=0.0001):
+        data, self.to_receive = self.to_receive, b''
+        return data
+
+
+class Test_TextProtocol(unittest.TestCase):
+
+    def test_partial_and_malformed_responses(self):
+        jetson_interface = ml_util.JetsonInterface(do_set_up_server=False)
+        # Visibly cut off: a field is missing, then the last number ends in '.'
+        jetson_interface.parse('!0,0.12')
+        self.assertIsNone(jetson_interface.latest_predictions[0])
+        jetson_interface.parse('345,1.')
+        self.assertIsNone(jetson_interface.latest_predictions[0])
+        # Whole responses are parsed at once, whatever their number format
+        jetson_interface.parse('0!1,0.53,1')
+        self.assertEqual(jetson_interface.latest_predictions[0][:2], (0.12345, 1.0))
+        self.assertEqual(jetson_interface.latest_predictions[1][:2], (0.53, 1.0))
+        jetson_interface.parse('!1,2.5e-')
+        self.assertEqual(jetson_interface.latest_predictions[1][:2], (0.53, 1.0))
+        jetson_interface.parse('1,0!0,x,1.00000!2,0.10000,1.00000!0,0.25000,0.00000')
+        self.assertEqual(jetson_interface.latest_predictions[1][:2], (0.25, 0.0))
+        self.assertEqual(jetson_interface.latest_predictions[0][:2], (0.25, 0.0))
+        self.assertEqual(jetson_interface.num_malformed_messages, 2)
+        self.assertEqual(jetson_interface.text_buffer, '')
+
+
+class Test_LinkTelemetry(unittest.TestCase):
+
+    def test_rtt_drops_and_duplicates(self):
+        clock = util.VirtualClock(start_time=100)
+        util.set_time_source(clock)
+        try:
+            jetson_interface = ml_util.JetsonInterface(
+                do_set_up_server=False, use_binary_protocol=True, drop_timeout=1)
+            jetson_interface.clienttcp = FakeClientTCP()
+            data = Exo.DataContainer()
+            for i in range(6):
+                clock.set_time(100 + i/100)
+                jetson_interface.package_and_send_message(side=constants.Side.LEFT,
+                                                          data_container=data)
+            requests = [ml_util.unpack_request(message)
+                        for message in jetson_interface.clienttcp.sent_messages]
+            # Answer requests 0-3 (sent 0-30 ms ago) at once, and request 2 twice
+            clock.set_time(100.08)
+            jetson_interface.clienttcp.to_receive = b''.join(
+                ml_util.pack_response(side=side, seq=seq, send_time=send_time,
+                                      gait_phase=0.5, is_stance=1.0)
+                for side, seq, send_time, _ in requests[:4] + [requests[2]])
+            jetson_interface.grab_message_and_parse()
+            prediction = jetson_interface.get_most_recent_prediction(side=constants.Side.LEFT)
+            self.assertEqual(prediction.seq, requests[2][1])
+            clock.set_time(100.1)
+            self.assertAlmostEqual(jetson_interface.record_prediction_use(
+                side=constants.Side.LEFT, prediction=prediction), 0.08)
+            # Requests 4 and 5 are never answered; request 0's answer comes again, much later
+            clock.set_time(102)
+            jetson_interface.clienttcp.to_receive = ml_util.pack_response(
+                side=0, seq=requests[0][1], send_time=requests[0][2], gait_phase=0.1,
+                is_stance=0.0)
+            jetson_interface.grab_message_and_parse()
+            stats = jetson_interface.telemetry[0].get_stats()
+            self.assertEqual(stats['num_sent'], 6)
+            self.assertEqual(stats['num_answered'], 4)
+            self.assertEqual(stats['num_dropped'], 2)
+            self.assertEqual(stats['num_duplicates'], 2)
+            self.assertEqual(stats['num_unanswered_at_exit'], 0)
+            self.assertEqual(stats['num_used'], 1)
+            self.assertAlmostEqual(stats['rtt_p50'], 65, places=6)
+            self.assertAlmostEqual(stats['rtt_max'], 80, places=6)
+            self.assertEqual(jetson_interface.telemetry[1].get_stats()['num_sent'], 0)
+        finally:
+            util.set_time_source()
+
+
+class Test_LocalGaitPhaseModel(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.window_length = 5
+        self.weights = [rng.standard_normal((40, 16)), rng.standard_normal((16, 8)),
+                        rng.standard_normal((8, 2))]
+        self.biases = [rng.standard_normal(16), rng.standard_normal(8), np.array([0.5, 0])]
+        self.feature_mean = rng.standard_normal(8)
+        self.feature_std = rng.uniform(0.5, 2, 8)
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'mlp.npz')
+        ml_util.save_mlp(filename=self.filename, weights=self.weights, biases=self.biases,
+                         feature_mean=self.feature_mean, feature_std=self.feature_std,
+                         window_length=self.window_length)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_matches_full_window(self):
+        network = ml_util.MLPGaitPhaseNetwork(filename=self.filename)
+        features = np.random.default_rng(1).standard_normal((30, 8))*10
+        for i in range(len(features)):
+            side = i % 2
+            gait_phase, is_stance = network.predict(side=side, features=features[i])
+            # Recompute from scratch, from the side's last window_length samples
+            window = np.zeros((self.window_length, 8))
+            side_features = features[side:i+1:2][-self.window_length:]
+            window[self.window_length - len(side_features):] = (
+                side_features - self.feature_mean)/self.feature_std
+            x = window.reshape(-1)
+            for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+                x = np.maximum(x @ weight + bias, 0)
+            output = x @ self.weights[-1] + self.biases[-1]
+            self.assertAlmostEqual(gait_phase, np.clip(output[0], 0, 1))
+            self.assertAlmostEqual(is_stance, 1/(1 + np.exp(-output[1])))
+
+    def test_large_stance_logits(self):
+        network = ml_util.MLPGaitPhaseNetwork(filename=self.filename)
+        for stance_bias, expected_is_stance in [(-1e4, 0.0), (1e4, 1.0)]:
+            network.biases[-1] = np.array([0.5, stance_bias])
+            _, is_stance = network.predict(side=0, features=np.zeros(8))
+            self.assertEqual(is_stance, expected_is_stance)
+
+    def test_in_place_of_jetson_interface(self):
+        local_model = ml_util.LocalGaitPhaseModel(filename=self.filename, inference_budget=0.01)
+        data = Exo.DataContainer()
+        for i in range(self.window_length):
+            self.assertIsNone(local_model.get_most_recent_gait_phase(constants.Side.RIGHT))
+            data.gyro_z = i
+            local_model.package_and_send_message(side=constants.Side.RIGHT, data_container=data)
+            local_model.grab_message_and_parse()
+        self.assertIsNotNone(local_model.get_most_recent_gait_phase(constants.Side.RIGHT))
+        self.assertIsNone(local_model.get_most_recent_gait_phase(constants.Side.LEFT))
+        stats = local_model.telemetry[1].get_stats()
+        self.assertEqual(stats['num_answered'], 1)
+        self.assertLess(stats['rtt_max'], 10)  # ms
+        with self.assertRaises(ValueError):
+            ml_util.LocalGaitPhaseModel(filename=self.filename, inference_budget=1e-9)
+
+
+class Test_JetsonReceiver(unittest.TestCase):
+
+    def test_receiver_thread(self):
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.bind(('127.0.0.1', 0))
+        listen_socket.listen(1)
+        clock = util.VirtualClock(start_time=10)
+        util.set_time_source(clock)
+        try:
+            jetson_interface = ml_util.JetsonInterface(
+                server_ip='127.0.0.1', recv_port=listen_socket.getsockname()[1],
+                use_binary_protocol=True, max_prediction_age=0.1)
+            server_conn, _ = listen_socket.accept()
+            quit_event = threading.Event()
+            jetson_interface.start_receiver_thread(quit_event=quit_event)
+            self.assertIsNone(jetson_interface.get_most_recent_gait_phase(constants.Side.LEFT))
+            response = ml_util.pack_response(side=0, seq=1, send_time=10, gait_phase=0.25,
+                                             is_stance=1.0)
+            # Split across two sends, which the receiver must put back together
+            server_conn.sendall(response[:5])
+            time.sleep(0.02)
+            server_conn.sendall(response[5:])
+            t0 = time.perf_counter()
+            while (jetson_interface.latest_predictions[0] is None and
+                   time.perf_counter() - t0 < 2):
+                time.sleep(0.001)
+            jetson_interface.grab_message_and_parse()  # Does nothing with a receiver thread
+            clock.set_time(10.05)
+            self.assertEqual(jetson_interface.get_most_recent_gait_phase(constants.Side.LEFT),
+                             (0.25, 1.0))
+            self.assertIsNone(jetson_interface.get_most_recent_gait_phase(constants.Side.RIGHT))
+            clock.set_time(10.2)  # Too old
+            self.assertIsNone(jetson_interface.get_most_recent_gait_phase(constants.Side.LEFT))
+            self.assertEqual(jetson_interface.get_most_recent_gait_phase(
+                constants.Side.LEFT, max_age=1), (0.25, 1.0))
+            quit_event.set()
+            jetson_interface.receiver_thread.join(timeout=1)
+            self.assertFalse(jetson_interface.receiver_thread.is_alive())
+            server_conn.close()
+            jetson_interface.clienttcp.close()
+        finally:
+            util.set_time_source()
+            listen_socket.close()
+
+    def test_text_receiver_thread_stops_when_server_closes(self):
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listen_socket.bind(('127.0.0.1', 0))
+        listen_socket.listen(1)
+        try:
+            jetson_interface = ml_util.JetsonInterface(
+                server_ip='127.0.0.1', recv_port=listen_socket.getsockname()[1])
+            server_conn, _ = listen_socket.accept()
+            jetson_interface.start_receiver_thread(quit_event=threading.Event())
+            server_conn.sendall(b'!1,0.7')
+            time.sleep(0.02)
+            server_conn.sendall(b'5000,1.00000!1,x,y')
+            server_conn.close()
+            jetson_interface.receiver_thread.join(timeout=1)
+            self.assertFalse(jetson_interface.receiver_thread.is_alive())
+            self.assertEqual(jetson_interface.latest_predictions[1][:2], (0.75, 1.0))
+            jetson_interface.clienttcp.close()
+        finally:
+            listen_socket.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
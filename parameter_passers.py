@@ -1,27 +1,63 @@
+import collections
 import threading
+import types
 from typing import Type
 import config_util
 
 
+class UpdateChannel():
+    '''Single-producer/single-consumer queue of config updates, which does not need a lock.
+
+    The producer (e.g., the keyboard thread) posts immutable {param_name: value} deltas, and the
+    consumer (the main loop) applies them between ticks. collections.deque's append() and
+    popleft() are atomic, and each delta is applied all at once, so the main loop never sees a
+    half-updated set of params.'''
+    # Posted as a value by post_toggle(), so the consumer flips the param's current value
+    TOGGLE = object()
+
+    def __init__(self):
+        self._deque = collections.deque()
+
+    def post(self, **params):
+        '''Called by the producer thread only.'''
+        self._deque.append(types.MappingProxyType(params))
+
+    def post_toggle(self, *param_names):
+        '''Called by the producer thread only. Flips boolean params when the delta is applied,
+        so toggles posted in quick succession each flip the value the consumer has.'''
+        self._deque.append(types.MappingProxyType(
+            {param_name: self.TOGGLE for param_name in param_names}))
+
+    def apply_updates(self, config: Type[config_util.ConfigurableConstants]) -> bool:
+        '''Called by the consumer thread only. Returns True if any params were updated.'''
+        if not self._deque:
+            return False
+        while self._deque:
+            for param_name, value in self._deque.popleft().items():
+                if value is self.TOGGLE:
+                    value = not getattr(config, param_name)
+                setattr(config, param_name, value)
+        return True
+
+
 class ParameterPasser(threading.Thread):
     def __init__(self,
-                 lock: Type[threading.Lock],
+                 update_channel: Type[UpdateChannel],
                  config: Type[config_util.ConfigurableConstants],
                  quit_event: Type[threading.Event],
-                 new_params_event: Type[threading.Event],
                  name='keyboard-input-thread'):
         '''This class passes parameters via user input and a parallel thread.
 
-        The general idea is that this thread waits for an input, then grabs a lock (to stop the main thread),
-        checks if the message follows the "code" (starts with 'v', ends with '!'), and then updates config
-        params, depending on which params your child class wants updated. Then it sets the new_param_event flag
-        to signal to the main loop to update the controllers'''
+        The general idea is that this thread waits for an input, checks if the message follows the
+        "code" (starts with 'v', ends with '!'), and then posts the new config params to the
+        update_channel, depending on which params your child class wants updated. The main loop
+        applies them between ticks and updates the controllers. The config is only read here,
+        never written.'''
         super().__init__(name=name)
         self.daemon = True  # Thread property
-        self.lock = lock
+        self.update_channel = update_channel
         self.config = config
         self.quit_event = quit_event
-        self.new_params_event = new_params_event
         self.start()  # Starts the run() function
 
     # This run function overrides the run() function in threading.Thread
@@ -29,13 +65,9 @@ class ParameterPasser(threading.Thread):
         while True:
             msg = input()
             if msg == 'a':
-                self.lock.acquire()
-                self.config.SLIP_DETECT_ACTIVE = not self.config.SLIP_DETECT_ACTIVE
-                self.config.SWING_ONLY = not self.config.SWING_ONLY
+                self.update_channel.post_toggle('SLIP_DETECT_ACTIVE', 'SWING_ONLY')
                 # print('swing only: ', self.config.SWING_ONLY,
                 #       'slip detect active: ', self.config.SWING_ONLY)
-                self.new_params_event.set()
-                self.lock.release()
 
             elif len(msg) < 3:
                 print('Message must be either "quit" or a string of parameters'
@@ -44,55 +76,57 @@ class ParameterPasser(threading.Thread):
 
             elif msg.lower() == 'quit':
                 print('Quitting')
-                self.lock.acquire()
                 self.quit_event.set()
-                self.lock.release()
                 break
 
             elif msg[-1] == '!':
-                self.lock.acquire()
                 first_letter = msg[0]
                 msg_content = msg[1:-1]
 
                 if first_letter == 'v':
-                    param_list = [float(x) for x in msg_content.split(',')]
+                    try:
+                        param_list = [float(x) for x in msg_content.split(',')]
+                    except ValueError:
+                        print('Spline points must be numbers separated by commas')
+                        continue
                     if len(param_list) != 4:
                         print('Must send four spline points with v<>! message')
                     else:
-                        self.config.RISE_FRACTION = param_list[0]
-                        self.config.PEAK_TORQUE = param_list[1]
-                        self.config.PEAK_FRACTION = param_list[2]
-                        self.config.FALL_FRACTION = param_list[3]
+                        self.update_channel.post(RISE_FRACTION=param_list[0],
+                                                 PEAK_TORQUE=param_list[1],
+                                                 PEAK_FRACTION=param_list[2],
+                                                 FALL_FRACTION=param_list[3])
                 elif first_letter == 'k':
                     if msg_content.isdigit():
-                        self.config.K_VAL = int(msg_content)
-                        self.config.B_VAL = self.config.B_RATIO * \
-                            self.config.K_VAL  # 2.5ish = critically damped
+                        k_val = int(msg_content)
+                        self.update_channel.post(
+                            K_VAL=k_val,
+                            B_VAL=self.config.B_RATIO*k_val)  # 2.5ish = critically damped
                         print('k_val updated to: ', msg_content)
                     else:
                         print('Must provide single positive integer to update k_val')
                 elif first_letter == 's':
                     if msg_content.lstrip('-').isdigit():
-                        self.config.SET_POINT = int(msg_content)
+                        self.update_channel.post(SET_POINT=int(msg_content))
                         print('SET_POINT updated to: ', msg_content)
                     else:
                         print('Must provide single integer to update SET_POINT')
                 elif first_letter == 'p':
                     if msg_content.isdigit():
                         if 0 <= int(msg_content) <= 40:
-                            self.config.PEAK_TORQUE = int(msg_content)
-                            print('Peak torque set to: ',
-                                  self.config.PEAK_TORQUE)
+                            self.update_channel.post(PEAK_TORQUE=int(msg_content))
+                            print('Peak torque set to: ', int(msg_content))
                     else:
                         print('Must provide single integer to update PEAK_TORQUE')
                 elif first_letter == 'd':
                     # Delay for slip detectors
-                    self.config.SLIP_DETECT_DELAY = int(msg_content)
+                    try:
+                        self.update_channel.post(SLIP_DETECT_DELAY=int(msg_content))
+                    except ValueError:
+                        print('Must provide single integer to update SLIP_DETECT_DELAY')
                 elif first_letter == '-':
-                    self.config.EXPERIMENTER_NOTES = msg_content
+                    self.update_channel.post(EXPERIMENTER_NOTES=msg_content)
                     print('Added that message to the config.')
-                self.new_params_event.set()
-                self.lock.release()
 
             else:
                 print('IDK how to interpret your message')
@@ -0,0 +1,67 @@
+import threading
+import unittest
+from unittest import mock
+
+import config_util
+import parameter_passers
+
+
+class Test_UpdateChannel(unittest.TestCase):
+
+    def test_deltas_are_applied_whole_and_in_order(self):
+        config = config_util.ConfigurableConstants(K_VAL=0, B_VAL=0)
+        update_channel = parameter_passers.UpdateChannel()
+        self.assertFalse(update_channel.apply_updates(config=config))
+
+        def post_updates():
+            for i in range(10000):
+                update_channel.post(K_VAL=i, B_VAL=2*i)
+        producer = threading.Thread(target=post_updates)
+        producer.start()
+        last_k_val = -1
+        while producer.is_alive():
+            update_channel.apply_updates(config=config)
+            # Never a half-applied delta, and never out of order
+            self.assertEqual(config.B_VAL, 2*config.K_VAL)
+            self.assertGreaterEqual(config.K_VAL, last_k_val)
+            last_k_val = config.K_VAL
+        producer.join()
+        update_channel.apply_updates(config=config)
+        self.assertEqual(config.K_VAL, 9999)
+
+    def test_deltas_are_immutable(self):
+        update_channel = parameter_passers.UpdateChannel()
+        update_channel.post(PEAK_TORQUE=10)
+        with self.assertRaises(TypeError):
+            update_channel._deque[0]['PEAK_TORQUE'] = 20
+
+    def test_toggles_flip_the_applied_value(self):
+        config = config_util.ConfigurableConstants(SWING_ONLY=False, SLIP_DETECT_ACTIVE=True)
+        update_channel = parameter_passers.UpdateChannel()
+        for _ in range(3):
+            update_channel.post_toggle('SWING_ONLY', 'SLIP_DETECT_ACTIVE')
+        update_channel.apply_updates(config=config)
+        self.assertTrue(config.SWING_ONLY)
+        self.assertFalse(config.SLIP_DETECT_ACTIVE)
+
+
+class Test_ParameterPasser(unittest.TestCase):
+
+    def test_malformed_messages_do_not_stop_the_thread(self):
+        config = config_util.ConfigurableConstants(SWING_ONLY=False, SLIP_DETECT_ACTIVE=False)
+        update_channel = parameter_passers.UpdateChannel()
+        quit_event = threading.Event()
+        messages = ['a', 'a', 'vx,1,2,3!', 'd1.5!', 'v0.2,15,0.56,0.6!', 'quit']
+        with mock.patch('builtins.input', side_effect=messages):
+            parameter_passer = parameter_passers.ParameterPasser(
+                update_channel=update_channel, config=config, quit_event=quit_event)
+            parameter_passer.join(timeout=5)
+        self.assertTrue(quit_event.is_set())
+        update_channel.apply_updates(config=config)
+        self.assertFalse(config.SWING_ONLY)  # Toggled twice
+        self.assertFalse(config.SLIP_DETECT_ACTIVE)
+        self.assertEqual(config.PEAK_TORQUE, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+'''Sweeps gait event detection params over recorded logs, scored against FSR ground truth.
+
+Each point in a grid (or random) search of HS_GYRO_THRESHOLD, HS_GYRO_FILTER_N,
+HS_GYRO_FILTER_WN, HS_GYRO_DELAY, TOE_OFF_FRACTION, and NUM_STRIDES_REQUIRED is run through
+the batch versions of GyroHeelStrikeDetector, StrideAverageGaitPhaseEstimator, and
+GaitPhaseBasedToeOffDetector (which match them sample for sample) on every log. Detected heel
+strikes are scored against heel_fsr rising edges, and toe offs against toe_fsr falling edges.
+
+Points that share filter params are sent to the same worker process, which filters each log's
+gyro_z once and reuses it for all of them. Workers default to one per core.
+    python parameter_sweep.py exo_data/*_LEFT.csv exo_data/*_RIGHT.csv
+    python parameter_sweep.py exo_data/*_LEFT.csv --num_random_points 500
+'''
+import argparse
+import concurrent.futures
+import itertools
+import os
+import random
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import config_util
+import filters
+import gait_state_estimators
+import replay
+
+PARAM_NAMES = ('HS_GYRO_THRESHOLD', 'HS_GYRO_FILTER_N', 'HS_GYRO_FILTER_WN', 'HS_GYRO_DELAY',
+               'TOE_OFF_FRACTION', 'NUM_STRIDES_REQUIRED')
+FILTER_PARAM_NAMES = ('HS_GYRO_FILTER_N', 'HS_GYRO_FILTER_WN')
+DEFAULT_GRID = {'HS_GYRO_THRESHOLD': [50, 75, 100, 125, 150],
+                'HS_GYRO_FILTER_N': [1, 2],
+                'HS_GYRO_FILTER_WN': [2, 3, 4, 6],
+                'HS_GYRO_DELAY': [0, 0.025, 0.05, 0.075],
+                'TOE_OFF_FRACTION': [0.55, 0.6, 0.65],
+                'NUM_STRIDES_REQUIRED': [2, 3]}
+# NUM_STRIDES_REQUIRED starts at 2, since StrideAverageGaitPhaseEstimator averages 2 strides
+# (as control_muxer builds it), and cannot require fewer strides than it averages.
+# (low, high) for random search. Integer params are drawn from low to high, inclusive.
+RANDOM_RANGES = {'HS_GYRO_THRESHOLD': (30, 200),
+                 'HS_GYRO_FILTER_N': (1, 3),
+                 'HS_GYRO_FILTER_WN': (1, 8),
+                 'HS_GYRO_DELAY': (0, 0.1),
+                 'TOE_OFF_FRACTION': (0.5, 0.7),
+                 'NUM_STRIDES_REQUIRED': (2, 4)}
+
+# Recordings loaded in each worker process by _load_recordings()
+_recordings = []
+
+
+def get_grid_points(grid: Dict[str, list] = DEFAULT_GRID) -> List[dict]:
+    return [dict(zip(PARAM_NAMES, values))
+            for values in itertools.product(*[grid[name] for name in PARAM_NAMES])]
+
+
+def get_random_points(num_points: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    points = []
+    for _ in range(num_points):
+        point = {}
+        for name in PARAM_NAMES:
+            low, high = RANDOM_RANGES[name]
+            if isinstance(low, int) and isinstance(high, int):
+                point[name] = rng.randint(low, high)
+            else:
+                point[name] = rng.uniform(low, high)
+        points.append(point)
+    return points
+
+
+def get_edge_indices(values: np.ndarray, is_rising: bool) -> np.ndarray:
+    '''Returns indices where a boolean signal goes from False to True (or True to False).'''
+    values = np.asarray(values, dtype=bool)
+    if is_rising:
+        return np.flatnonzero(~values[:-1] & values[1:]) + 1
+    else:
+        return np.flatnonzero(values[:-1] & ~values[1:]) + 1
+
+
+def _load_recordings(filenames: List[str]):
+    '''Loads the columns the sweep needs from each log, into this process's _recordings.'''
+    _recordings.clear()
+    for filename in filenames:
+        columns = replay.load_columns(filename)
+        if 'heel_fsr' not in columns or 'toe_fsr' not in columns:
+            raise ValueError('Log must have heel_fsr and toe_fsr columns: ', filename)
+        loop_time = np.asarray(columns['loop_time'], dtype=float)
+        _recordings.append({
+            'filename': filename,
+            'loop_time': loop_time,
+            'gyro_z': np.asarray(columns['gyro_z'], dtype=float),
+            'true_heel_strike_times': loop_time[get_edge_indices(columns['heel_fsr'], True)],
+            'true_toe_off_times': loop_time[get_edge_indices(columns['toe_fsr'], False)]})
+
+
+def filter_gyro(gyro_z: np.ndarray, N: int, Wn: float, fs: float) -> np.ndarray:
+    '''Filters gyro_z like GyroHeelStrikeDetector does (identically, see filter_array).'''
+    return filters.Butterworth(N=N, Wn=Wn, fs=fs).filter_array(gyro_z)
+
+
+def detect_events(loop_time: np.ndarray, filtered_gyro_z: np.ndarray, params: dict):
+    '''Runs the batch versions of the detectors on prefiltered gyro_z.
+
+    Times are offset like replay's VirtualClock, so stride durations see the same floats they
+    would during replay. Returns (heel strike indices, toe off indices, gait phase array with
+    NaN for None).'''
+    heel_strike_indices, gait_phase, toe_off_indices = (
+        gait_state_estimators.detect_gait_events_batch(
+            gyro_z=filtered_gyro_z, times=replay.VIRTUAL_CLOCK_OFFSET + loop_time,
+            height=params['HS_GYRO_THRESHOLD'], delay=params['HS_GYRO_DELAY'],
+            num_strides_required=params['NUM_STRIDES_REQUIRED'],
+            fraction_of_gait=params['TOE_OFF_FRACTION']))
+    return heel_strike_indices, toe_off_indices, gait_phase
+
+
+def match_events(detected_times: np.ndarray, true_times: np.ndarray, tolerance: float):
+    '''Matches each true event to the nearest unmatched detected event within tolerance (s).
+
+    Returns (num true positives, num false positives, num false negatives, timing errors (s)).'''
+    is_matched = np.zeros(len(detected_times), dtype=bool)
+    errors = []
+    for true_time in true_times:
+        if len(detected_times) == 0:
+            break
+        distances = np.abs(detected_times - true_time)
+        distances[is_matched] = np.inf
+        nearest = np.argmin(distances)
+        if distances[nearest] <= tolerance:
+            is_matched[nearest] = True
+            errors.append(detected_times[nearest] - true_time)
+    num_true_positives = len(errors)
+    return (num_true_positives, len(detected_times) - num_true_positives,
+            len(true_times) - num_true_positives, errors)
+
+
+def _get_scores(prefix: str, num_tp: int, num_fp: int, num_fn: int, errors: list) -> dict:
+    precision = num_tp/(num_tp + num_fp) if num_tp + num_fp else 0
+    recall = num_tp/(num_tp + num_fn) if num_tp + num_fn else 0
+    f1 = 2*precision*recall/(precision + recall) if precision + recall else 0
+    return {prefix + '_f1': f1,
+            prefix + '_precision': precision,
+            prefix + '_recall': recall,
+            prefix + '_mean_error': np.mean(errors) if errors else np.nan,
+            prefix + '_mean_abs_error': np.mean(np.abs(errors)) if errors else np.nan}
+
+
+def evaluate_filter_group(points: List[dict], fs: float, tolerance: float) -> List[dict]:
+    '''Scores points that share filter params, filtering each recording only once.'''
+    N = points[0]['HS_GYRO_FILTER_N']
+    Wn = points[0]['HS_GYRO_FILTER_WN']
+    filtered_gyros = [filter_gyro(recording['gyro_z'], N=N, Wn=Wn, fs=fs)
+                      for recording in _recordings]
+    results = []
+    for point in points:
+        totals = {'heel_strike': [0, 0, 0, []], 'toe_off': [0, 0, 0, []]}
+        num_samples_with_gait_phase = 0
+        num_samples = 0
+        for recording, filtered_gyro_z in zip(_recordings, filtered_gyros):
+            loop_time = recording['loop_time']
+            heel_strike_indices, toe_off_indices, gait_phase = detect_events(
+                loop_time=loop_time, filtered_gyro_z=filtered_gyro_z, params=point)
+            for event_name, indices, true_times in [
+                    ('heel_strike', heel_strike_indices, recording['true_heel_strike_times']),
+                    ('toe_off', toe_off_indices, recording['true_toe_off_times'])]:
+                num_tp, num_fp, num_fn, errors = match_events(
+                    detected_times=loop_time[indices], true_times=true_times,
+                    tolerance=tolerance)
+                totals[event_name][0] += num_tp
+                totals[event_name][1] += num_fp
+                totals[event_name][2] += num_fn
+                totals[event_name][3].extend(errors)
+            num_samples_with_gait_phase += np.count_nonzero(~np.isnan(gait_phase))
+            num_samples += len(gait_phase)
+        result = dict(point)
+        result.update(_get_scores('heel_strike', *totals['heel_strike']))
+        result.update(_get_scores('toe_off', *totals['toe_off']))
+        result['gait_phase_coverage'] = num_samples_with_gait_phase/num_samples
+        result['score'] = (result['heel_strike_f1'] + result['toe_off_f1'])/2
+        results.append(result)
+    return results
+
+
+def run_sweep(filenames: List[str],
+              points: List[dict],
+              fs: float = None,
+              tolerance: float = 0.2,
+              max_workers: int = None) -> pd.DataFrame:
+    '''Scores every point on every log, and returns the results, best score first.
+
+    Args:
+        filenames: exo_data csv or .bin logs, with heel_fsr and toe_fsr columns
+        points: dicts of {param name: value}, with every name in PARAM_NAMES
+        fs: sampling freq (Hz) for the gyro filter. Default is the config's TARGET_FREQ.
+        tolerance: max time (s) between a detected and a true event for them to match
+        max_workers: number of worker processes (default: one per core). 1 runs in-process.'''
+    if fs is None:
+        fs = config_util.ConfigurableConstants().TARGET_FREQ
+    groups = {}
+    for point in points:
+        groups.setdefault(tuple(point[name] for name in FILTER_PARAM_NAMES), []).append(point)
+    if max_workers is None:
+        max_workers = os.cpu_count()
+
+    results = []
+    if max_workers == 1:
+        _load_recordings(filenames)
+        for group_points in groups.values():
+            results.extend(evaluate_filter_group(group_points, fs=fs, tolerance=tolerance))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, initializer=_load_recordings,
+                initargs=(filenames,)) as executor:
+            futures = [executor.submit(evaluate_filter_group, group_points, fs, tolerance)
+                       for group_points in groups.values()]
+            for future in futures:  # In submission order, so results are reproducible
+                results.extend(future.result())
+    results_df = pd.DataFrame(results)
+    return results_df.sort_values(by=['score', 'heel_strike_mean_abs_error'],
+                                  ascending=[False, True], kind='mergesort').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep gait event detection params')
+    parser.add_argument('filenames', nargs='+',
+                        help='exo_data csv or .bin logs, with heel_fsr and toe_fsr columns')
+    parser.add_argument('--num_random_points', type=int, default=None,
+                        help='if given, random search with this many points, instead of a grid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='max time (s) between detected and true events')
+    parser.add_argument('--max_workers', type=int, default=None)
+    parser.add_argument('--output', type=str, default='exo_data/parameter_sweep.csv')
+    args = parser.parse_args()
+
+    if args.num_random_points is None:
+        sweep_points = get_grid_points()
+    else:
+        sweep_points = get_random_points(num_points=args.num_random_points, seed=args.seed)
+    print('Sweeping ', len(sweep_points), ' points over ', len(args.filenames), ' logs')
+    sweep_df = run_sweep(filenames=args.filenames, points=sweep_points,
+                         tolerance=args.tolerance, max_workers=args.max_workers)
+    sweep_df.to_csv(args.output, index=False)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(sweep_df.head(10))
+    print('Wrote: ', args.output)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import parameter_sweep
+from exoboot import Exo
+
+
+class Test_ParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        # 20 s of walking at 200 Hz. The gyro peaks just before heel contact, and the toe
+        # leaves the ground at 62% of the stride.
+        self.folder = tempfile.TemporaryDirectory()
+        loop_time = np.arange(0, 20, 0.005)
+        gait_phase = (loop_time/1.1) % 1
+        data = Exo.DataContainer(do_include_FSRs=True)
+        df = pd.DataFrame({name: 0 for name in data.field_names}, index=loop_time)
+        df['loop_time'] = loop_time
+        df['gyro_z'] = 250*np.exp(-(np.minimum(gait_phase, 1 - gait_phase)/0.04)**2)
+        df['heel_fsr'] = gait_phase < 0.5
+        df['toe_fsr'] = (gait_phase > 0.1) & (gait_phase < 0.62)
+        self.filename = os.path.join(self.folder.name, 'test_LEFT.csv')
+        df.to_csv(self.filename, index=False)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_match_events(self):
+        num_tp, num_fp, num_fn, errors = parameter_sweep.match_events(
+            detected_times=np.array([1.05, 2.5, 3.02]), true_times=np.array([1, 2, 3]),
+            tolerance=0.1)
+        self.assertEqual((num_tp, num_fp, num_fn), (2, 1, 1))
+        np.testing.assert_allclose(errors, [0.05, 0.02])
+
+    def test_sweep(self):
+        grid = {'HS_GYRO_THRESHOLD': [100, 300],
+                'HS_GYRO_FILTER_N': [2],
+                'HS_GYRO_FILTER_WN': [3, 6],
+                'HS_GYRO_DELAY': [0, 0.05],
+                'TOE_OFF_FRACTION': [0.6],
+                'NUM_STRIDES_REQUIRED': [2]}
+        points = parameter_sweep.get_grid_points(grid)
+        self.assertEqual(len(points), 8)
+        results_df = parameter_sweep.run_sweep(filenames=[self.filename], points=points,
+                                               max_workers=1)
+        best = results_df.iloc[0]
+        self.assertEqual(best['HS_GYRO_THRESHOLD'], 100)
+        self.assertGreater(best['heel_strike_f1'], 0.95)
+        self.assertGreater(best['toe_off_f1'], 0.9)
+        # Nothing crosses a threshold above the gyro peak
+        self.assertTrue(np.all(results_df[results_df.HS_GYRO_THRESHOLD == 300].score == 0))
+        # The process pool gives the same results
+        parallel_results_df = parameter_sweep.run_sweep(filenames=[self.filename],
+                                                        points=points, max_workers=2)
+        pd.testing.assert_frame_equal(results_df, parallel_results_df)
+
+    def test_default_grid_and_random_points(self):
+        for points in [parameter_sweep.get_grid_points(),
+                       parameter_sweep.get_random_points(num_points=50)]:
+            results_df = parameter_sweep.run_sweep(filenames=[self.filename], points=points,
+                                                   max_workers=1)
+            self.assertEqual(len(results_df), len(points))
+            self.assertGreater(results_df.iloc[0]['score'], 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
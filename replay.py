@@ -0,0 +1,199 @@
+'''Replays logged sessions through gait state estimators and state machines, offline.
+
+Each row of an exo_data csv (or binary .bin log) is copied into an Exo's DataContainer, and
+then the gait state estimators and state machines (built by control_muxer, as in main_loop) run
+on it. exoboot.fxs is temporarily replaced by a NullFlexSEA, so motor commands go nowhere, but
+the commanded_* fields are still recomputed. util's time source is replaced by a VirtualClock
+that follows the logged loop_time, so DelayTimers, stride durations, and spline fades see the
+times they saw during the session, and a long session replays in seconds.
+
+Logs written with ONLY_LOG_IF_NEW skip the ticks without new actpack data, so filters that ran
+on every tick can differ slightly. Logs with every tick replay the same events, to within the
+small time between the start of each tick (loop_time) and when the estimators ran.
+
+    python replay.py exo_data/20210727_1253_S01_LEFT.csv exo_data/20210727_1253_S01_RIGHT.csv
+    python replay.py exo_data/20210727_1253_S01_LEFT.bin -c my_config
+'''
+import argparse
+import operator
+import time
+from typing import List, Type
+
+import numpy as np
+import pandas as pd
+
+import config_util
+import constants
+import control_muxer
+import data_logger
+import exoboot
+import util
+from exoboot import Exo
+
+# Fields computed by the gait state estimators and state machines, which are not replayed
+OUTPUT_FIELDS = ('did_heel_strike', 'gait_phase', 'did_toe_off', 'did_slip',
+                 'gen_var1', 'gen_var2', 'gen_var3',
+                 'commanded_current', 'commanded_position', 'commanded_torque')
+# During a session, the time source is time.perf_counter(), which is large when the loop
+# starts. Starting the virtual clock at 0 would make the first stride look valid.
+VIRTUAL_CLOCK_OFFSET = 100000  # s
+
+
+class NullFlexSEA():
+    '''Stands in for Dephy's FlexSEA object during replay: gains and motor commands go nowhere.'''
+
+    def set_gains(self, dev_id, kp, ki, kd, k_val, b_val, ff):
+        pass
+
+    def send_motor_command(self, dev_id, ctrl_mode, value):
+        pass
+
+
+def load_columns(filename: str) -> dict:
+    '''Returns {column name: NumPy array} from an exo_data csv or binary (.bin) log.'''
+    if filename.endswith('.bin'):
+        samples, _ = data_logger.load_log(filename)
+        return {name: samples[name] for name in samples.dtype.names}
+    else:
+        df = pd.read_csv(filename)
+        return {name: df[name].to_numpy() for name in df.columns}
+
+
+def get_side_from_filename(filename: str) -> Type[constants.Side]:
+    if '_LEFT' in filename:
+        return constants.Side.LEFT
+    elif '_RIGHT' in filename:
+        return constants.Side.RIGHT
+    else:
+        raise ValueError('Filename must contain _LEFT or _RIGHT: ', filename)
+
+
+def get_exo_for_replay(side: Type[constants.Side], columns: dict,
+                       config: Type[config_util.ConfigurableConstants]) -> Type[Exo]:
+    '''Returns an Exo for side (exoboot.fxs must already be a NullFlexSEA), calibrated from
+    the logged slack, and with a DataContainer that has the same optional fields as the log.'''
+    if side == constants.Side.LEFT:
+        dev_id = constants.LEFT_EXO_DEV_IDS[0]
+    else:
+        dev_id = constants.RIGHT_EXO_DEV_IDS[0]
+    exo = Exo(dev_id=dev_id, max_allowable_current=config.MAX_ALLOWABLE_CURRENT)
+    exo.data = Exo.DataContainer(do_include_FSRs='heel_fsr' in columns,
+                                 do_include_sync='sync' in columns,
+                                 do_include_did_slip='did_slip' in columns,
+                                 do_include_gen_vars='gen_var1' in columns,
+                                 do_include_ml_telemetry='ml_seq' in columns)
+    # Slack was only logged after standing calibration, and it is the motor angle measured
+    # from the zero-slack angle, so it gives back the motor offset
+    slack = columns['slack'].astype(float)
+    was_calibrated = ~np.isnan(slack)
+    if np.any(was_calibrated):
+        zero_offset_motor_angles = exo.ankle_to_motor_angle_table.lookup_array(
+            columns['ankle_angle'][was_calibrated])
+        exo.motor_offset = np.median(columns['motor_angle'][was_calibrated] -
+                                     zero_offset_motor_angles +
+                                     exo.motor_sign*slack[was_calibrated])
+        exo.has_calibrated = True
+    return exo
+
+
+def _to_python_values(values: np.ndarray, kind: str) -> list:
+    '''Converts a column to the python values Exo.read_data() would have stored.'''
+    if kind == 'bool':
+        return [value == value and bool(value) for value in values.tolist()]  # NaN is False
+    elif kind == 'int':
+        return [int(value) if value == value else None for value in values.tolist()]
+    else:
+        return [float(value) if value == value else None for value in values.tolist()]
+
+
+def replay(filenames: List[str],
+           config: Type[config_util.ConfigurableConstants] = None) -> List[pd.DataFrame]:
+    '''Replays logs (one per side, from the same session) and returns the replayed outputs.
+
+    Returns one DataFrame per filename, with a row per logged row: loop_time, and the
+    OUTPUT_FIELDS that the replayed gait state estimators and state machines produced.'''
+    if config is None:
+        config = config_util.ConfigurableConstants(PRINT_HS=False)
+    column_dicts = [load_columns(filename) for filename in filenames]
+    clock = util.VirtualClock(start_time=VIRTUAL_CLOCK_OFFSET + min(
+        columns['loop_time'][0] for columns in column_dicts))
+    util.set_time_source(clock)
+    real_fxs = exoboot.fxs
+    exoboot.fxs = NullFlexSEA()
+    try:
+        exo_list = []
+        input_column_lists = []
+        for filename, columns in zip(filenames, column_dicts):
+            exo = get_exo_for_replay(side=get_side_from_filename(filename),
+                                     columns=columns, config=config)
+            exo_list.append(exo)
+            input_column_lists.append([
+                (name, _to_python_values(columns[name], kind))
+                for name, kind in zip(exo.data.field_names, exo.data.field_kinds)
+                if name in columns and name not in OUTPUT_FIELDS])
+        # Built after the clock is set, since controllers read the time when created
+        gait_state_estimator_list, state_machine_list = control_muxer.get_gse_and_sm_lists(
+            exo_list=exo_list, config=config)
+
+        recorded_fields = [('loop_time',) + tuple(
+            name for name in OUTPUT_FIELDS if name in exo.data.field_names) for exo in exo_list]
+        getters = [operator.attrgetter(*fields) for fields in recorded_fields]
+        outputs = [[] for _ in exo_list]
+        loop_time_lists = [columns['loop_time'].tolist() for columns in column_dicts]
+        indices = [0]*len(exo_list)
+        while True:
+            remaining = [i for i, loop_times in enumerate(loop_time_lists)
+                         if indices[i] < len(loop_times)]
+            if not remaining:
+                break
+            loop_time = min(loop_time_lists[i][indices[i]] for i in remaining)
+            clock.set_time(VIRTUAL_CLOCK_OFFSET + loop_time)
+            updated = [i for i in remaining if loop_time_lists[i][indices[i]] == loop_time]
+            for i in updated:
+                data = exo_list[i].data
+                for name, values in input_column_lists[i]:
+                    setattr(data, name, values[indices[i]])
+            for gait_state_estimator in gait_state_estimator_list:
+                gait_state_estimator.detect()
+            if not config.READ_ONLY:
+                for state_machine in state_machine_list:
+                    state_machine.step(read_only=False)
+            for i in updated:
+                outputs[i].append(getters[i](exo_list[i].data))
+                indices[i] += 1
+    finally:
+        util.set_time_source()
+        exoboot.fxs = real_fxs
+    return [pd.DataFrame(output, columns=fields)
+            for output, fields in zip(outputs, recorded_fields)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay logged exo data offline')
+    parser.add_argument('filenames', nargs='+',
+                        help='exo_data csv or .bin logs, at most one per side')
+    parser.add_argument('-c', '--config', action='store', type=str, default=None)
+    args = parser.parse_args()
+    if args.config is None:
+        config = config_util.ConfigurableConstants()
+    else:
+        config = config_util.load_config(config_filename=args.config)
+    config.PRINT_HS = False
+
+    t0 = time.perf_counter()
+    replayed_dfs = replay(filenames=args.filenames, config=config)
+    replay_duration = time.perf_counter() - t0
+    for filename, replayed_df in zip(args.filenames, replayed_dfs):
+        columns = load_columns(filename)
+        session_duration = columns['loop_time'][-1] - columns['loop_time'][0]
+        print(filename, ': replayed %.1f s of data in %.2f s' % (
+            session_duration, replay_duration))
+        for name in ['did_heel_strike', 'did_toe_off']:
+            logged_rows = np.flatnonzero(columns[name] == 1)
+            replayed_rows = np.flatnonzero(replayed_df[name].to_numpy())
+            print('    %s: %d logged, %d replayed, %d at the same row' % (
+                name, len(logged_rows), len(replayed_rows),
+                len(np.intersect1d(logged_rows, replayed_rows))))
+        replay_filename = filename[:-4] + '_REPLAY.csv'
+        replayed_df.to_csv(replay_filename, index=False)
+        print('    Wrote: ', replay_filename)
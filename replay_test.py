@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import config_util
+import data_logger
+import replay
+import util
+from exoboot import Exo
+
+
+class Test_Replay(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        # 30 s of walking at 200 Hz, with a gyro peak every 1.1 s
+        data = Exo.DataContainer()
+        loop_time = np.arange(0, 30, 0.005)
+        gait_phase = (loop_time/1.1) % 1
+        gyro_z = 250*np.exp(-((gait_phase - 0.5)/0.04)**2)
+        self.df = pd.DataFrame({name: 0 for name in data.field_names}, index=loop_time)
+        self.df['state_time'] = loop_time
+        self.df['loop_time'] = loop_time
+        self.df['gyro_z'] = gyro_z
+        self.df['slack'] = None
+        self.csv_filename = os.path.join(self.folder.name, 'test_LEFT.csv')
+        self.df.to_csv(self.csv_filename, index=False)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_replay_is_independent_of_wall_time(self):
+        config = config_util.ConfigurableConstants(READ_ONLY=True, PRINT_HS=False)
+        replayed_df = replay.replay(filenames=[self.csv_filename], config=config)[0]
+        self.assertEqual(len(replayed_df), len(self.df))
+        # One heel strike per stride, HS_GYRO_DELAY after the (filtered) gyro peak
+        heel_strike_times = replayed_df.loop_time[replayed_df.did_heel_strike].to_numpy()
+        self.assertEqual(len(heel_strike_times), 27)
+        np.testing.assert_allclose(np.diff(heel_strike_times), 1.1, atol=0.006)
+        # Gait phase starts after NUM_STRIDES_REQUIRED good strides
+        first_gait_phase_index = replayed_df.gait_phase.first_valid_index()
+        self.assertGreater(replayed_df.loop_time[first_gait_phase_index],
+                           heel_strike_times[config.NUM_STRIDES_REQUIRED - 1])
+        self.assertIs(util._time_source, util.time.perf_counter)  # Restored
+
+        # Binary logs replay the same
+        bin_filename = os.path.join(self.folder.name, 'test_LEFT.bin')
+        logger = data_logger.RingBufferLogger(
+            filename=bin_filename, field_names=list(self.df.columns),
+            field_kinds=list(Exo.DataContainer().field_kinds), capacity=len(self.df) + 1)
+        for row in self.df.itertuples(index=False):
+            logger.append(row)
+        logger.close()
+        replayed_bin_df = replay.replay(filenames=[bin_filename], config=config)[0]
+        pd.testing.assert_frame_equal(replayed_df, replayed_bin_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
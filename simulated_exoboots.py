@@ -1,26 +1,267 @@
-import exoboot
-import config_util
-import constants
+'''Simulated exoboots, for running and benchmarking the full loop without actpacks.
+
+SimulatedFlexSEA is a drop-in replacement for Dephy's FlexSEA object (exoboot.fxs), which is
+swapped in with exoboot.use_simulated_flexsea() (or DO_SIMULATE_EXOS in the config). Each
+simulated actpack replays a canned gait cycle of ankle angle and IMU data, and a simple
+motor/cable model responds to motor commands:
+    - The cable is taut when the motor reaches the zero-slack angle for the current ankle
+      angle. The motor cannot go past it (the ankle backdrives the motor instead).
+    - Position and impedance commands move the motor toward their setpoint, and current and
+      voltage commands that reel in move it toward the zero-slack angle, with a first order
+      lag and a max speed.
+    - Current is only produced once the cable is taut (or by the impedance/position controller).
+The exo torque does not change the ankle kinematics. Raw values are returned in Dephy's units
+and orientation, i.e., the inverse of the conversions in Exo.read_data().
+
+Run this file to print a few Jetson messages built from simulated exo data:
+    python simulated_exoboots.py
+'''
+import math
+import threading
+import time
+
 import numpy as np
+from flexsea import fxEnums as fxe
+from scipy import interpolate
+
+import constants
+import exoboot
 import ml_util
+import util
+
+# One gait cycle, starting at heel strike. Ankle angle (deg) is positive = plantarflexion.
+GAIT_PHASE_PTS = np.array([0, 0.1, 0.45, 0.62, 0.7, 0.85, 1])
+ANKLE_ANGLE_PTS = np.array([2, 6, -10, 15, 18, 0, 2])
+INITIAL_SLACK = 5000  # motor counts
+MOTOR_TIME_CONSTANT = 0.01  # s
+MAX_MOTOR_SPEED = 100000  # motor counts/s
+VOLTAGE_TO_STALL_CURRENT = 2  # mA/mV, when the cable is taut
+MAX_SIMULATED_CURRENT = 30000  # mA
+BATTERY_VOLTAGE = 36000  # mV
+
+
+def get_gait_cycle_tables():
+    '''Returns lookup tables of (ankle angle, gyro_z, accel_y) as functions of gait phase.'''
+    ankle_angle_table = util.LookupTable(
+        function=interpolate.PchipInterpolator(GAIT_PHASE_PTS, ANKLE_ANGLE_PTS),
+        x_min=0, x_max=1, step=0.001)
+
+    def gyro_z(gait_phase):
+        # Forward rotation of the foot before heel strike (the peak the heel strike detector
+        # looks for), and backward rotation after push off
+        return (250*np.exp(-((gait_phase - 0.97)/0.04)**2) +
+                250*np.exp(-((gait_phase + 0.03)/0.04)**2) -
+                200*np.exp(-((gait_phase - 0.75)/0.07)**2))
+    gyro_z_table = util.LookupTable(function=gyro_z, x_min=0, x_max=1, step=0.001)
+    accel_y_table = util.LookupTable(function=lambda gait_phase: 1 + 0.3*np.sin(
+        4*np.pi*gait_phase), x_min=0, x_max=1, step=0.001)  # g
+    return ankle_angle_table, gyro_z_table, accel_y_table
+
+
+class SimulatedActpackData():
+    '''Looks like the actpack data returned by fxs.read_device().'''
+    __slots__ = ('state_time', 'temperature', 'accelx', 'accely', 'accelz', 'gyrox', 'gyroy',
+                 'gyroz', 'mot_ang', 'mot_vel', 'mot_cur', 'ank_ang', 'batt_volt')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class SimulatedActpack():
+    def __init__(self,
+                 side: constants.Side,
+                 gait_period: float,
+                 phase_offset: float,
+                 motor_offset: float,
+                 gait_cycle_tables):
+        '''Replays gait kinematics for one exo, and integrates its motor/cable model.
+
+        Args:
+            side: constants.Side
+            gait_period: duration (s) of each stride
+            phase_offset: gait phase at time 0
+            motor_offset: the true motor offset, which standing calibration should find
+            gait_cycle_tables: from get_gait_cycle_tables()'''
+        self.side = side
+        if side == constants.Side.LEFT:
+            self.motor_sign = -1
+            ankle_to_motor_angle_polynomial = constants.LEFT_ANKLE_TO_MOTOR
+            self.ankle_angle_offset = constants.LEFT_ANKLE_ANGLE_OFFSET
+        else:
+            self.motor_sign = 1
+            ankle_to_motor_angle_polynomial = constants.RIGHT_ANKLE_TO_MOTOR
+            self.ankle_angle_offset = constants.RIGHT_ANKLE_ANGLE_OFFSET
+        self.ankle_to_motor_angle_table = exoboot.get_ankle_to_motor_lookup_table(
+            ankle_to_motor_angle_polynomial)
+        self.ankle_angle_table, self.gyro_z_table, self.accel_y_table = gait_cycle_tables
+        self.gait_period = gait_period
+        self.phase_offset = phase_offset
+        self.motor_offset = motor_offset
+        self.ctrl_mode = fxe.FX_NONE
+        self.command_value = 0
+        self.gains = {'kp': 0, 'ki': 0, 'kd': 0, 'k_val': 0, 'b_val': 0, 'ff': 0}
+        self.freq = None
+        self.t0 = None
+        self.sample_index = 0
+        self.ankle_angle = self.ankle_angle_table(phase_offset)
+        self.motor_angle = (self.get_zero_slack_motor_angle(self.ankle_angle) -
+                            self.motor_sign*INITIAL_SLACK)
+        self.data = SimulatedActpackData()
+        self.data.batt_volt = BATTERY_VOLTAGE
+        self.data.temperature = 30
+
+    def get_zero_slack_motor_angle(self, ankle_angle: float) -> float:
+        return self.ankle_to_motor_angle_table(ankle_angle) + self.motor_offset
+
+    def start_streaming(self, freq: float):
+        self.freq = freq
+        self.t0 = time.perf_counter()
+        self.sample_index = 0
+        self._step(dt=0)
+
+    def read(self) -> SimulatedActpackData:
+        '''Returns the most recent streamed sample, which updates at the streaming freq.'''
+        if self.t0 is None:
+            return self.data
+        sample_index = int((time.perf_counter() - self.t0)*self.freq)
+        if sample_index > self.sample_index:
+            dt = (sample_index - self.sample_index)/self.freq
+            self.sample_index = sample_index
+            self._step(dt=dt)
+        return self.data
+
+    def _step(self, dt: float):
+        t = self.sample_index/self.freq
+        gait_phase = (t/self.gait_period + self.phase_offset) % 1
+        ankle_angle = self.ankle_angle_table(gait_phase)
+        zero_slack_motor_angle = self.get_zero_slack_motor_angle(ankle_angle)
+        is_reeling_in = self.motor_sign*self.command_value > 0
+        if self.ctrl_mode in (fxe.FX_POSITION, fxe.FX_IMPEDANCE):
+            target_motor_angle = self.command_value
+        elif self.ctrl_mode in (fxe.FX_CURRENT, fxe.FX_VOLTAGE) and is_reeling_in:
+            target_motor_angle = zero_slack_motor_angle
+        else:
+            target_motor_angle = self.motor_angle
+
+        last_motor_angle = self.motor_angle
+        max_step = MAX_MOTOR_SPEED*dt
+        motor_step = (target_motor_angle - self.motor_angle) * \
+            (1 - math.exp(-dt/MOTOR_TIME_CONSTANT))
+        self.motor_angle += min(max(motor_step, -max_step), max_step)
+        # Slack (positive = actual slack) cannot be negative, so the ankle backdrives the motor
+        is_taut = self.motor_sign*(zero_slack_motor_angle - self.motor_angle) <= 0
+        if is_taut:
+            self.motor_angle = zero_slack_motor_angle
+
+        if self.ctrl_mode == fxe.FX_CURRENT:
+            motor_current = self.command_value if is_taut else 0.1*self.command_value
+        elif self.ctrl_mode == fxe.FX_VOLTAGE:
+            motor_current = VOLTAGE_TO_STALL_CURRENT*self.command_value if is_taut else 0
+        elif self.ctrl_mode == fxe.FX_IMPEDANCE:
+            motor_current = (self.gains['k_val']*constants.DEPHY_K_CONSTANT *
+                             (self.command_value - self.motor_angle))
+        elif self.ctrl_mode == fxe.FX_POSITION:
+            motor_current = (self.gains['kp']*constants.DEPHY_K_CONSTANT *
+                             (self.command_value - self.motor_angle))
+        else:
+            motor_current = 0
+        motor_current = min(max(motor_current, -MAX_SIMULATED_CURRENT), MAX_SIMULATED_CURRENT)
+        if dt > 0:
+            motor_velocity = (self.motor_angle - last_motor_angle)/dt  # counts/s
+        else:
+            motor_velocity = 0
+
+        # Inverse of the conversions in Exo.read_data()
+        self.data.state_time = int(1000*t)
+        self.data.ank_ang = int(round((ankle_angle - self.ankle_angle_offset) /
+                                      (-1*self.motor_sign*constants.ENC_CLICKS_TO_DEG)))
+        self.data.gyroz = int(self.motor_sign*self.gyro_z_table(gait_phase)/constants.GYRO_GAIN)
+        self.data.accely = int(-1*self.accel_y_table(gait_phase)/constants.ACCEL_GAIN)
+        self.data.mot_ang = int(self.motor_angle)
+        self.data.mot_vel = int(motor_velocity*constants.ENC_CLICKS_TO_DEG /
+                                constants.DEPHY_VEL_TO_MOTOR_VEL)
+        self.data.mot_cur = int(motor_current)
+        self.ankle_angle = ankle_angle
+
+
+class SimulatedFlexSEA():
+    def __init__(self,
+                 sides=(constants.Side.LEFT, constants.Side.RIGHT),
+                 gait_period: float = 1.1,
+                 io_time: float = 0):
+        '''Drop-in replacement for Dephy's FlexSEA object, backed by SimulatedActpacks.
+
+        Ports are assigned to sides in the order they are opened, and each side gets the first
+        dev_id listed for it in constants.
+
+        Args:
+            sides: sides of the actpacks that can be opened
+            gait_period: duration (s) of each simulated stride
+            io_time: time (s) that each read and command blocks for, like serial I/O'''
+        self.sides = list(sides)
+        self.gait_period = gait_period
+        self.io_time = io_time
+        self.gait_cycle_tables = get_gait_cycle_tables()
+        self.actpacks = {}
+        self.open_lock = threading.Lock()  # Ports can be opened from several threads at once
+
+    def open(self, port, baud_rate, log_level=3) -> int:
+        with self.open_lock:
+            if len(self.actpacks) >= len(self.sides):
+                raise IOError('No simulated actpack left to open on port: ', port)
+            side = self.sides[len(self.actpacks)]
+            if side == constants.Side.LEFT:
+                dev_id = constants.LEFT_EXO_DEV_IDS[0]
+            else:
+                dev_id = constants.RIGHT_EXO_DEV_IDS[0]
+            self.actpacks[dev_id] = SimulatedActpack(
+                side=side, gait_period=self.gait_period,
+                phase_offset=0.5*len(self.actpacks),  # Legs are half a stride apart
+                motor_offset=10000*(len(self.actpacks) + 1),
+                gait_cycle_tables=self.gait_cycle_tables)
+        return dev_id
+
+    def start_streaming(self, dev_id, freq, log_en=False):
+        self.actpacks[dev_id].start_streaming(freq=freq)
+
+    def read_device(self, dev_id) -> SimulatedActpackData:
+        if self.io_time:
+            time.sleep(self.io_time)
+        return self.actpacks[dev_id].read()
+
+    def send_motor_command(self, dev_id, ctrl_mode, value):
+        if self.io_time:
+            time.sleep(self.io_time)
+        actpack = self.actpacks[dev_id]
+        actpack.ctrl_mode = ctrl_mode
+        actpack.command_value = value
+
+    def set_gains(self, dev_id, kp, ki, kd, k_val, b_val, ff):
+        if self.io_time:
+            time.sleep(self.io_time)
+        self.actpacks[dev_id].gains = {'kp': kp, 'ki': ki, 'kd': kd,
+                                       'k_val': k_val, 'b_val': b_val, 'ff': ff}
+
+    def stop_streaming(self, dev_id):
+        self.actpacks[dev_id].t0 = None
+
+    def close(self, dev_id):
+        del self.actpacks[dev_id]
+
+
+if __name__ == '__main__':
+    exoboot.use_simulated_flexsea()
+    jetson_interface = ml_util.JetsonInterface(do_set_up_server=False)
+    exo_list = []
+    for port in ['/dev/ttyACM0', '/dev/ttyACM1']:
+        dev_id = exoboot.fxs.open(port, constants.DEFAULT_BAUD_RATE)
+        exoboot.fxs.start_streaming(dev_id=dev_id, freq=200)
+        exo_list.append(exoboot.Exo(dev_id=dev_id, max_allowable_current=0))
 
-exo_list = []
-for side in [constants.Side.LEFT, constants.Side.RIGHT]:
-    exo_list.append(exoboot.Exo(
-        dev_id=None, max_allowable_current=0))
-    exo_list[-1].side = side
-
-
-for i in range(10):
-    for exo in exo_list:
-        exo.data.accel_x = np.random.rand()
-        exo.data.accel_y = np.random.rand()
-        exo.data.accel_z = np.random.rand()
-        exo.data.gyro_x = np.random.rand()
-        exo.data.gyro_y = np.random.rand()
-        exo.data.gyro_z = np.random.rand()
-        exo.data.ankle_angle = np.random.rand()
-        exo.data.ankle_velocity = np.random.rand()
-        message = ml_util.get_data_string_for_jetson(
-            side=exo.side, data=exo.data)
-        print(message)
+    for i in range(10):
+        time.sleep(0.05)
+        for exo in exo_list:
+            exo.read_data()
+            message = jetson_interface.package_message(side=exo.side, data=exo.data)
+            print(message)
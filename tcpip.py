@@ -2,6 +2,42 @@ import socket
 import select
 
 
+class FrameBuffer(object):
+    '''Reassembles fixed size frames from a TCP byte stream.
+
+    TCP can split one send across several recv() calls, or merge several sends into one, so
+    frames are only returned once all of their bytes have arrived. Every frame starts with
+    magic; if the stream is ever out of step (e.g., a client restarted mid frame), bytes are
+    dropped up to the next magic.'''
+
+    def __init__(self, frame_size: int, magic: bytes):
+        self.frame_size = frame_size
+        self.magic = magic
+        self.buffer = bytearray()
+        self.num_bytes_dropped = 0
+
+    def add(self, data: bytes) -> list:
+        '''Adds newly received bytes, and returns a list of the complete frames.'''
+        if not self.buffer and len(data) == self.frame_size and data.startswith(self.magic):
+            return [data]  # The usual case: exactly one whole frame
+        self.buffer += data
+        frames = []
+        start = 0
+        while len(self.buffer) - start >= self.frame_size:
+            if self.buffer.startswith(self.magic, start):
+                frames.append(bytes(self.buffer[start:start+self.frame_size]))
+                start += self.frame_size
+            else:
+                next_start = self.buffer.find(self.magic, start + 1)
+                if next_start == -1:
+                    # Keep a possible partial magic at the end
+                    next_start = len(self.buffer) - len(self.magic) + 1
+                self.num_bytes_dropped += next_start - start
+                start = next_start
+        del self.buffer[:start]
+        return frames
+
+
 class ServerTCP(object):
     def __init__(self, server_ip, recv_port):
         self.SERVER_IP = server_ip
@@ -11,27 +47,51 @@ class ServerTCP(object):
     def close(self):
         self.recv_conn.close()
 
-    def from_client(self):
-        if select.select([self.recv_conn], [], [], 0.0001)[0]:
+    def from_client(self, timeout=0.0001):
+        if select.select([self.recv_conn], [], [], timeout)[0]:
             return self.recv_conn.recv(8192).decode()
         else:
             return ''
 
+    def from_client_bytes(self, timeout=0.0001) -> bytes:
+        '''Like from_client, but returns undecoded bytes, e.g. to pass to a FrameBuffer.
+        Waits up to timeout (s) for data. Raises ConnectionError if the client disconnected.'''
+        if select.select([self.recv_conn], [], [], timeout)[0]:
+            data = self.recv_conn.recv(8192)
+            if not data:
+                raise ConnectionError('Client closed the connection')
+            return data
+        else:
+            return b''
+
     def to_client(self, msg):
-        self.recv_conn.sendall(msg.encode())
+        '''msg can be a str, or bytes (e.g., struct-packed messages).'''
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.recv_conn.sendall(msg)
         return
 
     def start_server(self):
-        recv_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        recv_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        recv_socket.bind((self.SERVER_IP, self.RECV_PORT))
-        recv_socket.listen(1)
+        self.start_listening()
+        self.accept_client()
+        self.listen_socket.close()
+        return
+
+    def start_listening(self):
+        '''Binds and listens. If RECV_PORT is 0, it is set to the port the OS picked.'''
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((self.SERVER_IP, self.RECV_PORT))
+        self.RECV_PORT = self.listen_socket.getsockname()[1]
+        self.listen_socket.listen(1)
+
+    def accept_client(self):
+        '''Waits for a client to connect. Can be called again after the client disconnects.'''
         print('\nWaiting for client to connect.')
-        self.recv_conn, recv_addr = recv_socket.accept()
-        recv_socket.close()
+        self.recv_conn, recv_addr = self.listen_socket.accept()
+        self.recv_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print('Client connected!')
-        return
 
 
 class ClientTCP(object):
@@ -44,18 +104,38 @@ class ClientTCP(object):
     def close(self):
         self.recv_conn.close()
 
-    def from_server(self):
-        if select.select([self.recv_conn], [], [], 0.0001)[0]:
-            return self.recv_conn.recv(8192).decode()
+    def from_server(self, timeout=0.0001):
+        '''Waits up to timeout (s) for data. Raises ConnectionError if the server disconnected.'''
+        if select.select([self.recv_conn], [], [], timeout)[0]:
+            data = self.recv_conn.recv(8192)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            return data.decode()
         else:
             return ''
 
+    def from_server_bytes(self, timeout=0.0001) -> bytes:
+        '''Like from_server, but returns undecoded bytes, e.g. to pass to a FrameBuffer.
+        Waits up to timeout (s) for data. Raises ConnectionError if the server disconnected.'''
+        if select.select([self.recv_conn], [], [], timeout)[0]:
+            data = self.recv_conn.recv(8192)
+            if not data:
+                raise ConnectionError('Server closed the connection')
+            return data
+        else:
+            return b''
+
     def to_server(self, msg):
-        self.recv_conn.sendall(msg.encode())
+        '''msg can be a str, or bytes (e.g., struct-packed messages).'''
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.recv_conn.sendall(msg)
         return
 
     def start_client(self):
         self.recv_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Messages are small and sent every tick, so don't let Nagle's algorithm hold them
+        self.recv_conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.recv_conn.connect((self.SERVER_IP, self.RECV_PORT))
 
 
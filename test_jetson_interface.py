@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 import numpy as np
 import ml_util
@@ -9,8 +10,14 @@ df = pd.read_csv('20210727_1253_S01_T04_LEFT_processed.csv')
 df['gp_jetson'] = 0
 df['ss_jetson'] = 0
 
+# Use --server_ip 127.0.0.1 to test against jetson_server.py on this machine
+parser = argparse.ArgumentParser()
+parser.add_argument('--server_ip', type=str, default='192.168.1.2')
+parser.add_argument('--port', type=int, default=8080)
+args = parser.parse_args()
+
 jetson_interface = ml_util.JetsonInterface(
-    server_ip='192.168.1.2', recv_port=8080)
+    server_ip=args.server_ip, recv_port=args.port)
 data_container = exoboot.Exo.DataContainer()
 
 for idx, row in df.iterrows():
@@ -1,7 +1,39 @@
 import sys
 import os
+import csv
 import time
+from typing import List
+import numpy as np
 import constants
+import data_logger
+
+
+class VirtualClock():
+    '''A clock that only moves when it is set, e.g., to replay logged data faster than real time.'''
+
+    def __init__(self, start_time: float = 0):
+        self.time = start_time
+
+    def __call__(self) -> float:
+        return self.time
+
+    def set_time(self, new_time: float):
+        self.time = new_time
+
+
+# Time source for the timers, estimators, and controllers. Replaced with set_time_source().
+_time_source = time.perf_counter
+
+
+def get_time() -> float:
+    '''Returns the current time (s) from the time source (time.perf_counter by default).'''
+    return _time_source()
+
+
+def set_time_source(time_source=time.perf_counter):
+    '''Sets the function get_time() calls, e.g., a VirtualClock. Call with no args to reset.'''
+    global _time_source
+    _time_source = time_source
 
 
 class DelayTimer():
@@ -19,17 +51,17 @@ class DelayTimer():
 
     def start(self):
         '''Starts the timer.'''
-        self.start_time = time.perf_counter()
+        self.start_time = get_time()
 
     def check(self):
         '''Depending on true_until, will either go True when time is hit, or go False when time is hit.'''
         if self.true_until:
-            if self.start_time is not None and time.perf_counter() < self.start_time + self.delay_time:
+            if self.start_time is not None and get_time() < self.start_time + self.delay_time:
                 return True
             else:
                 return False
         else:
-            if self.start_time is not None and time.perf_counter() > self.start_time + self.delay_time:
+            if self.start_time is not None and get_time() >= self.start_time + self.delay_time:
                 return True
             else:
                 return False
@@ -38,23 +70,47 @@ class DelayTimer():
         self.start_time = None
 
     def get_time(self):
-        return time.perf_counter() - self.start_time
+        return get_time() - self.start_time
 
 
 class FlexibleTimer():
-    '''A timer that attempts to reach consistent desired freq by variable pausing.'''
+    '''A timer that attempts to reach consistent desired freq by variable pausing.
 
-    def __init__(self, target_freq):
+    Ticks are scheduled against absolute deadlines, so a late tick is followed by a shorter one
+    and the average frequency does not drift. With do_sleep=True, the timer sleeps until
+    spin_time before each deadline and only busy-waits for the remainder, which frees the CPU
+    for other threads (keyboard, Jetson socket, data logger) and the OS.'''
+
+    def __init__(self, target_freq, do_sleep: bool = False, spin_time: float = 0.0005,
+                 max_num_periods: int = 200000):
+        '''
+        Args:
+            target_freq: desired loop frequency (Hz)
+            do_sleep: whether to sleep for most of each period, instead of busy-waiting
+            spin_time: time (s) before each deadline to stop sleeping and busy-wait instead
+            max_num_periods: how many recent periods are kept for the period statistics
+        '''
         self.target_period = 1/target_freq
+        self.do_sleep = do_sleep
+        self.spin_time = spin_time
         self.last_time = time.perf_counter()
+        self.next_time = self.last_time + self.target_period
         self.over_time = 0
         self.warning_timer = DelayTimer(delay_time=3)
         self.do_count_errors = True
+        self.periods = np.zeros(max_num_periods)
+        self.num_periods = 0
+        self.num_late = 0
+        self.num_resyncs = 0
 
     def pause(self):
         '''main function for keeping timer constant.'''
+        now = time.perf_counter()
+        is_late = now > self.next_time
+        if is_late:
+            self.num_late += 1
         if self.do_count_errors:
-            if time.perf_counter()-self.last_time > self.target_period:
+            if is_late:
                 # Penalty for cycle going over time
                 self.over_time += 1
             else:
@@ -74,6 +130,185 @@ class FlexibleTimer():
                 self.do_count_errors = True
 
         # Main logic
-        while time.perf_counter()-self.last_time < self.target_period:
+        if self.do_sleep:
+            sleep_time = self.next_time - now - self.spin_time
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+        while time.perf_counter() < self.next_time:
             pass
+        now = time.perf_counter()
+        self.periods[self.num_periods % len(self.periods)] = now - self.last_time
+        self.num_periods += 1
+        self.last_time = now
+        self.next_time += self.target_period
+        if self.next_time < now:
+            # More than a period behind: start a new schedule rather than running fast to catch up
+            self.next_time = now + self.target_period
+            self.num_resyncs += 1
+
+    def get_period_stats(self) -> dict:
+        '''Returns statistics (periods in ms) of the most recent max_num_periods periods.'''
+        periods = 1000*self.periods[:min(self.num_periods, len(self.periods))]
+        stats = {'target_period': 1000*self.target_period,
+                 'num_periods': self.num_periods,
+                 'num_late': self.num_late,
+                 'num_resyncs': self.num_resyncs}
+        if len(periods) == 0:
+            return stats
+        stats['mean'] = np.mean(periods)
+        stats['min'] = np.min(periods)
+        for percentile in [50, 90, 99, 99.9]:
+            stats['p' + str(percentile)] = np.percentile(periods, percentile)
+        stats['max'] = np.max(periods)
+        return stats
+
+    def print_period_stats(self):
+        print('Loop period stats (ms): ', ', '.join(
+            '%s=%.4g' % (key, value) for key, value in self.get_period_stats().items()))
+
+    def write_period_stats(self, filename: str):
+        '''Writes the period statistics to a one-row csv.'''
+        stats = self.get_period_stats()
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=stats.keys())
+            writer.writeheader()
+            writer.writerow(stats)
+
+
+class StageProfiler():
+    '''Times the stages of each loop tick, e.g., to see which stage made the loop miss its period.
+
+    Each stage's durations are counted in a fixed-bin histogram, so memory use does not grow and
+    percentiles can be read at any time. Optionally, every tick's stage durations are also
+    traced to a binary log (see data_logger.py), which is converted to csv on close().'''
+
+    def __init__(self, stage_names: List[str], bin_width: float = 0.00002,
+                 max_time: float = 0.02, trace_filename: str = None):
+        '''
+        Args:
+            stage_names: names of the stages, in the order they run each tick
+            bin_width: histogram bin width (s)
+            max_time: durations at or above this (s) are counted in the last bin
+            trace_filename: if not None, binary file to trace every tick's stage durations to
+        '''
+        self.stage_names = list(stage_names)
+        self.stage_indices = {name: i for i, name in enumerate(self.stage_names)}
+        self.bin_width = bin_width
+        self.num_bins = int(round(max_time/bin_width)) + 1
+        self.counts = [[0]*self.num_bins for _ in self.stage_names]
+        self.total_times = [0.0]*len(self.stage_names)
+        self.max_times = [0.0]*len(self.stage_names)
+        self.tick_times = [0.0]*len(self.stage_names)
+        self.num_ticks = 0
+        self.last_time = time.perf_counter()
+        if trace_filename is not None:
+            self.trace_logger = data_logger.RingBufferLogger(
+                filename=trace_filename, field_names=['loop_time'] + self.stage_names,
+                field_kinds=['float']*(len(self.stage_names) + 1),
+                name='stage-trace-thread')
+        else:
+            self.trace_logger = None
+
+    def start_tick(self):
+        for i in range(len(self.tick_times)):
+            self.tick_times[i] = 0.0  # Stages skipped this tick are traced as 0
         self.last_time = time.perf_counter()
+
+    def end_stage(self, stage_name: str):
+        '''Records the time since the previous stage ended (or the tick started).'''
+        now = time.perf_counter()
+        self.record(stage_name, now - self.last_time)
+        self.last_time = now
+
+    def record(self, stage_name: str, duration: float):
+        i = self.stage_indices[stage_name]
+        self.counts[i][min(int(duration/self.bin_width), self.num_bins - 1)] += 1
+        self.total_times[i] += duration
+        if duration > self.max_times[i]:
+            self.max_times[i] = duration
+        self.tick_times[i] = duration
+
+    def end_tick(self, loop_time: float):
+        self.num_ticks += 1
+        if self.trace_logger is not None:
+            self.trace_logger.append([loop_time] + self.tick_times)
+
+    def get_percentile(self, stage_name: str, percentile: float) -> float:
+        '''Returns the percentile (s) of a stage's durations, to within one bin_width.'''
+        counts = np.array(self.counts[self.stage_indices[stage_name]])
+        if np.sum(counts) == 0:
+            return None
+        bin_index = np.searchsorted(np.cumsum(counts), percentile/100*np.sum(counts))
+        return (bin_index + 1)*self.bin_width  # Upper edge of the bin
+
+    def get_stats(self) -> dict:
+        '''Returns {stage_name: {stat_name: value}}, with times in ms.'''
+        stats = {}
+        for i, stage_name in enumerate(self.stage_names):
+            num_samples = sum(self.counts[i])
+            if num_samples == 0:
+                continue
+            stats[stage_name] = {'num_samples': num_samples,
+                                 'mean': 1000*self.total_times[i]/num_samples,
+                                 'p50': 1000*self.get_percentile(stage_name, 50),
+                                 'p99': 1000*self.get_percentile(stage_name, 99),
+                                 'max': 1000*self.max_times[i]}
+        return stats
+
+    def print_stats(self):
+        print('Loop stage times (ms):')
+        for stage_name, stage_stats in self.get_stats().items():
+            print('    %-12s' % stage_name, ', '.join(
+                '%s=%.4g' % (key, value) for key, value in stage_stats.items()))
+
+    def close(self):
+        '''Finishes the trace (if any) and converts it to csv.'''
+        if self.trace_logger is not None:
+            self.trace_logger.close()
+            data_logger.convert_log_to_csv(self.trace_logger.filename)
+
+
+class LookupTable():
+    '''A dense, uniformly sampled table of function values, with linear interpolation.
+
+    Scalar lookups use plain python floats (no NumPy or scipy dispatch), so they are much
+    cheaper than evaluating the original function. Inputs outside [x_min, x_max] are clamped.'''
+
+    def __init__(self, function, x_min: float, x_max: float, step: float):
+        '''
+        Args:
+            function: callable that accepts a NumPy array of x values, e.g., a scipy interpolator
+            x_min: smallest x value in the table
+            x_max: largest x value in the table
+            step: approximate spacing between table points. Rounded so x_max is a table point.
+        '''
+        if x_max <= x_min:
+            raise ValueError('x_max must be greater than x_min')
+        num_points = int(round((x_max - x_min)/step)) + 1
+        self.x_min = x_min
+        self.x_max = x_max
+        self.x = np.linspace(x_min, x_max, num_points)
+        self.y = np.asarray(function(self.x), dtype=float)
+        self._inv_step = (num_points - 1)/(x_max - x_min)
+        self._last_index = num_points - 1
+        self._slope = np.append(np.diff(self.y), 0.0)
+        # Python lists are faster than NumPy arrays for indexing single values
+        self._y_list = self.y.tolist()
+        self._slope_list = self._slope.tolist()
+
+    def __call__(self, x: float) -> float:
+        '''Fast scalar lookup.'''
+        position = (x - self.x_min)*self._inv_step
+        if position <= 0:
+            return self._y_list[0]
+        elif position >= self._last_index:
+            return self._y_list[-1]
+        index = int(position)
+        return self._y_list[index] + (position - index)*self._slope_list[index]
+
+    def lookup_array(self, x) -> np.ndarray:
+        '''Vectorized lookup, for arrays of x values.'''
+        position = np.clip((np.asarray(x, dtype=float) - self.x_min)*self._inv_step,
+                           0, self._last_index)
+        index = position.astype(int)
+        return self.y[index] + (position - index)*self._slope[index]
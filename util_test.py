@@ -1,7 +1,11 @@
+import os
+import tempfile
 import unittest
 import util
+import data_logger
 import time
 import random
+import numpy as np
 from matplotlib import pyplot as plt
 
 
@@ -26,6 +30,22 @@ class Test_timer(unittest.TestCase):
         plt.plot(vals2)
         plt.show()
 
+    def test_delay_timer_with_virtual_clock(self):
+        clock = util.VirtualClock(start_time=10)
+        util.set_time_source(clock)
+        try:
+            delay_timer = util.DelayTimer(delay_time=0)
+            delay_timer.start()
+            self.assertTrue(delay_timer.check())  # Fires on the same tick
+            delay_timer = util.DelayTimer(delay_time=0.05)
+            delay_timer.start()
+            clock.set_time(10.04)
+            self.assertFalse(delay_timer.check())
+            clock.set_time(10.05)
+            self.assertTrue(delay_timer.check())
+        finally:
+            util.set_time_source()
+
     # def test_single_time(self):
     #     custom_timer = util.FlexibleTimer(target_freq=2)
     #     t0 = time.time()
@@ -50,6 +70,63 @@ class Test_timer(unittest.TestCase):
     #     plt.plot(periods)
     #     plt.show()
 
+    def test_flexible_timer_absolute_deadlines(self):
+        for do_sleep in [False, True]:
+            custom_timer = util.FlexibleTimer(target_freq=200, do_sleep=do_sleep)
+            first_deadline = custom_timer.next_time
+            t0 = time.perf_counter()
+            cpu_t0 = time.process_time()
+            for i in range(100):
+                if i == 50:
+                    time.sleep(0.0075)  # One late tick, followed by a short one
+                custom_timer.pause()
+            elapsed = time.perf_counter() - t0
+            cpu_time = time.process_time() - cpu_t0
+            stats = custom_timer.get_period_stats()
+            self.assertEqual(stats['num_periods'], 100)
+            self.assertAlmostEqual(stats['p50'], 5, delta=0.2)
+            if stats['num_resyncs'] == 0:
+                # Deadlines are absolute, so the late tick did not push back the schedule
+                self.assertAlmostEqual(custom_timer.next_time - first_deadline, 0.5)
+            self.assertAlmostEqual(elapsed, 0.5, delta=0.05)
+            if do_sleep:
+                self.assertLess(cpu_time, 0.5*elapsed)
+
+
+class Test_StageProfiler(unittest.TestCase):
+
+    def test_histogram_stats(self):
+        profiler = util.StageProfiler(stage_names=['read_data', 'detect'], bin_width=0.0001,
+                                      max_time=0.01)
+        for i in range(100):
+            profiler.record('read_data', 0.00105 if i < 99 else 0.05)
+            profiler.end_tick(loop_time=i)
+        stats = profiler.get_stats()
+        self.assertNotIn('detect', stats)  # Never recorded
+        self.assertEqual(stats['read_data']['num_samples'], 100)
+        self.assertAlmostEqual(stats['read_data']['p50'], 1.1)  # Upper edge of the bin
+        self.assertAlmostEqual(stats['read_data']['max'], 50)
+        # Durations past max_time are counted in the last bin
+        self.assertEqual(profiler.counts[0][-1], 1)
+
+    def test_trace(self):
+        with tempfile.TemporaryDirectory() as folder:
+            trace_filename = os.path.join(folder, 'test_STAGES.bin')
+            profiler = util.StageProfiler(stage_names=['read_data', 'detect'],
+                                          trace_filename=trace_filename)
+            for i in range(5):
+                profiler.start_tick()
+                profiler.end_stage('read_data')
+                if i % 2:
+                    profiler.end_stage('detect')
+                profiler.end_tick(loop_time=0.005*i)
+            profiler.close()
+            samples, _ = data_logger.load_log(trace_filename)
+            self.assertListEqual(samples['loop_time'].tolist(), [0.005*i for i in range(5)])
+            self.assertListEqual((samples['detect'] > 0).tolist(),
+                                 [False, True, False, True, False])
+            self.assertTrue(os.path.exists(os.path.join(folder, 'test_STAGES.csv')))
+
 
 if __name__ == '__main__':
     unittest.main()